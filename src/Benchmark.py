@@ -0,0 +1,351 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+import Toolpath
+from Image_processor import ImageProcessor
+from Tumour import Tumour
+from Calibration import CalibrationTransform
+from Simulation import SimulatedRig, FIDUCIALS
+
+CROP_PARAMS = (65, 275, 130, 500)
+
+class SyntheticInputs:
+    """
+    Fixed synthetic inputs for the benchmarks, built on first use and shared between stages.
+
+    The silhouette stack is rendered from the simulated rig phantom, one frame per degree. The
+    voxel model is a lattice ellipsoid whose longest axis spans `model_size` voxels.
+
+    Attributes:
+        angles (int): Number of frames in the silhouette stack.
+        model_size (int): Voxels along the longest axis of the model.
+        path_strategy (str): Toolpath strategy used for the path preparation stage.
+    """
+
+    def __init__(self, angles=180, model_size=80, path_strategy='serpentine'):
+        self.angles = angles
+        self.model_size = model_size
+        self.path_strategy = path_strategy
+        self._cache = {}
+
+    def _cached(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    @property
+    def frames(self):
+        """list: BGR frames of the phantom, one per degree."""
+        def build():
+            rig = SimulatedRig(scene='phantom')
+            return [rig.render(0, angle) for angle in range(self.angles)]
+        return self._cached('frames', build)
+
+    @property
+    def contours(self):
+        """list: Tumour contour of every frame."""
+        def build():
+            processor = ImageProcessor()
+            return [processor.find_tumour(crop_params=CROP_PARAMS, image=frame.copy())[1] for frame in self.frames]
+        return self._cached('contours', build)
+
+    @property
+    def model(self):
+        """tuple: Voxel coordinates of shape (n, 3) and the model center."""
+        def build():
+            a, b, c = self.model_size / 2, 0.7 * self.model_size / 2, 0.8 * self.model_size / 2
+            x, y, z = np.mgrid[-a:a + 1, -b:b + 1, -c:c + 1].reshape(3, -1)
+            inside = (x / a) ** 2 + (y / b) ** 2 + (z / c) ** 2 <= 1
+            center = np.array([185.0, 105.0])
+            coordinates = np.column_stack((x[inside] + center[0], y[inside], z[inside] + center[1]))
+            return coordinates.astype(np.float64), center
+        return self._cached('model', build)
+
+    @property
+    def slices(self):
+        """dict: Slices of the model in its initial pose."""
+        return self._cached('slices', lambda: Tumour(*self.model).generate_slices())
+
+    @property
+    def transform(self):
+        """CalibrationTransform: Pixel to voltage mapping matching the simulated rig."""
+        def build():
+            rig = SimulatedRig()
+            centroids = np.array(FIDUCIALS, dtype=np.float64).reshape(3, 3, 2)
+            voltages = (np.linalg.solve(rig.galvo_matrix, (centroids.reshape(-1, 2) - rig.galvo_offset).T).T).reshape(3, 3, 2)
+            return CalibrationTransform(centroids, voltages, (130, 65))
+        return self._cached('transform', build)
+
+
+def bench_find_tumour(inputs):
+    """ImageProcessor.find_tumour over the silhouette stack."""
+    frames = inputs.frames
+    processor = ImageProcessor()
+
+    def run():
+        for frame in frames:
+            processor.find_tumour(crop_params=CROP_PARAMS, image=frame.copy())
+    return run, len(frames), 'frames'
+
+def bench_add_silhouette(inputs):
+    """SilhouetteTo3D.add_silhouette, one contour at a time."""
+    from Model_generator import SilhouetteTo3D
+    contours = inputs.contours
+
+    def run():
+        s23 = SilhouetteTo3D()
+        for theta, contour in enumerate(contours):
+            s23.add_silhouette(contour, theta)
+    return run, sum(len(contour) for contour in contours), 'points'
+
+def bench_add_silhouettes(inputs):
+    """SilhouetteTo3D.add_silhouettes, the whole stack in one batch."""
+    from Model_generator import SilhouetteTo3D
+    contours = inputs.contours
+
+    def run():
+        SilhouetteTo3D().add_silhouettes(contours)
+    return run, sum(len(contour) for contour in contours), 'points'
+
+def bench_convert_coordinates(inputs):
+    """SilhouetteTo3D.convert_coordinates of the batched point cloud."""
+    from Model_generator import SilhouetteTo3D
+    s23 = SilhouetteTo3D()
+    s23.add_silhouettes(inputs.contours)
+
+    def run():
+        s23.convert_coordinates()
+    return run, len(s23.points), 'points'
+
+def bench_generate_solid(inputs):
+    """SilhouetteTo3D.generate_solid (delaunay_3d + voxelize) of the point cloud."""
+    from Model_generator import SilhouetteTo3D
+    s23 = SilhouetteTo3D()
+    s23.add_silhouettes(inputs.contours)
+    s23.convert_coordinates()
+
+    def run():
+        s23.generate_solid()
+    return run, len(s23.points_cloud), 'points'
+
+def bench_rotate_tumour(inputs):
+    """Tumour.rotate_tumour by 36 degrees."""
+    tumour = Tumour(*inputs.model)
+
+    def run():
+        tumour.rotate_tumour(36)
+    return run, len(tumour.coordinates), 'points'
+
+def bench_generate_slices(inputs):
+    """Tumour.generate_slices of the model."""
+    tumour = Tumour(*inputs.model)
+
+    def run():
+        tumour.generate_slices()
+    return run, len(tumour.coordinates), 'points'
+
+def bench_paint_path(inputs):
+    """Per-slice work of LaserPainter.paint_tumour before streaming: path planning, mapping and encoding."""
+    from Painter import LaserPainter
+    slices = list(inputs.slices.values())
+    transform = inputs.transform
+
+    def run():
+        for points in slices:
+            coordinates, _ = Toolpath.plan_path(points, inputs.path_strategy)
+            voltages = transform(coordinates)
+            LaserPainter.encode_axis(voltages[:, 0])
+            LaserPainter.encode_axis(voltages[:, 1])
+    return run, sum(len(points) for points in slices), 'points'
+
+BENCHMARKS = {
+    'find_tumour': bench_find_tumour,
+    'add_silhouette': bench_add_silhouette,
+    'add_silhouettes': bench_add_silhouettes,
+    'convert_coordinates': bench_convert_coordinates,
+    'generate_solid': bench_generate_solid,
+    'rotate_tumour': bench_rotate_tumour,
+    'generate_slices': bench_generate_slices,
+    'paint_path': bench_paint_path,
+}
+
+def measure(run, repeat=3, min_time=0.05):
+    """
+    Times a benchmark and measures its peak memory.
+
+    Like timeit, each timed run calls the stage as many times as it takes to last `min_time`, so
+    short stages are not lost in timer noise. One more call under tracemalloc gives the peak of the
+    memory allocated by the stage.
+
+    Args:
+        run (callable): The stage.
+        repeat (int): Number of timed runs. Defaults to 3.
+        min_time (float): Minimum duration of a timed run, in seconds. Defaults to 0.05.
+
+    Returns:
+        dict: Best and mean seconds per call, calls per timed run and peak memory in MB.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        times.append((time.perf_counter() - start) / number)
+
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': min(times), 'mean_seconds': float(np.mean(times)), 'number': number, 'peak_memory_mb': peak / 2 ** 20}
+
+def run_benchmarks(names=None, angles=180, model_size=80, path_strategy='serpentine', repeat=3, verbose=False):
+    """
+    Runs the benchmarks on fixed synthetic inputs.
+
+    Args:
+        names (list, optional): Benchmarks to run. Defaults to all of BENCHMARKS.
+        angles (int): Frames in the silhouette stack. Defaults to 180.
+        model_size (int): Voxels along the longest axis of the model. Defaults to 80.
+        path_strategy (str): Toolpath strategy of the path preparation stage. Defaults to 'serpentine'.
+        repeat (int): Timed runs per benchmark. Defaults to 3.
+        verbose (bool): If True, prints each result as it is measured.
+
+    Returns:
+        dict: The parameters and environment under 'meta' and, under 'stages', the timings, item count,
+              throughput in items per second and peak memory of every stage, or its error.
+    """
+    inputs = SyntheticInputs(angles, model_size, path_strategy)
+    results = {
+        'meta': {
+            'angles': angles,
+            'model_size': model_size,
+            'path_strategy': path_strategy,
+            'repeat': repeat,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+        },
+        'stages': {},
+    }
+
+    for name in names or BENCHMARKS:
+        try:
+            run, items, unit = BENCHMARKS[name](inputs)
+            result = measure(run, repeat)
+        except Exception as e:
+            # A stage whose dependency is missing or broken is reported instead of ending the run
+            result = {'error': f"{type(e).__name__}: {e}"}
+        else:
+            result.update({'items': items, 'unit': unit, 'throughput': items / result['seconds'] if result['seconds'] > 0 else float('inf')})
+
+        results['stages'][name] = result
+        if verbose:
+            print(format_result(name, result))
+
+    return results
+
+def format_result(name, result):
+    """
+    Formats one stage result as a line.
+
+    Args:
+        name (str): The stage.
+        result (dict): Its result from run_benchmarks.
+
+    Returns:
+        str: The line.
+    """
+    if 'error' in result:
+        return f"{name:<20} error: {result['error']}"
+    return (f"{name:<20} {result['seconds'] * 1000:10.2f} ms {result['throughput']:14.0f} {result['unit']}/s "
+            f"{result['peak_memory_mb']:10.1f} MB")
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Compares results against a baseline.
+
+    A stage regresses when its throughput drops, or its peak memory grows, by more than `tolerance`,
+    or when it now fails although it ran in the baseline.
+
+    Args:
+        results (dict): Results from run_benchmarks.
+        baseline (dict): Earlier results, e.g. loaded from a stored JSON file.
+        tolerance (float): Allowed relative change. Defaults to 0.1.
+
+    Returns:
+        dict: For every stage present in both, the throughput and memory ratios to the baseline
+              and whether it regressed. A stage that now fails has its error instead of the ratios.
+    """
+    comparison = {}
+    for name, result in results['stages'].items():
+        reference = baseline.get('stages', {}).get(name)
+        if reference is None or 'error' in reference:
+            continue
+        if 'error' in result:
+            comparison[name] = {'error': result['error'], 'regressed': True}
+            continue
+        speed = result['throughput'] / reference['throughput']
+        memory = result['peak_memory_mb'] / reference['peak_memory_mb'] if reference['peak_memory_mb'] > 0 else 1.0
+        comparison[name] = {
+            'throughput_ratio': speed,
+            'memory_ratio': memory,
+            'regressed': speed < 1 - tolerance or memory > 1 + tolerance,
+        }
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time each pipeline stage on fixed synthetic inputs.")
+    parser.add_argument('stages', nargs='*', help=f"Stages to run, from {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--angles', type=int, default=180, help="Frames in the silhouette stack")
+    parser.add_argument('--model-size', type=int, default=80, help="Voxels along the longest axis of the model")
+    parser.add_argument('--path-strategy', default='serpentine', choices=Toolpath.STRATEGIES)
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per stage")
+    parser.add_argument('--output', help="Write the results as JSON to this file (default: stdout)")
+    parser.add_argument('--baseline', help="Compare against results stored by an earlier run")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed relative slowdown or memory growth")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.stages if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown stage {', '.join(unknown)}")
+
+    results = run_benchmarks(args.stages, args.angles, args.model_size, args.path_strategy, args.repeat, verbose=bool(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            results['comparison'] = compare(results, json.load(file), args.tolerance)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        regressions = [name for name, entry in results['comparison'].items() if entry['regressed']]
+        for name, entry in results['comparison'].items():
+            if 'error' in entry:
+                print(f"{name:<20} error: {entry['error']}  REGRESSION", file=sys.stderr)
+                continue
+            print(f"{name:<20} throughput x{entry['throughput_ratio']:.2f}, memory x{entry['memory_ratio']:.2f}"
+                  f"{'  REGRESSION' if entry['regressed'] else ''}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
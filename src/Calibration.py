@@ -0,0 +1,302 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+
+class CalibrationTransform:
+    """
+    Pixel to galvo voltage mapping, fitted once from the calibration data.
+
+    The X and Y voltages are each a linear function of the corresponding pixel coordinate,
+    fitted over the 3x3 grid of centroids and fine-tuned voltages. The fitted slopes and
+    intercepts are kept so that whole coordinate arrays are mapped in one vectorized call.
+
+    Attributes:
+        slope (numpy.ndarray): Volts per pixel for the X and Y axes.
+        intercept (numpy.ndarray): Voltage at pixel 0 for the X and Y axes.
+    """
+
+    def __init__(self, centroids, voltages, centroid_shift=(0, 0)):
+        """
+        Fits the mapping.
+
+        Args:
+            centroids (numpy.ndarray): 3x3x2 grid of centroid pixel coordinates. Left untouched.
+            voltages (numpy.ndarray): 3x3x2 grid of the matching X and Y voltages (the fine grid).
+            centroid_shift (tuple): Offset subtracted from the centroids, e.g. the tumour crop origin.
+        """
+        pixels = np.array(centroids, dtype=np.float64).reshape(-1, 2) - np.asarray(centroid_shift, dtype=np.float64)
+        volts = np.asarray(voltages, dtype=np.float64).reshape(-1, 2)
+
+        # Least-squares line per axis, the same fit as LinearRegression without importing scikit-learn
+        (slope_x, intercept_x), (slope_y, intercept_y) = (np.polyfit(pixels[:, axis], volts[:, axis], 1) for axis in (0, 1))
+
+        self.slope = np.array([slope_x, slope_y])
+        self.intercept = np.array([intercept_x, intercept_y])
+
+    @classmethod
+    def from_files(cls, centroid_shift=(0, 0), calibration_file="data/calibration_data.pkl", centroids_file="data/centroids_data.pkl"):
+        """
+        Builds the mapping from the saved calibration and centroid data.
+
+        Args:
+            centroid_shift (tuple): Offset subtracted from the centroids.
+            calibration_file (str): Pickle written by LaserPainter.save_calibration_data.
+            centroids_file (str): Pickle written by LaserPainter.compute_centroids.
+
+        Returns:
+            CalibrationTransform: The fitted mapping.
+        """
+        with open(calibration_file, "rb") as file:
+            voltages = pickle.load(file)['fine_grid']
+        with open(centroids_file, "rb") as file:
+            centroids = pickle.load(file)
+        return cls(centroids, voltages, centroid_shift)
+
+    def __call__(self, coordinates):
+        """
+        Maps pixel coordinates to galvo voltages.
+
+        Args:
+            coordinates (numpy.ndarray): Array of shape (n, 2) with x, y pixel coordinates.
+
+        Returns:
+            numpy.ndarray: Array of shape (n, 2) with the X and Y voltages.
+        """
+        return np.asarray(coordinates, dtype=np.float64)[:, :2] * self.slope + self.intercept
+
+
+class CalibrationLUT:
+    """
+    Dense pixel to galvo voltage lookup table over the camera frame.
+
+    The X and Y voltages are fitted over the 3x3 grid of centroids and fine-tuned voltages as
+    functions of both pixel coordinates, so coupling between the axes is captured, and tabulated
+    once for every pixel. Mapping coordinates is then a gather from the table, bilinearly
+    interpolated between pixels. Coordinates outside the frame take the value at its edge.
+
+    A saved table is accompanied by a JSON sidecar with the method and a hash of the calibration it
+    was built from, so that a stale table can be detected (see is_current).
+
+    Attributes:
+        table (numpy.ndarray): Array of shape (height, width, 2) with the X and Y voltages of every pixel.
+        centroid_shift (numpy.ndarray): Offset added to the coordinates before the lookup, e.g. the tumour crop origin.
+        method (str): Interpolation the table was built with, or None if unknown.
+        source (str): Hash of the centroids, voltages and frame shape it was built from (see source_hash), or None.
+    """
+
+    METHODS = ('bilinear', 'thin_plate')
+
+    def __init__(self, table, centroid_shift=(0, 0), method=None, source=None):
+        """
+        Wraps a table.
+
+        Args:
+            table (numpy.ndarray): Array of shape (height, width, 2), possibly memory-mapped.
+            centroid_shift (tuple): Offset added to the coordinates before the lookup.
+            method (str, optional): Interpolation the table was built with.
+            source (str, optional): Hash of the calibration it was built from.
+        """
+        self.table = table
+        self.centroid_shift = np.asarray(centroid_shift, dtype=np.float64)
+        self.method = method
+        self.source = source
+
+    @staticmethod
+    def source_hash(centroids, voltages, frame_shape=(480, 640)):
+        """
+        Hashes the calibration a table is built from.
+
+        Args:
+            centroids (numpy.ndarray): 3x3x2 grid of centroid pixel coordinates.
+            voltages (numpy.ndarray): 3x3x2 grid of the matching voltages.
+            frame_shape (tuple): Height and width of the camera frame.
+
+        Returns:
+            str: Hex digest.
+        """
+        digest = hashlib.sha256()
+        digest.update(np.ascontiguousarray(centroids, dtype=np.float64).tobytes())
+        digest.update(np.ascontiguousarray(voltages, dtype=np.float64).tobytes())
+        digest.update(repr(tuple(int(size) for size in frame_shape[:2])).encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def metadata_file(filename):
+        """
+        Returns:
+            str: The JSON sidecar of a saved table, e.g. data/calibration_lut.json.
+        """
+        return os.path.splitext(filename)[0] + '.json'
+
+    @classmethod
+    def build(cls, centroids, voltages, frame_shape=(480, 640), method='bilinear', centroid_shift=(0, 0)):
+        """
+        Fits the mapping and tabulates it over the frame.
+
+        Args:
+            centroids (numpy.ndarray): 3x3x2 grid of centroid pixel coordinates in the full frame.
+            voltages (numpy.ndarray): 3x3x2 grid of the matching X and Y voltages (the fine grid).
+            frame_shape (tuple): Height and width of the camera frame. Defaults to (480, 640).
+            method (str): 'bilinear' (least squares a + bx + cy + dxy per axis) or 'thin_plate'
+                          (thin-plate spline through the 9 points). Defaults to 'bilinear'.
+            centroid_shift (tuple): Offset added to the coordinates before the lookup.
+
+        Returns:
+            CalibrationLUT: The tabulated mapping.
+        """
+        pixels = np.asarray(centroids, dtype=np.float64).reshape(-1, 2)
+        volts = np.asarray(voltages, dtype=np.float64).reshape(-1, 2)
+        height, width = frame_shape[:2]
+
+        # Work in frame-normalized coordinates to keep the systems well conditioned
+        scale = float(max(height, width))
+        points = pixels / scale
+        xs = np.arange(width) / scale
+        ys = np.arange(height) / scale
+
+        table = np.empty((height, width, 2), dtype=np.float32)
+
+        if method == 'bilinear':
+            design = np.column_stack((np.ones(len(points)), points[:, 0], points[:, 1], points[:, 0] * points[:, 1]))
+            coefficients = np.linalg.lstsq(design, volts, rcond=None)[0]
+            gx, gy = xs[None, :], ys[:, None]
+            for axis in range(2):
+                a, b, c, d = coefficients[:, axis]
+                table[:, :, axis] = a + b * gx + c * gy + d * gx * gy
+        elif method == 'thin_plate':
+            n = len(points)
+            kernel = _thin_plate_kernel(np.linalg.norm(points[:, None] - points[None, :], axis=2))
+            affine = np.column_stack((np.ones(n), points))
+            system = np.zeros((n + 3, n + 3))
+            system[:n, :n] = kernel
+            system[:n, n:] = affine
+            system[n:, :n] = affine.T
+            rhs = np.zeros((n + 3, 2))
+            rhs[:n] = volts
+            solution = np.linalg.solve(system, rhs)
+            weights, (a, b, c) = solution[:n], solution[n:]
+
+            # One row of the frame at a time keeps the kernel matrix small
+            for row, y in enumerate(ys):
+                distances = np.hypot(xs[:, None] - points[None, :, 0], y - points[None, :, 1])
+                table[row] = _thin_plate_kernel(distances) @ weights + a + b * xs[:, None] + c * y
+        else:
+            raise ValueError(f"Unknown calibration mapping '{method}', choose from {', '.join(cls.METHODS)}")
+
+        return cls(table, centroid_shift, method, cls.source_hash(centroids, voltages, frame_shape))
+
+    @classmethod
+    def from_files(cls, frame_shape=(480, 640), method='bilinear', centroid_shift=(0, 0),
+                   calibration_file="data/calibration_data.pkl", centroids_file="data/centroids_data.pkl"):
+        """
+        Builds the table from the saved calibration and centroid data.
+
+        Args:
+            frame_shape (tuple): Height and width of the camera frame.
+            method (str): 'bilinear' or 'thin_plate'.
+            centroid_shift (tuple): Offset added to the coordinates before the lookup.
+            calibration_file (str): Pickle written by LaserPainter.save_calibration_data.
+            centroids_file (str): Pickle written by LaserPainter.compute_centroids.
+
+        Returns:
+            CalibrationLUT: The tabulated mapping.
+        """
+        with open(calibration_file, "rb") as file:
+            voltages = pickle.load(file)['fine_grid']
+        with open(centroids_file, "rb") as file:
+            centroids = pickle.load(file)
+        return cls.build(centroids, voltages, frame_shape, method, centroid_shift)
+
+    def save(self, filename="data/calibration_lut.npy"):
+        """
+        Saves the table and its metadata sidecar.
+
+        Args:
+            filename (str): Destination, next to the calibration data by default.
+        """
+        np.save(filename, np.ascontiguousarray(self.table))
+        with open(self.metadata_file(filename), 'w') as file:
+            json.dump({'method': self.method, 'source': self.source}, file)
+
+    @classmethod
+    def is_current(cls, filename, centroids, voltages, method, frame_shape=(480, 640)):
+        """
+        Whether a saved table was built with `method` from this calibration.
+
+        Args:
+            filename (str): Table written by save.
+            centroids (numpy.ndarray): 3x3x2 grid of centroid pixel coordinates.
+            voltages (numpy.ndarray): 3x3x2 grid of the matching voltages.
+            method (str): 'bilinear' or 'thin_plate'.
+            frame_shape (tuple): Height and width of the camera frame.
+
+        Returns:
+            bool: False if the table or its sidecar is missing or either differs.
+        """
+        try:
+            with open(cls.metadata_file(filename)) as file:
+                metadata = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        return (os.path.exists(filename) and metadata.get('method') == method
+                and metadata.get('source') == cls.source_hash(centroids, voltages, frame_shape))
+
+    @classmethod
+    def load(cls, filename="data/calibration_lut.npy", centroid_shift=(0, 0)):
+        """
+        Memory-maps a saved table.
+
+        Args:
+            filename (str): Table written by save.
+            centroid_shift (tuple): Offset added to the coordinates before the lookup.
+
+        Returns:
+            CalibrationLUT: The mapping.
+        """
+        try:
+            with open(cls.metadata_file(filename)) as file:
+                metadata = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            metadata = {}
+        return cls(np.load(filename, mmap_mode='r'), centroid_shift, metadata.get('method'), metadata.get('source'))
+
+    def __call__(self, coordinates):
+        """
+        Maps pixel coordinates to galvo voltages.
+
+        Args:
+            coordinates (numpy.ndarray): Array of shape (n, 2) with x, y pixel coordinates.
+
+        Returns:
+            numpy.ndarray: Array of shape (n, 2) with the X and Y voltages.
+        """
+        height, width = self.table.shape[:2]
+        pixels = np.asarray(coordinates, dtype=np.float64)[:, :2] + self.centroid_shift
+
+        x = np.clip(pixels[:, 0], 0, width - 1)
+        y = np.clip(pixels[:, 1], 0, height - 1)
+        x0 = np.minimum(x.astype(np.intp), width - 2)
+        y0 = np.minimum(y.astype(np.intp), height - 2)
+        fx = (x - x0)[:, None]
+        fy = (y - y0)[:, None]
+
+        table = self.table
+        return ((table[y0, x0] * (1 - fx) + table[y0, x0 + 1] * fx) * (1 - fy)
+                + (table[y0 + 1, x0] * (1 - fx) + table[y0 + 1, x0 + 1] * fx) * fy)
+
+
+def _thin_plate_kernel(distances):
+    """
+    Thin-plate spline radial basis r^2 log r, with 0 at r = 0.
+
+    Args:
+        distances (numpy.ndarray): Distances r.
+
+    Returns:
+        numpy.ndarray: The kernel values.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = distances ** 2 * np.log(distances)
+    return np.nan_to_num(values, nan=0.0)
@@ -1,8 +1,292 @@
 import cv2
+import time
+import queue
+import threading
+import Tracing
+
+# Opens a capture device by index; Simulation.SimulatedRig swaps in simulated cameras
+capture_backend = cv2.VideoCapture
+
+class CameraSession:
+    """A long-lived capture session on a single camera device.
+
+    The device is opened once and a background thread keeps grabbing frames so that
+    the most recent frame is always available without paying the open/negotiate/release
+    cost of ``cv2.VideoCapture`` on every picture.
+
+    Args:
+        camera_number (int): The index of the camera device.
+
+    Attributes:
+        camera_number (int): The index of the camera device.
+        users (int): Number of holders currently sharing this session.
+    """
+    def __init__(self, camera_number):
+        self.camera_number = camera_number
+        self.users = 0
+        self._cap = None
+        self._thread = None
+        self._running = False
+        self._condition = threading.Condition()
+        self._frame = None
+        self._frame_started = 0.0
+        self._frame_time = 0.0
+        # Set, under the condition lock, when the grab thread has exited, and when close left the
+        # device for it to release
+        self._grab_done = False
+        self._release_on_exit = False
+
+    def open(self):
+        """Opens the device and starts the background grab thread.
+
+        Returns:
+            bool: True if the device was opened, False otherwise.
+        """
+        if self._running:
+            return True
+
+        Tracing.count('camera opens')
+        cap = capture_backend(self.camera_number)
+        if not cap.isOpened():
+            print(f"Error: Camera with index {self.camera_number} could not be opened.")
+            cap.release()
+            return False
+
+        # Keep the driver queue short so a grabbed frame is never older than one period
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self._cap = cap
+        self._running = True
+        self._grab_done = False
+        self._release_on_exit = False
+        self._thread = threading.Thread(target=self._grab_loop, args=(cap,), name=f"camera-{self.camera_number}", daemon=True)
+        self._thread.start()
+        return True
+
+    def _grab_loop(self, cap):
+        """Continuously reads frames and publishes the latest one.
+
+        Args:
+            cap (cv2.VideoCapture): The opened device. It is released here if close gave up waiting.
+        """
+        while self._running:
+            started = time.monotonic()
+            ret, frame = cap.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            Tracing.count('camera frames grabbed')
+            with self._condition:
+                self._frame = frame
+                self._frame_started = started
+                self._frame_time = time.monotonic()
+                self._condition.notify_all()
+
+        with self._condition:
+            self._grab_done = True
+            if self._release_on_exit:
+                cap.release()
+            self._condition.notify_all()
+
+    def read_stamped(self, fresh=True, timeout=2.0):
+        """Returns the latest frame together with its capture timestamp.
+
+        Args:
+            fresh (bool, optional): If True, waits for a frame whose exposure started after this call,
+                                    so that changes made just before (a stage or mirror move) are visible.
+                                    Defaults to True.
+            timeout (float, optional): Maximum time to wait for a frame, in seconds. Defaults to 2.0.
+
+        Returns:
+            tuple: (frame, timestamp) where timestamp is the ``time.monotonic()`` midpoint of the exposure,
+                   or (None, None) if no frame arrived in time.
+        """
+        requested = time.monotonic()
+        deadline = requested + timeout
+
+        with self._condition:
+            while self._running:
+                if self._frame is not None and (not fresh or self._frame_started >= requested):
+                    Tracing.count('camera frames captured')
+                    return self._frame.copy(), (self._frame_started + self._frame_time) / 2
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+        return None, None
+
+    def read(self, fresh=True, timeout=2.0):
+        """Returns the latest frame.
+
+        Args:
+            fresh (bool, optional): See ``read_stamped``. Defaults to True.
+            timeout (float, optional): Maximum time to wait for a frame, in seconds. Defaults to 2.0.
+
+        Returns:
+            numpy.ndarray or None: The frame, or None if no frame arrived in time.
+        """
+        return self.read_stamped(fresh, timeout)[0]
+
+    def close(self):
+        """Stops the grab thread and releases the device.
+
+        If the thread is still blocked in a read after two seconds, the device is left for the
+        thread to release when the read returns, since releasing it under a pending read can
+        crash the driver.
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        if self._cap is not None:
+            with self._condition:
+                if self._grab_done:
+                    self._cap.release()
+                else:
+                    self._release_on_exit = True
+            self._cap = None
+        self._frame = None
+
+    def __enter__(self):
+        if not self.open():
+            raise RuntimeError(f"Camera with index {self.camera_number} could not be opened.")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def acquire_session(camera_number):
+    """Returns the shared session for a device index, opening it on first use.
+
+    Every call must be paired with ``release_session``; the device stays open while
+    at least one holder remains.
+
+    Args:
+        camera_number (int): The index of the camera device.
+
+    Returns:
+        CameraSession or None: The shared session, or None if the device could not be opened.
+    """
+    with _sessions_lock:
+        session = _sessions.get(camera_number)
+        if session is None:
+            session = CameraSession(camera_number)
+            if not session.open():
+                return None
+            _sessions[camera_number] = session
+        session.users += 1
+        return session
+
+def release_session(camera_number):
+    """Drops one holder of the shared session and closes the device when none remain.
+
+    Args:
+        camera_number (int): The index of the camera device.
+    """
+    with _sessions_lock:
+        session = _sessions.get(camera_number)
+        if session is None:
+            return
+        session.users -= 1
+        if session.users <= 0:
+            del _sessions[camera_number]
+            session.close()
+
+def wall_time(timestamp):
+    """Converts a capture timestamp from ``read_stamped`` to seconds since the epoch.
+
+    Args:
+        timestamp (float): A ``time.monotonic()`` time.
+
+    Returns:
+        float: The same instant as a ``time.time()`` time.
+    """
+    return time.time() - (time.monotonic() - timestamp)
+
+
+class FrameWriter:
+    """Encodes and writes frames to disk on a background thread.
+
+    Frames are handed over through a bounded queue, so the caller only blocks when the
+    writer falls more than `max_pending` frames behind.
+
+    Args:
+        max_pending (int, optional): Maximum number of frames waiting to be written. Defaults to 16.
+
+    Attributes:
+        written (int): Number of frames written so far.
+        failed (int): Number of frames that could not be written.
+        first_failure (int): Position, in the order the frames were queued, of the first frame that
+                             could not be written, or None.
+    """
+    def __init__(self, max_pending=16):
+        self.written = 0
+        self.failed = 0
+        self.first_failure = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._write_loop, name="frame-writer", daemon=True)
+        self._thread.start()
+
+    def _write_loop(self):
+        """Writes queued frames until the end marker arrives."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            output_name, frame = item
+            try:
+                with Tracing.span('frame write', 'io'):
+                    written = cv2.imwrite(output_name, frame)
+                if written:
+                    self.written += 1
+                else:
+                    self._fail()
+                    print(f"Error: Could not write {output_name}")
+            except Exception as e:
+                self._fail()
+                print(f"An error occurred writing {output_name}: {e}")
+
+    def _fail(self):
+        """Counts the frame being written as failed."""
+        if self.first_failure is None:
+            self.first_failure = self.written + self.failed
+        self.failed += 1
+
+    def write(self, output_name, frame):
+        """Queues a frame to be written.
+
+        Args:
+            output_name (str): The file path to save the frame.
+            frame (numpy.ndarray): The frame. It must not be modified afterwards.
+        """
+        self._queue.put((output_name, frame))
+
+    def close(self):
+        """Waits until every queued frame is written and stops the thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 
 class Camera:
     """A class to interact with a camera device using OpenCV.
 
+    Pictures are served from the shared ``CameraSession`` of the device. Using the camera
+    in a 'with' statement keeps that session open for the whole block, so repeated
+    captures do not reopen the device.
+
     Args:
         camera_number (int): The index of the camera device.
 
@@ -11,9 +295,23 @@ class Camera:
 
     Methods:
         take_picture: Captures a picture from the camera.
+        take_stamped_picture: Captures a picture and the time it was captured.
     """
     def __init__(self, camera_number):
         self.camera_number = camera_number
+        self._held = False
+
+    def __enter__(self):
+        """Holds the shared session of the device until the 'with' block exits."""
+        if acquire_session(self.camera_number) is None:
+            raise RuntimeError(f"Camera with index {self.camera_number} could not be opened.")
+        self._held = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._held:
+            self._held = False
+            release_session(self.camera_number)
 
     def take_picture(self, output_name=None, return_image=False):
         """Captures a picture from the camera.
@@ -23,18 +321,17 @@ class Camera:
             return_image (bool, optional): Whether to return the captured image as an array. Defaults to False.
 
         Returns:
-            bool or numpy.ndarray or None: If return_image is False, returns True if the capture was successful, 
+            bool or numpy.ndarray or None: If return_image is False, returns True if the capture was successful,
                                            False otherwise. If return_image is True, returns the captured image as
                                            a numpy array if successful, None otherwise.
         """
-        cap = cv2.VideoCapture(self.camera_number)
-        if not cap.isOpened():
-            print(f"Error: Camera with index {self.camera_number} could not be opened.")
+        session = acquire_session(self.camera_number)
+        if session is None:
             return None if return_image else False
 
         try:
-            ret, frame = cap.read()
-            if not ret:
+            frame = session.read()
+            if frame is None:
                 print("Error: No frame captured from the camera.")
                 return None if return_image else False
 
@@ -52,12 +349,33 @@ class Camera:
             return None if return_image else False
 
         finally:
-            cap.release()
+            release_session(self.camera_number)
+
+    def take_stamped_picture(self):
+        """Captures a picture together with the time it was captured.
+
+        Returns:
+            tuple: (frame, timestamp) with the timestamp in seconds since the epoch, or (None, None)
+                   if no frame was captured.
+        """
+        session = acquire_session(self.camera_number)
+        if session is None:
+            return None, None
+
+        try:
+            frame, timestamp = session.read_stamped()
+            if frame is None:
+                print("Error: No frame captured from the camera.")
+                return None, None
+            return frame, wall_time(timestamp)
+
+        finally:
+            release_session(self.camera_number)
 
 def find_available_cameras(limit=10):
     available_cameras = []
     for i in range(limit):
-        cap = cv2.VideoCapture(i)
+        cap = capture_backend(i)
         if cap.isOpened():
             available_cameras.append(i)
             cap.release()
@@ -70,6 +388,5 @@ if __name__ == '__main__':
 
     # Creating camera instances and taking pictures
     for camera_number in cameras:
-        cam = Camera(camera_number)
-        cam.take_picture(f'images/test/captured_image_{camera_number}.jpg')
-
+        with Camera(camera_number) as cam:
+            cam.take_picture(f'images/test/captured_image_{camera_number}.jpg')
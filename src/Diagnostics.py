@@ -0,0 +1,155 @@
+import os
+import zipfile
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# How diagnostic plots are produced: not at all, after the run with 'Run.py report', or by a worker process during the run
+MODES = ('off', 'report', 'background')
+
+def render_slice(points, filename):
+    """
+    Plots the painted path of a slice, as seen by the laser camera.
+
+    Args:
+        points (numpy.ndarray): Array of shape (n, 2) with the x, y pixel coordinates in painting order.
+        filename (str): Image file to write.
+    """
+    from matplotlib.figure import Figure
+
+    figure = Figure()
+    axes = figure.add_subplot()
+    axes.plot(points[:, 0], points[:, 1])
+    axes.invert_yaxis()
+    figure.savefig(filename)
+
+def render_green_map(samples, filename):
+    """
+    Plots the brightness measured at every galvo position tried for a calibration point.
+
+    Args:
+        samples (numpy.ndarray): Array of shape (n, 3) with the x, y voltages and the brightness.
+        filename (str): PDF file to write.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.colors import Normalize
+
+    figure = Figure()
+    axes = figure.add_subplot()
+    # Normalize the green values to the range [0, 1] for color mapping
+    norm = Normalize(vmin=samples[:, 2].min(), vmax=samples[:, 2].max())
+    scatter = axes.scatter(samples[:, 0], samples[:, 1], c=samples[:, 2], cmap='Greens', norm=norm)
+    figure.colorbar(scatter)
+    axes.set_xlabel('X Coordinate')
+    axes.set_ylabel('Y Coordinate')
+    axes.set_title('Green Map Color Plot')
+    figure.savefig(filename, format='pdf')
+
+RENDERERS = {'slice': render_slice, 'green_map': render_green_map}
+
+def _render(kind, array, filename):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    RENDERERS[kind](array, filename)
+
+class DiagnosticsRecorder:
+    """
+    Records the data behind the diagnostic plots while the device runs, and leaves the plotting for later.
+
+    Every array is appended to an npz archive as soon as it is recorded, under the name
+    '<kind>/<plot file>', so the archive alone is enough to render the plots with render_archive.
+    In 'background' mode the plots are also rendered by a worker process as the data arrives,
+    which keeps matplotlib off the thread that drives the hardware. Workers are spawned rather than
+    forked, so they do not inherit the sockets, serial ports and camera threads of the device.
+
+    Attributes:
+        archive (str): The npz archive.
+        mode (str): 'off', 'report' or 'background'.
+    """
+
+    def __init__(self, archive, mode='report', append=False):
+        """
+        Opens the archive.
+
+        Args:
+            archive (str): The npz archive.
+            mode (str): 'off' (record nothing), 'report' (record only) or 'background' (record and render).
+                        Defaults to 'report'.
+            append (bool): Whether to keep the entries of an earlier run, e.g. when resuming. Defaults to False.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown diagnostics mode '{mode}', choose from {', '.join(MODES)}")
+
+        self.archive = archive
+        self.mode = mode
+        self._zip = None
+        self._pool = None
+
+        if mode != 'off':
+            directory = os.path.dirname(archive)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._zip = zipfile.ZipFile(archive, 'a' if append else 'w')
+            self._names = set(self._zip.namelist())
+        if mode == 'background':
+            self._pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+
+    def record(self, kind, filename, array):
+        """
+        Appends an array to the archive, and renders it in the background if enabled.
+
+        Args:
+            kind (str): 'slice' or 'green_map' (see RENDERERS).
+            filename (str): File the plot is rendered to.
+            array (numpy.ndarray): The data of the plot.
+        """
+        if self._zip is None:
+            return
+
+        name = f"{kind}/{filename}.npy"
+        if name in self._names:
+            # Already recorded by the run being resumed
+            return
+        self._names.add(name)
+
+        array = np.asarray(array)
+        with self._zip.open(name, 'w', force_zip64=True) as entry:
+            np.lib.format.write_array(entry, array, allow_pickle=False)
+
+        if self._pool is not None:
+            self._pool.submit(_render, kind, array, filename)
+
+    def close(self):
+        """Closes the archive and waits for the plots still being rendered."""
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def render_archive(archive, workers=None):
+    """
+    Renders every plot recorded in an archive.
+
+    Args:
+        archive (str): The npz archive written by DiagnosticsRecorder.
+        workers (int, optional): Worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        int: Number of plots rendered.
+    """
+    with np.load(archive) as data:
+        tasks = [(*key.split('/', 1), data[key]) for key in data.files]
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for future in [pool.submit(_render, kind, array, filename) for kind, filename, array in tasks]:
+            future.result()
+    return len(tasks)
@@ -0,0 +1,312 @@
+import os
+import json
+import struct
+import cv2
+import numpy as np
+
+MAGIC = b'FSTACK01'
+ALIGNMENT = 64
+
+class FrameStackWriter:
+    """
+    Writes a tomography acquisition into a single memory-mappable frame-stack file.
+
+    Layout: magic, header length (uint32), JSON header padded to a 64-byte boundary, then
+    the angles (float64), the timestamps (float64) and the frames. Frames are stored raw
+    (uint8, as captured or cropped) or, for 'bits' stacks, as silhouette masks packed to
+    one bit per pixel along each row.
+
+    Attributes:
+        path (str): The file being written.
+        count (int): Number of frames in the stack.
+        kind (str): 'raw' or 'bits'.
+    """
+
+    def __init__(self, path, count, frame_shape=None, kind='raw', crop_params=None, camera_index=None):
+        """
+        Prepares the writer. The file is allocated on the first frame if frame_shape is not given.
+
+        Args:
+            path (str): The file to write.
+            count (int): Number of frames in the stack.
+            frame_shape (tuple, optional): Shape of every frame (height, width[, channels]); for 'bits' the mask shape.
+            kind (str, optional): 'raw' for uint8 frames, 'bits' for packed silhouette masks. Defaults to 'raw'.
+            crop_params (tuple, optional): Crop already applied to the frames, recorded in the header.
+            camera_index (int, optional): Camera that captured the frames, recorded in the header.
+        """
+        if kind not in ('raw', 'bits'):
+            raise ValueError(f"Unknown frame stack kind '{kind}', choose from 'raw', 'bits'")
+
+        self.path = path
+        self.count = count
+        self.kind = kind
+        self.crop_params = crop_params
+        self.camera_index = camera_index
+        self._map = None
+        self._angles = None
+        self._timestamps = None
+        self._frames = None
+
+        if frame_shape is not None:
+            self._allocate(tuple(frame_shape))
+
+    def _allocate(self, frame_shape):
+        """
+        Creates the file and maps its sections.
+
+        Args:
+            frame_shape (tuple): Shape of every frame.
+        """
+        header = {
+            'version': 1,
+            'count': self.count,
+            'kind': self.kind,
+            'frame_shape': list(frame_shape),
+            'crop_params': list(self.crop_params) if self.crop_params is not None else None,
+            'camera_index': self.camera_index,
+        }
+        layout = _layout(header)
+
+        with open(self.path, 'wb') as file:
+            encoded = json.dumps(header).encode('utf-8')
+            file.write(MAGIC + struct.pack('<I', layout['header_length']))
+            file.write(encoded.ljust(layout['header_length'], b' '))
+            file.truncate(layout['size'])
+
+        self._map = np.memmap(self.path, dtype=np.uint8, mode='r+')
+        self._angles, self._timestamps, self._frames = _sections(self._map, header, layout)
+        self._angles[:] = np.nan
+        self._timestamps[:] = np.nan
+
+    def write(self, index, frame, angle=None, timestamp=None):
+        """
+        Stores a frame.
+
+        Args:
+            index (int): Position of the frame in the stack.
+            frame (numpy.ndarray): The frame; for 'bits' stacks a mask where non-zero is inside.
+            angle (float, optional): Angle of the frame in degrees. Defaults to the index.
+            timestamp (float, optional): Capture time (seconds since the epoch). Left unknown (NaN) if not given.
+        """
+        if index >= self.count:
+            return
+
+        if self._map is None:
+            self._allocate(frame.shape)
+
+        if self.kind == 'bits':
+            self._frames[index] = np.packbits(np.asarray(frame) > 0, axis=-1)
+        else:
+            self._frames[index] = frame
+
+        self._angles[index] = index if angle is None else angle
+        if timestamp is not None:
+            self._timestamps[index] = timestamp
+
+    def close(self):
+        """Flushes the stack to disk."""
+        if self._map is not None:
+            self._map.flush()
+            self._map = None
+            self._angles = self._timestamps = self._frames = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class FrameStack:
+    """
+    Read-only, memory-mapped view of a frame-stack file.
+
+    Indexing a 'raw' stack returns zero-copy views into the file. 'bits' stacks are unpacked
+    into uint8 masks (0 or 255) on access; `packed` gives the zero-copy packed rows.
+
+    Attributes:
+        count (int): Number of frames.
+        kind (str): 'raw' or 'bits'.
+        frame_shape (tuple): Shape of every frame.
+        crop_params (tuple): Crop applied to the frames, or None.
+        camera_index (int): Camera that captured the frames, or None.
+        angles (numpy.ndarray): Angle of every frame in degrees, NaN for frames never written.
+        timestamps (numpy.ndarray): Capture time of every frame, NaN if unknown.
+    """
+
+    def __init__(self, path):
+        """
+        Opens a frame stack.
+
+        Args:
+            path (str): The frame-stack file.
+
+        Raises:
+            FileNotFoundError: If the stack was never written, which happens when no frame reached the writer.
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Frame stack {path} was never written")
+
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+
+        if bytes(self._map[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a frame stack")
+
+        header_length = struct.unpack('<I', bytes(self._map[len(MAGIC):len(MAGIC) + 4]))[0]
+        start = len(MAGIC) + 4
+        header = json.loads(bytes(self._map[start:start + header_length]).decode('utf-8'))
+
+        self.count = header['count']
+        self.kind = header['kind']
+        self.frame_shape = tuple(header['frame_shape'])
+        self.crop_params = tuple(header['crop_params']) if header['crop_params'] is not None else None
+        self.camera_index = header['camera_index']
+        self.angles, self.timestamps, self._frames = _sections(self._map, header, _layout(header))
+
+    def __len__(self):
+        return self.count
+
+    def packed(self, index):
+        """
+        Returns the stored frame without unpacking.
+
+        Args:
+            index (int): Position of the frame.
+
+        Returns:
+            numpy.ndarray: View into the file.
+        """
+        return self._frames[index]
+
+    def __getitem__(self, index):
+        if self.kind == 'bits':
+            width = self.frame_shape[1]
+            return np.unpackbits(self._frames[index], axis=-1, count=width) * np.uint8(255)
+        return self._frames[index]
+
+    def __iter__(self):
+        """Yields (angle, frame) for every frame in the stack."""
+        for index in range(self.count):
+            yield self.angles[index], self[index]
+
+
+def _layout(header):
+    """
+    Byte offsets of the sections of a frame stack.
+
+    Args:
+        header (dict): The JSON header.
+
+    Returns:
+        dict: header_length, angles, timestamps and frames offsets, frame_size and total size.
+    """
+    encoded_length = len(json.dumps(header).encode('utf-8'))
+    prefix = len(MAGIC) + 4
+    header_length = _align(prefix + encoded_length) - prefix
+
+    shape = header['frame_shape']
+    if header['kind'] == 'bits':
+        frame_size = shape[0] * ((shape[1] + 7) // 8)
+    else:
+        frame_size = int(np.prod(shape))
+
+    angles = prefix + header_length
+    timestamps = angles + 8 * header['count']
+    frames = _align(timestamps + 8 * header['count'])
+
+    return {
+        'header_length': header_length,
+        'angles': angles,
+        'timestamps': timestamps,
+        'frames': frames,
+        'frame_size': frame_size,
+        'size': frames + frame_size * header['count'],
+    }
+
+def _sections(mapping, header, layout):
+    """
+    Views of the angles, timestamps and frames of a mapped frame stack.
+
+    Args:
+        mapping (numpy.memmap): The whole file as uint8.
+        header (dict): The JSON header.
+        layout (dict): Offsets from _layout.
+
+    Returns:
+        tuple: (angles, timestamps, frames) arrays sharing memory with the file.
+    """
+    count = header['count']
+    shape = header['frame_shape']
+    if header['kind'] == 'bits':
+        frame_shape = (shape[0], (shape[1] + 7) // 8)
+    else:
+        frame_shape = tuple(shape)
+
+    angles = mapping[layout['angles']:layout['timestamps']].view(np.float64)
+    timestamps = mapping[layout['timestamps']:layout['timestamps'] + 8 * count].view(np.float64)
+    frames = mapping[layout['frames']:layout['size']].reshape((count,) + frame_shape)
+    return angles, timestamps, frames
+
+def _align(offset):
+    """
+    Rounds an offset up to the next multiple of ALIGNMENT.
+
+    Args:
+        offset (int): Byte offset.
+
+    Returns:
+        int: The aligned offset.
+    """
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def from_jpeg_folder(folder, path, count=360, kind='raw', crop_params=None, camera_index=0):
+    """
+    Converts a folder of angle_{i}.jpg images into a frame stack.
+
+    Args:
+        folder (str): Folder with the images, e.g. 'images/reconstruction'.
+        path (str): The frame-stack file to write.
+        count (int, optional): Number of angles. Defaults to 360.
+        kind (str, optional): 'raw' to store the (cropped) frames, 'bits' to store the tumour
+                              silhouette masks found by ImageProcessor.find_tumour. Defaults to 'raw'.
+        crop_params (tuple, optional): Crop applied to the frames. Defaults to no crop for 'raw'
+                                       and to the find_tumour crop for 'bits'.
+        camera_index (int, optional): Camera that captured the images. Defaults to 0.
+
+    Returns:
+        FrameStack: The written stack, opened for reading.
+    """
+    if kind == 'bits':
+        from Image_processor import ImageProcessor
+        processor = ImageProcessor()
+        if crop_params is None:
+            crop_params = (65, 275, 130, 500)
+
+    with FrameStackWriter(path, count, kind=kind, crop_params=crop_params, camera_index=camera_index) as writer:
+        for i in range(count):
+            image_path = os.path.join(folder, f'angle_{i}.jpg')
+
+            if kind == 'bits':
+                cropped_image, contour = processor.find_tumour(image_path, crop_params)
+                frame = ImageProcessor.silhouette_mask(contour, cropped_image.shape)
+            else:
+                frame = cv2.imread(image_path)
+                if frame is None:
+                    raise FileNotFoundError(f"Image file not found at {image_path}")
+                if crop_params is not None:
+                    crop_top, crop_bottom, crop_left, crop_right = crop_params
+                    frame = frame[crop_top:crop_bottom, crop_left:crop_right]
+
+            writer.write(i, frame, angle=i, timestamp=os.path.getmtime(image_path))
+
+    return FrameStack(path)
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Usage: python3 Frame_stack.py <image folder> <stack file> [raw|bits]")
+        sys.exit(1)
+
+    stack = from_jpeg_folder(sys.argv[1], sys.argv[2], kind=sys.argv[3] if len(sys.argv) > 3 else 'raw')
+    print(f"Wrote {len(stack)} frames of shape {stack.frame_shape} to {sys.argv[2]}")
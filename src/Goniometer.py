@@ -1,7 +1,13 @@
+import time
 import serial
 import numpy as np
 from Image_processor import ImageProcessor
-from Camera import Camera
+from Camera import Camera, FrameWriter, acquire_session, release_session, wall_time
+from Search import golden_section_maximum
+import Tracing
+
+# Opens the serial port of the controller; Simulation.SimulatedRig swaps in a simulated stage
+serial_backend = serial.Serial
 
 class GoniometerController:
     """
@@ -10,6 +16,9 @@ class GoniometerController:
     Attributes:
         STEPS_PER_DEGREE (int): The number of steps per degree for the goniometer.
         MOVEMENT_INCREMENT (float): The angle increment for movement in degrees.
+        POLL_MIN (float): Shortest interval between motion state queries, in seconds.
+        POLL_MAX (float): Longest interval between motion state queries, in seconds.
+        MOTION_TIMEOUT (float): Seconds a move may take beyond its travel time at full speed.
         port (str): The port to which the goniometer device is connected.
         baud_rate (int): The baud rate for serial communication with the device.
         ser (serial.Serial): The serial connection object.
@@ -18,6 +27,9 @@ class GoniometerController:
 
     STEPS_PER_DEGREE = 12800
     MOVEMENT_INCREMENT = 0.15
+    POLL_MIN = 0.002
+    POLL_MAX = 0.05
+    MOTION_TIMEOUT = 10.0
 
     def __init__(self, port='/dev/ttyUSB0', baud_rate=115200):
         """
@@ -31,12 +43,24 @@ class GoniometerController:
         self.baud_rate = baud_rate
         self.ser = None
         self.processor = ImageProcessor()
+        # Last position read from the controller and target of the current move, in steps
+        self._steps = 0.0
+        self._target = None
+        self._deadline = 0.0
+        # Acceleration and deceleration of the axis in steps per second squared, read on connection
+        self._acc = None
+        self._dec = None
 
     def connect(self):
         """
-        Connects to the goniometer device via serial communication.
+        Connects to the goniometer device via serial communication and prepares it for movement.
+
+        Does nothing if already connected.
         """
-        self.ser = serial.Serial(self.port, self.baud_rate)
+        if self.ser is not None and self.ser.is_open:
+            return
+        self.ser = serial_backend(self.port, self.baud_rate)
+        self._prepare_goniometer()
 
     def disconnect(self):
         """
@@ -58,30 +82,58 @@ class GoniometerController:
         """
         self.disconnect()
 
-    def _parse_state(self, message):
+    def _prepare_goniometer(self):
+        """
+        Prepares the goniometer device for movement, once per connection.
+
+        Enables the servo, sets the motor type and the limit switch configuration, and reads the
+        position that the targets of relative moves are tracked from and the acceleration and
+        deceleration that the move deadlines are computed with.
+        """
+        self._command('SHH', 'MTH = -2', 'CN1')
+        self.position()
+        self._acc, self._dec = (float(value) for value in self._query('MG _ACH, _DCH').split())
+
+    def _command(self, *commands):
+        """
+        Sends commands that only reply with an acknowledgement line, in a single write.
+
+        Args:
+            commands (str): The commands, without line terminator.
+        """
+        Tracing.count('serial round trips', len(commands))
+        self.ser.write(''.join(f'{cmd}\r\n' for cmd in commands).encode('utf-8'))
+        for _ in commands:
+            self.ser.readline()
+
+    def _query(self, command):
         """
-        Parses the state message received from the goniometer device.
+        Sends a query command and returns its value.
 
         Args:
-            message (bytes): The message received from the device.
+            command (str): The query, e.g. 'MG _TPH'.
 
         Returns:
-            int: The parsed state value.
+            str: The value line of the reply.
         """
-        message = message.decode('utf-8').strip()
-        return int(message[0])
+        Tracing.count('serial round trips')
+        self.ser.write(bytes(f'{command}\r\n', 'utf-8'))
+        self.ser.readline()
+        return self.ser.readline().decode('utf-8').strip()
 
-    def _prepare_goniometer(self):
+    def position(self):
         """
-        Prepares the goniometer device for movement.
+        Reads the current position of the goniometer.
+
+        Returns:
+            float: The position in degrees, as counted by the controller.
         """
-        self.ser.write(b'SHH\r\n')
-        self.ser.write(b'MTH = -2\r\n')
-        self.ser.write(b'CN1\r\n')
+        self._steps = float(self._query('MG _TPH'))
+        return self._steps / self.STEPS_PER_DEGREE
 
     def move(self, angle, speed=60000, acc=5000, dec=5000, verbose=False):
         """
-        Moves the goniometer to the specified angle.
+        Moves the goniometer by the specified angle.
 
         Args:
             angle (float): The target angle in degrees.
@@ -90,65 +142,181 @@ class GoniometerController:
             dec (int): The deceleration in steps per second squared (default is 5000).
             verbose (bool): If True, prints verbose output during movement (default is False).
         """
-        self._prepare_goniometer()
-        angle_steps = str(int(angle * self.STEPS_PER_DEGREE))
-        commands = [
-            f'PRH={angle_steps}\r\n',
-            f'SPH={speed}\r\n',
-            # f'ACH={acc}\r\n',
-            # f'DCH={dec}\r\n',
-            f'BGH\r\n',
-            f'MG _BGH\r\n'
-        ]
-
-        for cmd in commands:
-            self.ser.write(bytes(cmd, 'utf-8'))
-
-        for _ in range(len(commands) + 3):
-            self.ser.readline()
+        with Tracing.span('goniometer move', 'hardware', angle=angle):
+            self.start_move(angle, speed, acc, dec)
+            self.wait_for_motion(verbose)
 
-        state = self._parse_state(self.ser.readline())
-        while state == 1:
-            self.ser.write(b'MG _BGH\r\n')
-            self.ser.readline()
-            state = self._parse_state(self.ser.readline())
+    def start_move(self, angle, speed=60000, acc=5000, dec=5000):
+        """
+        Starts a relative move and returns without waiting for it to finish.
+
+        Args:
+            angle (float): The target angle in degrees.
+            speed (int): The movement speed in steps per second (default is 60000).
+            acc (int): The acceleration in steps per second squared (default is 5000).
+            dec (int): The deceleration in steps per second squared (default is 5000).
+        """
+        angle_steps = int(angle * self.STEPS_PER_DEGREE)
+        self._begin(f'PRH={angle_steps}', self._steps + angle_steps, speed)
+
+    def move_to(self, angle, speed=60000, verbose=False):
+        """
+        Moves the goniometer to an absolute angle, as counted by the controller (see position).
+
+        Args:
+            angle (float): The target angle in degrees.
+            speed (int): The movement speed in steps per second (default is 60000).
+            verbose (bool): If True, prints verbose output during movement (default is False).
+        """
+        with Tracing.span('goniometer move', 'hardware', angle=angle):
+            self.start_move_to(angle, speed)
+            self.wait_for_motion(verbose)
+
+    def start_move_to(self, angle, speed=60000):
+        """
+        Starts an absolute move and returns without waiting for it to finish.
+
+        Args:
+            angle (float): The target angle in degrees.
+            speed (int): The movement speed in steps per second (default is 60000).
+        """
+        target = int(angle * self.STEPS_PER_DEGREE)
+        self._begin(f'PAH={target}', target, speed)
+
+    def _begin(self, distance_command, target, speed):
+        """
+        Sends a move and records its target and deadline for wait_for_motion.
+
+        Args:
+            distance_command (str): The PRH or PAH command.
+            target (float): Expected final position in steps.
+            speed (int): The movement speed in steps per second.
+        """
+        # ACH and DCH are left at the controller settings
+        self._command(distance_command, f'SPH={speed}', 'BGH')
+        self._target = target
+        self._deadline = time.monotonic() + self._travel_time(abs(target - self._steps), speed) + self.MOTION_TIMEOUT
+
+    def _travel_time(self, distance, speed):
+        """
+        Duration of a move with a trapezoidal speed profile, or a triangular one if the move is too
+        short to reach the speed.
+
+        Args:
+            distance (float): Length of the move in steps.
+            speed (int): The movement speed in steps per second.
+
+        Returns:
+            float: The duration in seconds.
+        """
+        acc, dec = self._acc, self._dec
+        peak = min(speed, np.sqrt(2 * distance * acc * dec / (acc + dec)))
+        if peak <= 0:
+            return 0.0
+        cruise = max(0.0, distance - peak ** 2 / (2 * acc) - peak ** 2 / (2 * dec)) / peak
+        return peak / acc + cruise + peak / dec
+
+    def stop(self):
+        """
+        Stops the goniometer and waits until it is at rest.
+        """
+        self._command('STH')
+        self._target = None
+        self.wait_for_motion(timeout=self.MOTION_TIMEOUT)
+
+    def wait_for_motion(self, verbose=False, timeout=None):
+        """
+        Waits until the goniometer stops moving.
+
+        The motion state and position are queried together. Between queries the controller is left
+        alone for half the time the axis needs to reach the target at the speed seen since the last
+        query, within POLL_MIN and POLL_MAX, so a move ends at most POLL_MIN late without flooding
+        the controller. Without a target, e.g. when stopping, the interval doubles up to POLL_MAX.
+
+        Args:
+            verbose (bool): If True, prints the motion state while waiting (default is False).
+            timeout (float, optional): Seconds to wait. Defaults to the travel time of the current move,
+                                       ramps included, plus MOTION_TIMEOUT.
+
+        Raises:
+            TimeoutError: If the goniometer is still moving at the deadline. It is stopped first.
+        """
+        deadline = self._deadline if timeout is None else time.monotonic() + timeout
+        interval = self.POLL_MIN / 2
+        previous = None
+        polls = 0
+        while True:
+            state, steps = self._query('MG _BGH, _TPH').split()
+            now = time.monotonic()
+            self._steps = float(steps)
+            polls += 1
             if verbose:
                 print(state)
+            if not int(float(state)):
+                break
+
+            if now > deadline:
+                self._command('STH')
+                raise TimeoutError(f"Goniometer still moving at {self._steps / self.STEPS_PER_DEGREE:.3f} degrees, stopped")
+
+            if self._target is not None and previous is not None and self._steps != previous[1]:
+                remaining = abs(self._target - self._steps) / (abs(self._steps - previous[1]) / (now - previous[0]))
+                interval = min(max(remaining / 2, self.POLL_MIN), self.POLL_MAX)
+            else:
+                interval = min(interval * 2, self.POLL_MAX)
+            previous = (now, self._steps)
+            time.sleep(interval)
 
-    def calibrate_goniometer(self, camera, verbose=False):
+        self._target = None
+        Tracing.count('move poll iterations', polls)
+
+    def calibrate_goniometer(self, camera, verbose=False, method='sweep', span=None, tolerance=None, max_evaluations=15, debug=False):
         """
         Calibrates the goniometer device using image processing.
 
         Args:
             camera (Camera): The camera object for capturing images.
+            verbose (bool, optional): Whether to print progress. Defaults to False.
+            method (str, optional): 'sweep' samples 50 increments on each side and takes the largest area;
+                                    'golden' finds the maximum of the (unimodal) area with a golden-section
+                                    search. Defaults to 'sweep'.
+            span (float, optional): Golden search bracket, in degrees on each side. Defaults to 50 increments.
+            tolerance (float, optional): Golden search precision in degrees. Defaults to MOVEMENT_INCREMENT.
+            max_evaluations (int, optional): Maximum captures of the golden search. Defaults to 15.
+            debug (bool, optional): Whether the golden search writes the contour images. Defaults to False.
 
         Returns:
             float: The calibrated angle for maximum area.
         """
+        if method == 'golden':
+            return self._golden_calibration(camera, verbose, span, tolerance, max_evaluations, debug)
+
         angle = 0
         angle_areas = []
 
         try:
-            print("Adjusting the panels' positioning")
-            for i in range(50):
-                area = self.processor.find_contour(i, camera)
-                angle_areas.append([angle, area])
-                self.move(self.MOVEMENT_INCREMENT)
-                if verbose:
-                    print(i)
-                angle += self.MOVEMENT_INCREMENT
-
-            self.move(-5)
-
-            angle = 0
-
-            for i in range(50):
-                area = self.processor.find_contour(i * -1, camera)
-                angle_areas.append([angle, area])
-                self.move(-self.MOVEMENT_INCREMENT)
-                if verbose:
-                    print(i * -1)
-                angle -= self.MOVEMENT_INCREMENT
+            # Holding the camera keeps one session open across every find_contour call
+            with Camera(camera):
+                print("Adjusting the panels' positioning")
+                for i in range(50):
+                    area = self.processor.find_contour(i, camera)
+                    angle_areas.append([angle, area])
+                    self.move(self.MOVEMENT_INCREMENT)
+                    if verbose:
+                        print(i)
+                    angle += self.MOVEMENT_INCREMENT
+
+                self.move(-5)
+
+                angle = 0
+
+                for i in range(50):
+                    area = self.processor.find_contour(i * -1, camera)
+                    angle_areas.append([angle, area])
+                    self.move(-self.MOVEMENT_INCREMENT)
+                    if verbose:
+                        print(i * -1)
+                    angle -= self.MOVEMENT_INCREMENT
 
             angle_areas = np.array(angle_areas)
             max_index = np.argmax(angle_areas[:, 1])
@@ -167,25 +335,254 @@ class GoniometerController:
             print(f"Error during calibration: {e}")
             # Handle or log the exception as needed
 
-    def perform_tomography(self):
+    def _golden_calibration(self, camera, verbose, span, tolerance, max_evaluations, debug):
+        """
+        Golden-section variant of calibrate_goniometer; see its arguments.
+
+        Returns:
+            float: The calibrated angle for maximum area.
+        """
+        span = 50 * self.MOVEMENT_INCREMENT if span is None else span
+        tolerance = self.MOVEMENT_INCREMENT if tolerance is None else tolerance
+        position = 0
+
+        def area_at(angle):
+            nonlocal position
+            self.move(angle - position)
+            position = angle
+            area = self.processor.find_contour(round(angle / self.MOVEMENT_INCREMENT), camera, save=debug)
+            if verbose:
+                print(f"angle: {angle:.3f}, area: {area}")
+            return area
+
+        try:
+            with Camera(camera):
+                print("Adjusting the panels' positioning")
+                best_angle, best_area, samples = golden_section_maximum(area_at, -span, span, tolerance, max_evaluations)
+
+            self.move(best_angle - position)
+
+            if verbose:
+                print(f"Max area:{best_area}, angle:{best_angle}, captures: {len(samples)}")
+
+            return best_angle
+
+        except Exception as e:
+            print(f"Error during calibration: {e}")
+
+    def fly_scan(self, camera_number=0, degrees_per_second=10.0, frame_rate=20.0, revolution=360,
+                 acc=256000, angle_source='position', output_folder='images/reconstruction', verbose=False,
+                 on_frame=None, save_frames=True):
+        """
+        Acquires a tomography while the goniometer turns continuously at constant speed.
+
+        The stage is jogged at `degrees_per_second` while frames are grabbed at `frame_rate`. Every
+        frame is tagged with its angle, either interpolated from position queries made between
+        frames or computed from its timestamp and the jog speed and acceleration. For each whole
+        degree the closest frame is saved as `angle_{i}.jpg`, the layout used by stepped tomography.
+        Frames are tagged as they are grabbed and only the closest one so far is kept for every
+        degree, so memory is bounded by the number of degrees rather than the number of frames.
+
+        Args:
+            camera_number (int): The index of the tomography camera (default is 0).
+            degrees_per_second (float): Rotation speed in degrees per second (default is 10).
+            frame_rate (float): Frames grabbed per second (default is 20).
+            revolution (float): Angle to cover, in degrees (default is 360).
+            acc (int): The acceleration of the jog in steps per second squared (default is 256000, half a
+                       second to reach 10 degrees per second). The controller setting is restored afterwards.
+            angle_source (str): 'position' to interpolate from MG _TPH queries, 'time' to use
+                                timestamps only (default is 'position').
+            output_folder (str): Folder where the frames are saved (default is 'images/reconstruction').
+            verbose (bool): If True, prints progress (default is False).
+            on_frame (callable): Called with (degree, frame, timestamp) for the frame kept for every whole
+                                 degree, once the scan has finished, with the capture time of the frame in
+                                 seconds since the epoch (default is None).
+            save_frames (bool): If False, the frames are not written to disk (default is True).
+
+        Returns:
+            numpy.ndarray: Tagged angle, in degrees from the start of the scan, of every grabbed frame.
+        """
+        speed = int(degrees_per_second * self.STEPS_PER_DEGREE)
+        ramp_time = speed / acc
+        ramp_angle = 0.5 * acc * ramp_time ** 2 / self.STEPS_PER_DEGREE
+
+        session = acquire_session(camera_number)
+        if session is None:
+            raise RuntimeError(f"Camera with index {camera_number} could not be opened.")
+
+        angles, query_times, query_positions = [], [], []
+        # Closest frame to every whole degree so far. Angles only grow, so the closest frame to a
+        # degree is the last one grabbed before it or the first one after it
+        degrees = int(revolution)
+        kept = [None] * degrees
+        kept_times = [None] * degrees
+        previous = None
+
+        # The jog acceleration only applies to the scan; later moves use the controller setting
+        controller_acc = int(float(self._query('MG _ACH')))
+
+        try:
+            start_position = self.position()
+
+            self._command(f'ACH={acc}', f'JGH={speed}')
+            start = time.monotonic()
+            self._command('BGH')
+
+            if revolution > ramp_angle:
+                duration = ramp_time + (revolution - ramp_angle) / degrees_per_second
+            else:
+                duration = np.sqrt(2 * revolution * self.STEPS_PER_DEGREE / acc)
+            deadline = start
+
+            while True:
+                frame, timestamp = session.read_stamped()
+                if frame is None:
+                    raise RuntimeError("No frame captured from the camera.")
+
+                if angle_source == 'position':
+                    before = time.monotonic()
+                    position = self.position() - start_position
+                    query_times.append((before + time.monotonic()) / 2)
+                    query_positions.append(position)
+                    # The frame was grabbed before this query, so the queries so far bracket it
+                    angle = float(np.interp(timestamp, query_times, query_positions))
+                    done = position >= revolution
+                else:
+                    elapsed = timestamp - start
+                    accelerating = 0.5 * acc * min(elapsed, ramp_time) ** 2 / self.STEPS_PER_DEGREE
+                    angle = accelerating + degrees_per_second * max(elapsed - ramp_time, 0)
+                    done = elapsed >= duration
+                angles.append(angle)
+
+                timestamp = wall_time(timestamp)
+                if previous is None:
+                    for degree in range(min(int(np.ceil(angle)), degrees)):
+                        kept[degree], kept_times[degree] = frame, timestamp
+                else:
+                    previous_angle, previous_frame, previous_time = previous
+                    for degree in range(max(int(np.ceil(previous_angle)), 0), min(int(np.ceil(angle)), degrees)):
+                        if degree - previous_angle <= angle - degree:
+                            kept[degree], kept_times[degree] = previous_frame, previous_time
+                        else:
+                            kept[degree], kept_times[degree] = frame, timestamp
+                previous = (angle, frame, timestamp)
+
+                if verbose:
+                    print(f"Frame {len(angles)}")
+
+                if done:
+                    break
+
+                deadline += 1 / frame_rate
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            self.stop()
+            self._command(f'ACH={controller_acc}')
+            self._acc = controller_acc
+            release_session(camera_number)
+
+        # Degrees beyond the last frame
+        last_angle, last_frame, last_time = previous
+        for degree in range(max(int(np.ceil(last_angle)), 0), degrees):
+            kept[degree], kept_times[degree] = last_frame, last_time
+
+        angles = np.array(angles)
+        with FrameWriter() as writer:
+            for degree, (frame, timestamp) in enumerate(zip(kept, kept_times)):
+                if on_frame is not None:
+                    on_frame(degree, frame, timestamp)
+                if save_frames:
+                    writer.write(f"{output_folder}/angle_{degree}.jpg", frame)
+
+        if save_frames:
+            np.save(f"{output_folder}/fly_scan_angles.npy", angles)
+
+        return angles
+
+    def perform_tomography(self, fly_scan=False, degrees_per_second=10.0, on_frame=None, save_frames=True, checkpoint=None):
         """
         Performs tomography by capturing images at various angles.
 
+        Args:
+            fly_scan (bool): If True, turns continuously instead of stopping at every degree (default is False).
+            degrees_per_second (float): Rotation speed of the fly scan (default is 10).
+            on_frame (callable): Called with (angle index, frame, timestamp) as each frame is captured, e.g. to
+                                 reconstruct while acquiring; the timestamp is the capture time in seconds
+                                 since the epoch (default is None).
+            save_frames (bool): If False, the raw frames are not written to disk (default is True).
+            checkpoint (Pipeline.Checkpoint): Records the starting position and the angles whose frames are
+                                              on disk, and resumes after them if it holds an interrupted
+                                              stepped tomography. Errors are raised instead of printed
+                                              when given (default is None).
+
         Raises:
-            Exception: If an error occurs during the tomography process.
+            Exception: If an error occurs during the tomography process, including a stepped tomography
+                       that could not capture or write the frame of some angle.
         """
-        camera = Camera(0)
-        
         input("Turn on light pannel and press enter")
         print("Performing Tomography")
 
         try:
-            for i in range(360):
-                camera.take_picture(f"images/reconstruction/angle_{i}.jpg")
-                self.move(1)
+            if fly_scan:
+                with Tracing.span('fly scan', degrees_per_second=degrees_per_second):
+                    self.fly_scan(degrees_per_second=degrees_per_second, on_frame=on_frame, save_frames=save_frames)
+            else:
+                # The next move starts as soon as the frame is in memory, while the
+                # writer thread encodes and saves it
+                first = checkpoint.get('angle', 0) if checkpoint is not None else 0
+                if first:
+                    # Go back to the first angle whose frame is not on disk
+                    self.move_to(checkpoint.get('origin') + first)
+                elif checkpoint is not None:
+                    checkpoint.update(origin=self.position())
+
+                queued = []
+                # First angle whose frame could not be captured
+                missed = None
+
+                def on_disk_until(current):
+                    """First angle from which the frames are not known to be on disk."""
+                    # Angles before the oldest frame still waiting for the writer are done,
+                    # unless a frame was lost before it
+                    done = writer.written + writer.failed
+                    angle = queued[done] if done < len(queued) else current
+                    if writer.first_failure is not None:
+                        angle = min(angle, queued[writer.first_failure])
+                    if missed is not None:
+                        angle = min(angle, missed)
+                    return angle
+
+                with Camera(0) as camera, FrameWriter() as writer:
+                    for i in range(first, 360):
+                        with Tracing.span('tomography angle', angle=i):
+                            frame, timestamp = camera.take_stamped_picture()
+                            self.start_move(1)
+                            if frame is not None:
+                                if on_frame is not None:
+                                    on_frame(i, frame, timestamp)
+                                if save_frames:
+                                    writer.write(f"images/reconstruction/angle_{i}.jpg", frame)
+                                    queued.append(i)
+                            elif missed is None:
+                                missed = i
+                            self.wait_for_motion()
+
+                        if checkpoint is not None:
+                            checkpoint.update(angle=on_disk_until(i + 1))
+
+                # Every frame is written once the writer is closed
+                last = on_disk_until(360)
+                if checkpoint is not None:
+                    checkpoint.update(angle=last)
+                if last < 360:
+                    raise RuntimeError(f"The frame of angle {last} was not captured or written, resume to take the frames from it again")
         except Exception as e:
             print(f"Error during tomography: {e}")
             # Handle or log the exception as needed
+            if checkpoint is not None:
+                raise
 
         input("Turn off Light Pannel")
 
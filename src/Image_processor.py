@@ -1,6 +1,9 @@
+import os
 import cv2 as cv
 import outils
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from outils import show_wait_destroy
 from Camera import Camera
 
@@ -37,18 +40,7 @@ class ImageProcessor:
 
         image = self.image
 
-        x, y, w, h = cv.boundingRect(contour)
-
-        # Enlarge the rectangle by the specified percentage
-        enlarge_size = max(w, h) * enlarge_percent / 100
-        x = int(x - enlarge_size / 2)
-        y = int(y - enlarge_size / 2)
-        w = int(w + enlarge_size)
-        h = int(h + enlarge_size)
-
-        # Ensure the rectangle is within image boundaries
-        x, y = max(0, x), max(0, y)
-        w, h = min(w, self.image.shape[1] - x), min(h, self.image.shape[0] - y)
+        x, y, w, h = BrightnessROIs.region(contour, self.image.shape, enlarge_percent)
 
         # Crop and calculate brightness
         cropped_image = self.image[y:y+h, x:x+w]
@@ -95,7 +87,7 @@ class ImageProcessor:
 
         return centroids
 
-    def find_contour(self, index, camera_number, crop_params=(125, 250, 150, 480)):
+    def find_contour(self, index, camera_number, crop_params=(125, 250, 150, 480), save=True):
         """
         Find contours in an image captured by a camera.
 
@@ -103,6 +95,7 @@ class ImageProcessor:
             index (int): Index of the image.
             camera_number (int): Number of the camera.
             crop_params (tuple, optional): Parameters for cropping the image. Defaults to (125, 250, 150, 480).
+            save (bool, optional): Whether to write the image with the contours drawn to images/contours. Defaults to True.
 
         Returns:
             float: Total area of the contours found.
@@ -118,19 +111,19 @@ class ImageProcessor:
 
         contours, hierarchy = cv.findContours(image=thresh, mode=cv.RETR_TREE, method=cv.CHAIN_APPROX_SIMPLE)
 
-        image_copy = img.copy()
-        cv.drawContours(image=image_copy, contours=contours, contourIdx=-1, color=(0, 255, 0), thickness=2, lineType=cv.LINE_AA)
-
         area = 0
 
         for contour in contours:
             area += cv.contourArea(contour)
 
-        cv.imwrite(f"images/contours/camera_{camera_number}_{index}.jpg", image_copy)
+        if save:
+            image_copy = img.copy()
+            cv.drawContours(image=image_copy, contours=contours, contourIdx=-1, color=(0, 255, 0), thickness=2, lineType=cv.LINE_AA)
+            cv.imwrite(f"images/contours/camera_{camera_number}_{index}.jpg", image_copy)
 
         return area
 
-    def find_tumour(self,image_path=None, crop_params=(65, 275, 130, 500), debug=False):
+    def find_tumour(self,image_path=None, crop_params=(65, 275, 130, 500), debug=False, image=None):
         """
         Find tumor in the image.
 
@@ -138,17 +131,18 @@ class ImageProcessor:
             image_path (str, optional): Path to the image file. Defaults to None.
             crop_params (tuple, optional): Parameters for cropping the image. Defaults to (65, 275, 130, 500).
             debug (bool, optional): Whether to show debug image. Defaults to False.
+            image (numpy.ndarray, optional): Frame already in memory; takes precedence over image_path. Defaults to None.
 
         Returns:
             tuple: Cropped image with tumor and the contour of the tumor.
         """
         crop_top, crop_bottom, crop_left, crop_right = crop_params
 
-        if image_path is None:
-            camera = cv.VideoCapture(0)
-            ret, image = camera.read()
-            camera.release()
-            if not ret:
+        if image is not None:
+            self.image = image
+        elif image_path is None:
+            self.image = Camera(0).take_picture(return_image=True)
+            if self.image is None:
                 raise ValueError("Failed to capture image from camera")
         else:
             self.image = cv.imread(image_path)
@@ -178,6 +172,179 @@ class ImageProcessor:
 
         return cropped_image, max_area_contour
 
+    def find_tumours(self, frames, crop_params=(65, 275, 130, 500), workers=None, with_masks=False):
+        """
+        Find the tumour in a batch of frames, spreading the work across worker processes.
+
+        Args:
+            frames (list): Image file paths or frames already in memory, in angle order.
+            crop_params (tuple, optional): Parameters for cropping the images. Defaults to (65, 275, 130, 500).
+            workers (int, optional): Number of worker processes. Defaults to the number of CPUs;
+                                     0 or 1 runs serially in this process.
+            with_masks (bool, optional): Whether to also return the filled silhouette masks. Defaults to False.
+
+        Returns:
+            list or tuple: Tumour contours in the order of `frames`, or (contours, masks) if with_masks is True.
+        """
+        tasks = [(frame, crop_params, with_masks) for frame in frames]
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(tasks))
+
+        results = None
+        if workers > 1:
+            # Only a pool that cannot start or loses a worker falls back to serial; an error raised
+            # by a frame in a worker, e.g. a missing file, propagates as it would serially
+            pool = None
+            try:
+                pool = ProcessPoolExecutor(max_workers=workers)
+                pending = pool.map(_extract_silhouette, tasks, chunksize=max(1, len(tasks) // (4 * workers)))
+            except (OSError, RuntimeError) as e:
+                print(f"Could not start the silhouette extraction workers ({e}), falling back to serial")
+            else:
+                try:
+                    results = list(pending)
+                except BrokenProcessPool as e:
+                    print(f"Parallel silhouette extraction failed ({e}), falling back to serial")
+            finally:
+                if pool is not None:
+                    pool.shutdown(cancel_futures=True)
+
+        if results is None:
+            results = [_extract_silhouette(task) for task in tasks]
+
+        if with_masks:
+            return [contour for contour, _ in results], [mask for _, mask in results]
+
+        return results
+
+    @staticmethod
+    def silhouette_mask(contour, shape):
+        """
+        Render a contour as a filled binary silhouette mask.
+
+        Args:
+            contour (numpy.ndarray): Contour of the silhouette, as returned by find_tumour.
+            shape (tuple): Height and width of the mask, usually the shape of the cropped image.
+
+        Returns:
+            numpy.ndarray: uint8 mask with 255 inside the silhouette and 0 elsewhere.
+        """
+        mask = np.zeros(shape[:2], dtype=np.uint8)
+        cv.drawContours(mask, [contour], -1, 255, thickness=cv.FILLED)
+        return mask
+
+class BrightnessROIs:
+    """
+    Fixed set of brightness regions, one per fiducial contour, measured together on each frame.
+
+    The regions are the enlarged bounding rectangles of ImageProcessor.compute_brightness, computed
+    once. `measure` takes the green-channel mean of every region from a single integral image, so one
+    capture gives the brightness at all the grid points and the frame is left untouched.
+    """
+
+    def __init__(self, contours, shape, enlarge_percent=100):
+        """
+        Precompute the regions.
+
+        Args:
+            contours (list): Contours of the regions, e.g. as sorted by outils.sort_centroids.
+            shape (tuple): Shape of the frames that will be measured.
+            enlarge_percent (int, optional): Percentage to enlarge the bounding rectangles. Defaults to 100.
+        """
+        self.shape = tuple(shape[:2])
+        self.rects = np.array([self.region(contour, shape, enlarge_percent) for contour in contours], dtype=np.intp).reshape(-1, 4)
+
+        x, y, w, h = self.rects.T
+        w, h = np.maximum(w, 0), np.maximum(h, 0)
+        self._areas = w * h
+
+        # The integral image only needs to cover the window spanned by the regions
+        self._window = (int(y.min()), int((y + h).max()), int(x.min()), int((x + w).max())) if len(self.rects) else (0, 0, 0, 0)
+        self._top, self._left = y - self._window[0], x - self._window[2]
+        self._bottom, self._right = self._top + h, self._left + w
+
+    @staticmethod
+    def region(contour, shape, enlarge_percent=100):
+        """
+        Enlarged bounding rectangle of a contour, clamped to the frame.
+
+        Args:
+            contour (numpy.ndarray): Contour specifying the region of interest.
+            shape (tuple): Shape of the frame.
+            enlarge_percent (int, optional): Percentage to enlarge the bounding rectangle. Defaults to 100.
+
+        Returns:
+            tuple: x, y, width and height of the rectangle.
+        """
+        x, y, w, h = cv.boundingRect(contour)
+
+        # Enlarge the rectangle by the specified percentage
+        enlarge_size = max(w, h) * enlarge_percent / 100
+        x = int(x - enlarge_size / 2)
+        y = int(y - enlarge_size / 2)
+        w = int(w + enlarge_size)
+        h = int(h + enlarge_size)
+
+        # Ensure the rectangle is within image boundaries
+        x, y = max(0, x), max(0, y)
+        w, h = min(w, shape[1] - x), min(h, shape[0] - y)
+
+        return x, y, w, h
+
+    def __len__(self):
+        return len(self.rects)
+
+    def measure(self, image):
+        """
+        Green-channel mean of every region.
+
+        Args:
+            image (numpy.ndarray): BGR frame of the shape given at construction.
+
+        Returns:
+            numpy.ndarray: Mean brightness per region, in contour order (NaN for empty regions),
+                           or None if no image was given.
+        """
+        if image is None:
+            print("Error: Image not provided or loaded properly.")
+            return None
+
+        top, bottom, left, right = self._window
+        integral = cv.integral(np.ascontiguousarray(image[top:bottom, left:right, 1]))
+
+        sums = (integral[self._bottom, self._right] - integral[self._top, self._right]
+                - integral[self._bottom, self._left] + integral[self._top, self._left])
+
+        means = np.full(len(self.rects), np.nan)
+        np.divide(sums, self._areas, out=means, where=self._areas > 0)
+        return means
+
+def _extract_silhouette(task):
+    """
+    Worker for ImageProcessor.find_tumours.
+
+    Args:
+        task (tuple): Frame (path or array), crop parameters and whether to build the mask.
+
+    Returns:
+        numpy.ndarray or tuple: The tumour contour, or (contour, mask).
+    """
+    frame, crop_params, with_mask = task
+    processor = ImageProcessor()
+
+    if isinstance(frame, str):
+        cropped_image, contour = processor.find_tumour(frame, crop_params)
+    else:
+        # find_tumour draws into the crop, so work on a copy of the caller's frame
+        cropped_image, contour = processor.find_tumour(crop_params=crop_params, image=frame.copy())
+
+    if with_mask:
+        return contour, ImageProcessor.silhouette_mask(contour, cropped_image.shape)
+
+    return contour
+
 # Example Usage
 if __name__ == "__main__":
     # image = cv.imread("images/test/captured_image_2.jpg")
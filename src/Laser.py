@@ -1,19 +1,25 @@
 import time
+import numpy as np
 from Mcp import Mcp
+import Tracing
 
 class LaserController:
     def __init__(self, mcp):
         self.mcp = mcp  # MCP2210 instance is passed during initialization
+        self.state = None  # Last value written to the laser pin, None until the first write
 
     def switch_laser(self, switch='on'):
         """
         Turn on or off the laser by setting the GPIO pin.
+        Each write is a USB HID transaction, so a write that would not change the pin is skipped.
         :param switch: 'on' to turn on, 'off' to turn off.
         """
-        if switch == 'on':
-            self.mcp.set_gpio_output_value(0, True)
-        else:
-            self.mcp.set_gpio_output_value(0, False)
+        state = switch == 'on'
+        if state == self.state:
+            return
+        self.mcp.set_gpio_output_value(0, state)
+        self.state = state
+        Tracing.count('gpio writes')
 
     def blink_laser(self, times):
         """
@@ -25,6 +31,110 @@ class LaserController:
         self.switch_laser('off')
 
 
+class PulseScheduler:
+    """
+    Paints a trajectory point by point, firing the laser for a set dwell at each point.
+
+    The MCP2210 has no pulse timer, so the pulses are timed in software against a monotonic
+    deadline clock: the scheduler sleeps until shortly before each deadline and spins for the
+    rest, then toggles the GPIO. Every pulse is timed from the moment its 'on' write returned,
+    so a late start shifts the pulse instead of shortening it, and the dose per point only
+    depends on how precisely the 'off' write lands.
+
+    With blanking the laser is switched off while the mirrors move to the next point. Without
+    it the laser stays on for the whole trajectory and only two GPIO writes are made, the dwell
+    then being the time the mirrors hold each point.
+    """
+
+    def __init__(self, laser, move, settle=0.0005, blank=True, spin=0.002, clock=time.perf_counter):
+        """
+        :param laser: LaserController firing the pulses.
+        :param move: Callable taking the X and Y voltages of a point and sending them to the mirrors.
+        :param settle: Seconds between the end of a pulse and the start of the next, for the mirrors to settle.
+        :param blank: Whether the laser is switched off while the mirrors move.
+        :param spin: Seconds before a deadline at which sleeping gives way to busy waiting.
+        :param clock: Monotonic clock in seconds.
+        """
+        self.laser = laser
+        self.move = move
+        self.settle = settle
+        self.blank = blank
+        self.spin = spin
+        self.clock = clock
+
+    def wait_until(self, deadline):
+        """
+        Wait until the clock reaches a deadline.
+        :param deadline: Time to wait for, on the scheduler clock.
+        :return: The time at which the wait ended.
+        """
+        remaining = deadline - self.clock()
+        if remaining > self.spin:
+            time.sleep(remaining - self.spin)
+        now = self.clock()
+        while now < deadline:
+            now = self.clock()
+        return now
+
+    def run(self, trajectory):
+        """
+        Paint a trajectory.
+        :param trajectory: Array of shape (n, 3) with the X and Y voltages and the dwell in seconds of each point.
+        :return: Dictionary with the number of points, the points per second, and the statistics (see
+                 jitter_statistics) of the pulse start lateness and of the pulse width error, in seconds.
+        """
+        trajectory = np.asarray(trajectory, dtype=np.float64)
+        n_points = len(trajectory)
+        lateness = np.zeros(n_points)
+        width_error = np.zeros(n_points)
+
+        start = self.clock()
+        deadline = start
+        try:
+            for index, (x, y, dwell) in enumerate(trajectory.tolist()):
+                self.move(x, y)
+                # The settle time counts from when the mirrors were sent the point, which is
+                # after the pulse ended if sending took longer than the pulse tail
+                deadline = max(deadline, self.clock()) + self.settle
+                self.wait_until(deadline)
+
+                self.laser.switch_laser('on')
+                on = self.clock()
+                lateness[index] = on - deadline
+
+                if self.blank:
+                    self.wait_until(on + dwell)
+                    self.laser.switch_laser('off')
+                    deadline = self.clock()
+                else:
+                    deadline = self.wait_until(on + dwell)
+                width_error[index] = deadline - on - dwell
+        finally:
+            self.laser.switch_laser('off')
+
+        elapsed = self.clock() - start
+        return {
+            'points': n_points,
+            'points_per_second': n_points / elapsed if elapsed > 0 else float('inf'),
+            'lateness': jitter_statistics(lateness),
+            'width_error': jitter_statistics(width_error),
+        }
+
+
+def jitter_statistics(errors):
+    """
+    Summarise timing errors.
+    :param errors: Timing errors in seconds.
+    :return: Dictionary with the mean, standard deviation, 99th percentile of the magnitude and maximum magnitude.
+    """
+    errors = np.asarray(errors, dtype=np.float64)
+    if len(errors) == 0:
+        return {'mean': 0.0, 'std': 0.0, 'p99': 0.0, 'max': 0.0}
+    magnitude = np.abs(errors)
+    return {'mean': float(errors.mean()), 'std': float(errors.std()),
+            'p99': float(np.percentile(magnitude, 99)), 'max': float(magnitude.max())}
+
+
 if __name__ == '__main__':
     mcp = Mcp()  # Create an instance of Mcp
     laser_controller = LaserController(mcp)  # Pass the Mcp instance to LaserController
@@ -1,10 +1,11 @@
-from mcp2210 import Mcp2210, Mcp2210GpioDesignation, Mcp2210GpioDirection
-
 def Mcp():
     """
     Prepare and configure the MCP2210 USB-to-SPI bridge.
     :return: Mcp2210 object for communication.
     """
+    # Imported here so that simulated runs do not need the driver
+    from mcp2210 import Mcp2210, Mcp2210GpioDesignation, Mcp2210GpioDirection
+
     mcp = Mcp2210(serial_number="0000423978")  # Initialize the MCP2210 device with its serial number
     
     # Configure SPI timing parameters
@@ -1,8 +1,7 @@
 import cv2
+import queue
+import threading
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-import pyvista as pv
 from outils import show_wait_destroy
 from Image_processor import ImageProcessor
 
@@ -17,6 +16,8 @@ class SilhouetteTo3D:
         self.max_y = 0
         self.max_x = 0
         self.center = False
+        self._buffer = np.empty((0, 3), dtype=np.float32)
+        self._count = 0
 
     def find_center(self, contour):
         """Find the center of the silhouette contour."""
@@ -45,8 +46,56 @@ class SilhouetteTo3D:
             x = point[0][0]
             y = point[0][1]
 
+            if isinstance(self.points, np.ndarray):
+                self.points = self.points.tolist()
             self.points.append([self.radius(point[0]), np.deg2rad(theta), 209 - point[0][1] - self.cy])
 
+    def _reserve(self, extra):
+        """Grow the cylindrical point buffer so it can hold `extra` more points."""
+        needed = self._count + extra
+        if needed > len(self._buffer):
+            buffer = np.empty((max(needed, 2 * len(self._buffer)), 3), dtype=np.float32)
+            buffer[:self._count] = self._buffer[:self._count]
+            self._buffer = buffer
+
+    def add_silhouettes(self, contours, thetas=None):
+        """Add a batch of silhouette contours to the point cloud in one vectorized pass.
+
+        Produces the same points as calling `add_silhouette` on each contour, written into a
+        preallocated float32 buffer. Can be called repeatedly; the buffer grows geometrically.
+
+        Args:
+            contours (list): Contours as returned by cv2.findContours, one per angle.
+            thetas (list, optional): Angle in degrees of each contour. Defaults to the contour index.
+        """
+        contours = [np.asarray(contour).reshape(-1, 2) for contour in contours]
+        if not contours:
+            return
+        if thetas is None:
+            thetas = np.arange(len(contours))
+
+        if len(self.points) and not isinstance(self.points, np.ndarray):
+            # Points added one by one through add_silhouette are moved into the buffer first
+            legacy = np.asarray(self.points, dtype=np.float32)
+            self._count = 0
+            self._reserve(len(legacy))
+            self._buffer[:len(legacy)] = legacy
+            self._count = len(legacy)
+
+        self.find_center(contours[0])
+
+        counts = [len(contour) for contour in contours]
+        pixels = np.concatenate(contours)
+        self._reserve(len(pixels))
+
+        block = self._buffer[self._count:self._count + len(pixels)]
+        block[:, 0] = pixels[:, 0] - self.cx
+        block[:, 1] = np.repeat(np.deg2rad(np.asarray(thetas, dtype=np.float64)), counts)
+        block[:, 2] = 209 - pixels[:, 1] - self.cy
+
+        self._count += len(pixels)
+        self.points = self._buffer[:self._count]
+
     def _cyl2cart(self, point):
         """Convert cylindrical coordinates to Cartesian coordinates."""
         x = point[0] * np.cos(point[1]) + self.cx 
@@ -57,12 +106,24 @@ class SilhouetteTo3D:
          
     def convert_coordinates(self):
         """Convert cylindrical coordinates of points to Cartesian coordinates."""
+        if isinstance(self.points, np.ndarray):
+            radius, theta, height = self.points.T
+            cloud = np.empty((len(self.points), 3), dtype=np.float32)
+            cloud[:, 0] = radius * np.cos(theta) + self.cx
+            cloud[:, 1] = radius * np.sin(theta)
+            cloud[:, 2] = height + self.cy
+            self.points_cloud = cloud
+            return
+
         for point in self.points:
             point_1 = self._cyl2cart(point)
             self.points_cloud.append(point_1)
 
     def plot_cloud(self):
         """Plot the 3D point cloud."""
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d import Axes3D
+
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
         x = [point[0] for point in self.points_cloud]
@@ -74,12 +135,77 @@ class SilhouetteTo3D:
 
     def generate_solid(self):
         """Generate a solid object from the point cloud."""
+        import pyvista as pv
+
         cloud = pv.PolyData(np.array(self.points_cloud))
         surf = cloud.delaunay_3d()
         voxels = pv.voxelize(surf, check_surface=False)
         coordinates = np.array(voxels.points)
         self.coordinates = np.array([[x, y, z] for x,y,z in coordinates])
 
+    def carve_visual_hull(self, masks, thetas=None, resolution=100, chunk_size=262144):
+        """Reconstruct the solid by space carving against the binary silhouette masks.
+
+        A voxel grid around the rotation axis is projected into every mask and only the voxels
+        that fall inside all silhouettes are kept. Voxels are processed in chunks of `chunk_size`,
+        and each chunk shrinks as it is carved, so memory stays bounded. Fills `coordinates` with
+        the surviving voxel centres, in the same frame as `generate_solid`.
+
+        Args:
+            masks (list): uint8 silhouette masks, one per angle (see ImageProcessor.silhouette_mask).
+            thetas (list, optional): Angle in degrees of each mask. Defaults to the mask index.
+            resolution (int, optional): Number of voxels along the largest extent of the grid. Defaults to 100.
+            chunk_size (int, optional): Number of voxels carved at once. Defaults to 262144.
+        """
+        masks = [np.asarray(mask) > 0 for mask in masks]
+        if thetas is None:
+            thetas = np.arange(len(masks))
+        thetas = np.deg2rad(np.asarray(thetas, dtype=np.float64))
+
+        self.find_center(masks[0].astype(np.uint8))
+
+        height, width = masks[0].shape
+        top = height - 1
+
+        # Bound the grid by the union of all silhouettes
+        union = np.logical_or.reduce(masks)
+        rows = np.flatnonzero(union.any(axis=1))
+        cols = np.flatnonzero(union.any(axis=0))
+        if len(rows) == 0:
+            self.coordinates = np.empty((0, 3), dtype=np.float32)
+            return
+
+        radius = max(abs(cols[0] - self.cx), abs(cols[-1] - self.cx))
+        z_min, z_max = top - rows[-1], top - rows[0]
+        step = max(2 * radius, z_max - z_min, 1) / resolution
+
+        xs = np.arange(self.cx - radius, self.cx + radius + step / 2, step)
+        ys = np.arange(-radius, radius + step / 2, step)
+        zs = np.arange(z_min, z_max + step / 2, step)
+        grid_shape = (len(xs), len(ys), len(zs))
+        total = len(xs) * len(ys) * len(zs)
+
+        cosines, sines = np.cos(thetas), np.sin(thetas)
+        kept = []
+
+        for start in range(0, total, chunk_size):
+            ix, iy, iz = np.unravel_index(np.arange(start, min(start + chunk_size, total)), grid_shape)
+            x, y, z = xs[ix], ys[iy], zs[iz]
+            v = np.rint(top - z).astype(np.intp)
+
+            for mask, cos, sin in zip(masks, cosines, sines):
+                u = np.rint(self.cx + (x - self.cx) * cos + y * sin).astype(np.intp)
+                inside = (u >= 0) & (u < width) & (v >= 0) & (v < height)
+                inside[inside] = mask[v[inside], u[inside]]
+                x, y, z, v = x[inside], y[inside], z[inside], v[inside]
+                if len(x) == 0:
+                    break
+
+            if len(x):
+                kept.append(np.column_stack((x, y, z)).astype(np.float32))
+
+        self.coordinates = np.concatenate(kept) if kept else np.empty((0, 3), dtype=np.float32)
+
     def save_coordinates(self, filename='data/coordinates.npy'):
         """Save the coordinates to a file."""
         np.save(filename, self.coordinates)
@@ -91,6 +217,8 @@ class SilhouetteTo3D:
 
     def plot_shell(self, plot_type="Surface"):
         """Plot the 3D surface or voxels."""
+        import pyvista as pv
+
         cloud = pv.PolyData(np.array(self.points_cloud))
         surf = cloud.delaunay_3d()
 
@@ -100,6 +228,157 @@ class SilhouetteTo3D:
             voxels = pv.voxelize(surf, check_surface=False)
             voxels.plot()
 
+class StreamingReconstructor:
+    """Builds the 3D model while the tomography frames are still arriving.
+
+    Frames handed to `submit` are queued to a background thread that extracts the silhouette
+    (as ImageProcessor.find_tumour does) and adds it to a running SilhouetteTo3D, so the model
+    is ready a few seconds after the last frame instead of being rebuilt from disk.
+    """
+
+    def __init__(self, angles=180, crop_params=(65, 275, 130, 500), reconstruction='delaunay',
+                 voxel_resolution=100, max_pending=32):
+        """Start the extraction thread.
+
+        Args:
+            angles (int, optional): Frames with an index below this are used. Defaults to 180.
+            crop_params (tuple, optional): Crop applied before segmentation. Defaults to (65, 275, 130, 500).
+            reconstruction (str, optional): 'delaunay' or 'carving'. Defaults to 'delaunay'.
+            voxel_resolution (int, optional): Resolution of the carving grid. Defaults to 100.
+            max_pending (int, optional): Frames that may wait for extraction before submit blocks. Defaults to 32.
+        """
+        self.angles = angles
+        self.crop_params = crop_params
+        self.reconstruction = reconstruction
+        self.voxel_resolution = voxel_resolution
+        self.model = SilhouetteTo3D()
+        self.masks = {}
+        self.extracted = 0
+        self.failed = []
+        self.error = None
+
+        self._processor = ImageProcessor()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._extract_loop, name="silhouette-extractor", daemon=True)
+        self._thread.start()
+
+    def submit(self, index, frame):
+        """Queue a captured frame for silhouette extraction.
+
+        Args:
+            index (int): Angle index of the frame, in degrees.
+            frame (numpy.ndarray): The captured frame. It is not modified.
+        """
+        if index < self.angles:
+            self._queue.put((index, frame))
+
+    def _extract_loop(self):
+        """Extract silhouettes from queued frames until the end marker arrives.
+
+        A frame that fails is recorded in `failed`, and the first unexpected error in `error`; the
+        queue keeps being drained so that submit never blocks.
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            index, frame = item
+            try:
+                cropped_image, contour = self._processor.find_tumour(crop_params=self.crop_params, image=frame.copy())
+                mask = None
+                if self.reconstruction == 'carving':
+                    mask = ImageProcessor.silhouette_mask(contour, cropped_image.shape)
+                self.model.add_silhouettes([contour], [index])
+            except Exception as e:
+                print(f"Error extracting silhouette {index}: {e}")
+                self.failed.append(index)
+                if self.error is None and not isinstance(e, ValueError):
+                    self.error = e
+                continue
+
+            self.extracted += 1
+            if mask is not None:
+                self.masks[index] = mask
+
+    def finish(self):
+        """Wait for the pending frames and generate the solid.
+
+        Returns:
+            SilhouetteTo3D: The model, with its point cloud and coordinates computed.
+
+        Raises:
+            RuntimeError: If no silhouette could be extracted.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+        if self.failed:
+            print(f"No silhouette for {len(self.failed)} frames: {sorted(self.failed)}")
+            if self.error is not None:
+                print(f"First unexpected extraction error: {self.error!r}")
+        if not self.extracted:
+            raise RuntimeError("No silhouette could be extracted from the tomography frames") from self.error
+
+        if self.reconstruction == 'carving':
+            order = sorted(self.masks)
+            self.model.carve_visual_hull([self.masks[i] for i in order], order, resolution=self.voxel_resolution)
+        else:
+            self.model.convert_coordinates()
+            self.model.generate_solid()
+
+        return self.model
+
+def silhouettes_from_stack(stack, count=None, crop_params=(65, 275, 130, 500), workers=None, with_masks=False):
+    """Extract the silhouettes of a frame stack (see Frame_stack.FrameStack).
+
+    Raw frames are handed to ImageProcessor.find_tumours as zero-copy views into the stack. If the
+    stack was cropped when written, the frames are used whole. Bit-packed stacks already hold the
+    silhouette masks, so only their outer contours are traced. Frames that were never written
+    (their angle is NaN, e.g. after an interrupted tomography) are left out.
+
+    Args:
+        stack (FrameStack): The frame stack.
+        count (int, optional): Number of frames to use from the start of the stack. Defaults to all.
+        crop_params (tuple, optional): Crop applied to uncropped raw frames. Defaults to (65, 275, 130, 500).
+        workers (int, optional): Worker processes for find_tumours. Defaults to the number of CPUs.
+        with_masks (bool, optional): Whether to also return the silhouette masks. Defaults to False.
+
+    Returns:
+        tuple: (contours, thetas) or (contours, thetas, masks) if with_masks is True.
+
+    Raises:
+        ValueError: If none of the frames was written.
+    """
+    count = len(stack) if count is None else min(count, len(stack))
+    angles = np.array(stack.angles[:count])
+    written = np.flatnonzero(~np.isnan(angles))
+    if len(written) == 0:
+        raise ValueError(f"None of the first {count} frames of the frame stack was written")
+    if len(written) < count:
+        print(f"Frame stack: {count - len(written)} of {count} frames were never written, leaving them out")
+    thetas = angles[written]
+
+    if stack.kind == 'bits':
+        masks = [stack[i] for i in written]
+        contours = []
+        for mask in masks:
+            found, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            contours.append(max(found, key=cv2.contourArea))
+        return (contours, thetas, masks) if with_masks else (contours, thetas)
+
+    if stack.crop_params is not None:
+        height, width = stack.frame_shape[:2]
+        crop_params = (0, height, 0, width)
+
+    frames = [stack[i] for i in written]
+    processor = ImageProcessor()
+
+    if with_masks:
+        contours, masks = processor.find_tumours(frames, crop_params, workers=workers, with_masks=True)
+        return contours, thetas, masks
+
+    return processor.find_tumours(frames, crop_params, workers=workers), thetas
+
 if __name__ == "__main__":
     
     img_index = [i for i in range(180)]
@@ -109,13 +388,11 @@ if __name__ == "__main__":
     processor = ImageProcessor(None)  # Initialize ImageProcessor with None image
 
     # Find contours for each image and get the contour with maximum area
-    contours = [processor.find_tumour(image)[1] for image in images]
+    contours = processor.find_tumours(images)
 
     s23 = SilhouetteTo3D() 
 
-    for i,contour in enumerate(contours):
-        s23.add_silhouette(contour, i)
-    
+    s23.add_silhouettes(contours)
     s23.convert_coordinates()
 
     s23.plot_shell()
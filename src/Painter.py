@@ -4,18 +4,19 @@ import cv2
 import outils
 import pickle
 import time
-from Laser import LaserController
+from Laser import LaserController, PulseScheduler
 import Mcp
-import curses
 import numpy as np
 from Camera import Camera
-from Image_processor import ImageProcessor
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-from sklearn.linear_model import LinearRegression
+from Image_processor import ImageProcessor, BrightnessROIs
 from Goniometer import GoniometerController
 from Tumour import Tumour
 from Socket_connection import SocketConnection
+from Calibration import CalibrationTransform, CalibrationLUT
+import Toolpath
+import Search
+from Diagnostics import DiagnosticsRecorder, render_green_map
+import Tracing
  
 
 class LaserPainter:
@@ -32,9 +33,22 @@ class LaserPainter:
         laser_pulse_duration (float): Duration for which the laser stays on during painting.
         laser_controller (LaserController): Controller for the laser.
         calibration_grid (numpy.ndarray): Grid for calibration data.
+        stream_batch (int): Points sent per axis in each bulk write when streaming a trajectory.
+        point_rate (float): Maximum points per second when streaming, or None for no pacing.
+        path_strategy (str): Order in which the points of a slice are painted (see Toolpath.plan_path).
+        search_strategy (str): How fine_tune_calibration looks for the brightest position (see Search.search).
+        search_budget (int): Maximum captures per grid point for the adaptive search strategies.
+        search_tolerance (float): Convergence tolerance of the adaptive search, in calibration steps.
+        calibration_mapping (str): Pixel to voltage mapping used when painting (see build_calibration_transform).
+        diagnostics (str): How the slice and green map plots are produced (see Diagnostics.DiagnosticsRecorder).
+        point_dwell (float): Laser pulse at every painted point in seconds, or None to keep the laser on while streaming.
+        pulse_settle (float): Mirror settling time before each pulse in seconds.
+        pulse_stats (dict): Timing statistics of the last pulsed trajectory (see Laser.PulseScheduler.run).
     """
 
-    def __init__(self, x_socket, y_socket, x_cal_factor, y_cal_factor, mcp_controller, laser_pulse_duration=0.025):
+    def __init__(self, x_socket, y_socket, x_cal_factor, y_cal_factor, mcp_controller, laser_pulse_duration=0.025, stream_batch=1, point_rate=None, path_strategy='raster',
+                 search_strategy='raster', search_budget=40, search_tolerance=0.5, calibration_mapping='linear', diagnostics='report',
+                 point_dwell=None, pulse_settle=0.0005):
         """
         Initializes the LaserPainter with sockets, calibration factors, MCP controller, and laser settings.
 
@@ -45,6 +59,21 @@ class LaserPainter:
             y_cal_factor (float): Calibration factor for Y-axis movements.
             mcp_controller (Mcp): Controller for MCP hardware.
             laser_pulse_duration (float): Duration for the laser pulse. Defaults to 0.025 seconds.
+            stream_batch (int): Points sent per axis in each bulk write. Defaults to 1, which keeps X and Y
+                                interleaved point by point; larger batches trade path fidelity for throughput.
+            point_rate (float): Maximum points per second when streaming. Defaults to None (no pacing).
+            path_strategy (str): 'raster', 'serpentine', 'nearest' or 'contour'. Defaults to 'raster'.
+            search_strategy (str): 'raster' (diagonal sweep and full raster), 'coarse_to_fine', 'hill_climb'
+                                   or 'nelder_mead'. Defaults to 'raster'.
+            search_budget (int): Maximum captures per grid point for the adaptive strategies. Defaults to 40.
+            search_tolerance (float): Convergence tolerance in calibration steps. Defaults to 0.5.
+            calibration_mapping (str): 'linear' (independent X and Y fits) or a dense lookup table interpolated
+                                       'bilinear' or 'thin_plate' over the frame. Defaults to 'linear'.
+            diagnostics (str): 'off', 'report' (record the plot data to data/diagnostics for Run.py report) or
+                               'background' (record it and render the plots in a worker process). Defaults to 'report'.
+            point_dwell (float): Pulse length at every point when painting, timed by Laser.PulseScheduler. Defaults to
+                                 None, which streams the trajectory with the laser left on for the whole angle.
+            pulse_settle (float): Time for the mirrors to settle before each pulse. Defaults to 0.0005 seconds.
         """
         self.x_socket = x_socket
         self.y_socket = y_socket
@@ -53,6 +82,17 @@ class LaserPainter:
         self.mcp_controller = mcp_controller
         self.laser_pulse_duration = laser_pulse_duration
         self.laser_controller = LaserController(mcp_controller)
+        self.stream_batch = stream_batch
+        self.point_rate = point_rate
+        self.path_strategy = path_strategy
+        self.search_strategy = search_strategy
+        self.search_budget = search_budget
+        self.search_tolerance = search_tolerance
+        self.calibration_mapping = calibration_mapping
+        self.diagnostics = diagnostics
+        self.point_dwell = point_dwell
+        self.pulse_settle = pulse_settle
+        self.pulse_stats = None
 
         self.calibration_grid = np.zeros((3, 3, 2))
         self.fine_grid = np.zeros((3,3,2)) 
@@ -63,6 +103,7 @@ class LaserPainter:
         self.y_socket.send_data('UPMODE:NORMAL\r\n')
 
         self.contours = None
+        self.brightness_rois = None
         self.centroids = np.zeros((3,3,2))
         self.centroid_shift = None
 
@@ -94,6 +135,104 @@ class LaserPainter:
         # self.laser_controller.switch_laser('on')
         # self.laser_controller.switch_laser('off')
 
+    @staticmethod
+    def encode_axis(positions):
+        """
+        Encodes a sequence of positions into one contiguous buffer of MWV commands.
+
+        Args:
+            positions (numpy.ndarray): Positions for a single axis.
+
+        Returns:
+            tuple: The encoded bytes and an array with the offset at which each command starts,
+                   followed by the total length.
+        """
+        commands = [f"MWV:{position}\r\n" for position in np.asarray(positions, dtype=np.float64).tolist()]
+        offsets = np.zeros(len(commands) + 1, dtype=np.int64)
+        np.cumsum([len(command) for command in commands], out=offsets[1:])
+        return "".join(commands).encode('utf-8'), offsets
+
+    def stream_trajectory(self, voltages, batch_size=None, rate=None, verbose=False):
+        """
+        Streams a whole trajectory to the galvo controllers in bulk writes.
+
+        The trajectory is encoded once per axis, then sent in batches of `batch_size` points,
+        each batch written to the X socket and then to the Y socket.
+
+        Args:
+            voltages (numpy.ndarray): Array of shape (n, 2) with the X and Y voltages of each point.
+            batch_size (int): Points per bulk write. Defaults to self.stream_batch.
+            rate (float): Maximum points per second. Defaults to self.point_rate.
+            verbose (bool): If True, prints the achieved points per second.
+
+        Returns:
+            float: Achieved points per second.
+        """
+        batch_size = max(1, batch_size or self.stream_batch)
+        rate = rate if rate is not None else self.point_rate
+
+        voltages = np.asarray(voltages)
+        n_points = len(voltages)
+        if n_points == 0:
+            return 0.0
+
+        x_buffer, x_offsets = self.encode_axis(voltages[:, 0])
+        y_buffer, y_offsets = self.encode_axis(voltages[:, 1])
+        x_view, y_view = memoryview(x_buffer), memoryview(y_buffer)
+
+        start = time.monotonic()
+
+        for first in range(0, n_points, batch_size):
+            last = min(first + batch_size, n_points)
+            self.x_socket.send_bytes(x_view[x_offsets[first]:x_offsets[last]])
+            self.y_socket.send_bytes(y_view[y_offsets[first]:y_offsets[last]])
+
+            if rate:
+                delay = start + last / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+        elapsed = time.monotonic() - start
+        points_per_second = n_points / elapsed if elapsed > 0 else float('inf')
+
+        if verbose:
+            print(f"Streamed {n_points} points at {points_per_second:.0f} points/sec")
+
+        return points_per_second
+
+    def pulse_trajectory(self, voltages, dwell=None, verbose=False):
+        """
+        Paints a trajectory point by point, with a timed laser pulse at each point.
+
+        The statistics of the pulse timing are kept in `pulse_stats`.
+
+        Args:
+            voltages (numpy.ndarray): Array of shape (n, 2) with the X and Y voltages of each point.
+            dwell (float or numpy.ndarray): Pulse length of every point, or of each point, in seconds.
+                                            Defaults to self.point_dwell.
+            verbose (bool): If True, prints the achieved points per second and the pulse timing errors.
+
+        Returns:
+            float: Achieved points per second.
+        """
+        dwell = self.point_dwell if dwell is None else dwell
+        voltages = np.asarray(voltages, dtype=np.float64)
+        trajectory = np.column_stack([voltages[:, :2], np.broadcast_to(dwell, len(voltages))])
+
+        scheduler = PulseScheduler(self.laser_controller, self._move_point, settle=self.pulse_settle)
+        self.pulse_stats = scheduler.run(trajectory)
+
+        if verbose:
+            print(f"Pulsed {self.pulse_stats['points']} points at {self.pulse_stats['points_per_second']:.0f} points/sec, "
+                  f"start lateness p99 {self.pulse_stats['lateness']['p99'] * 1e6:.0f} us, "
+                  f"width error p99 {self.pulse_stats['width_error']['p99'] * 1e6:.0f} us")
+
+        return self.pulse_stats['points_per_second']
+
+    def _move_point(self, x, y):
+        self.move('x', x)
+        self.move('y', y)
+
     def set_laser_grid(self, stdscr):
         """
         Allows manual painting using keyboard controls in a curses window.
@@ -105,6 +244,8 @@ class LaserPainter:
         self.move('x', posX)
         self.move('y', posY)
 
+        import curses
+
         curses.noecho()
         curses.cbreak()
         stdscr.keypad(True)
@@ -175,15 +316,14 @@ class LaserPainter:
         else:
             calibration_grid = self.calibration_grid
 
-        camera = Camera(2) 
-
-        for i in range(3):
-            for j in range(3):
-                self.laser_controller.switch_laser('on')
-                self.move('x', calibration_grid[i, j, 0])
-                self.move('y', calibration_grid[i, j, 1])
-                camera.take_picture(f"images/calibration/brgt/laser_avg_{i}{j}.jpg")
-                time.sleep(3)
+        with Camera(2) as camera:
+            for i in range(3):
+                for j in range(3):
+                    self.laser_controller.switch_laser('on')
+                    self.move('x', calibration_grid[i, j, 0])
+                    self.move('y', calibration_grid[i, j, 1])
+                    camera.take_picture(f"images/calibration/brgt/laser_avg_{i}{j}.jpg")
+                    time.sleep(3)
         self.laser_controller.switch_laser('off')
 
     def scan_diagonal(self, center, n_points, coordinate, verbose=False):
@@ -223,8 +363,8 @@ class LaserPainter:
                 self.move('y', y)
                 self.move('x', x)
 
-                processor = ImageProcessor(camera.take_picture(return_image=True))
-                green = processor.compute_brightness(self.contours[3*coordinate[0] + coordinate[1]])
+                greens = self.brightness_rois.measure(camera.take_picture(return_image=True))
+                green = greens[3*coordinate[0] + coordinate[1]]
 
                 # self.green_map.append([x,y,gree])
                 
@@ -303,9 +443,9 @@ class LaserPainter:
             while x < x_top_left + line * self.x_calibration_factor:
                 self.move('x', x)
 
-                processor = ImageProcessor(camera.take_picture(return_image=True))
+                brghts = self.brightness_rois.measure(camera.take_picture(return_image=True))
 
-                brght = processor.compute_brightness(self.contours[3*i + j])
+                brght = brghts[3*i + j]
 
                 self.whole_green_map.append([x,y,brght])
 
@@ -332,34 +472,78 @@ class LaserPainter:
 
         return max_brght
 
+    def search_calibration(self, center, coordinate, verbose=False):
+        """
+        Finds the brightest position around a grid point with an adaptive search instead of a full raster.
+
+        Args:
+            center (tuple): Center coordinates of the search window.
+            coordinate (tuple): Coordinates of the point being scanned.
+            verbose (bool): If True, prints the search result.
+
+        Returns:
+            tuple: The brightest position and its brightness value.
+        """
+        camera = Camera(2)
+        index = 3*coordinate[0] + coordinate[1]
+
+        def brightness(x, y):
+            self.move('y', y)
+            self.move('x', x)
+            return self.brightness_rois.measure(camera.take_picture(return_image=True))[index]
+
+        self.laser_controller.switch_laser('on')
+        try:
+            position, value, samples = Search.search(brightness, center, (self.x_calibration_factor, self.y_calibration_factor),
+                                                     self.search_strategy, budget=self.search_budget, tolerance=self.search_tolerance)
+        finally:
+            self.laser_controller.switch_laser('off')
+
+        self.whole_green_map = samples
+        self.green_map = [sample for sample in samples if sample[2] == value]
+
+        if verbose:
+            print(f"brgth: {value}, pos: {position}, captures: {len(samples)}")
+
+        return position, value
+
     def fine_tune_calibration(self):
         """
-        Fine tunes the calibration by scanning diagonals and calibration areas for each grid point.
+        Fine tunes the calibration by scanning diagonals and calibration areas for each grid point,
+        or by an adaptive search when a search strategy other than 'raster' is set.
         """
         print("Fine tune calibration")
         print("------------------------")
-        for i in range(3):
-            for j in range(3):
-                x = self.calibration_grid[i,j,0]
-                y = self.calibration_grid[i,j,1]
-                pos_1, gv1 = self.scan_diagonal((x,y), 10, (i,j))
-                self.scan_calibration(pos_1, 10, (i,j))
-
-                array = np.array(self.green_map)
-
-                x_values = np.array([coord[0] for coord in array])
-                y_values = np.array([coord[1] for coord in array])
-
-                self.fine_grid[i,j,0] = np.mean(x_values)
-                self.fine_grid[i,j,1] = np.mean(y_values)
-
-                # print(f"Green map: {self.green_map}")
-                # print(f"Fine_grid: {self.fine_grid[i,j]}")
-                # print()
-                self.plot_green_map(f'green_map_{i}_{j}')
-                self.green_map = []
-                self.whole_green_map = []
-                time.sleep(2)
+        # Keep the laser camera session open across every scan of every grid point
+        with Camera(2), DiagnosticsRecorder('data/diagnostics/calibration.npz', self.diagnostics) as diagnostics:
+            for i in range(3):
+                for j in range(3):
+                    x = self.calibration_grid[i,j,0]
+                    y = self.calibration_grid[i,j,1]
+
+                    with Tracing.span('fine tune point', point=f"{i},{j}", strategy=self.search_strategy):
+                        if self.search_strategy == 'raster':
+                            pos_1, gv1 = self.scan_diagonal((x,y), 10, (i,j))
+                            self.scan_calibration(pos_1, 10, (i,j))
+
+                            array = np.array(self.green_map)
+
+                            x_values = np.array([coord[0] for coord in array])
+                            y_values = np.array([coord[1] for coord in array])
+
+                            self.fine_grid[i,j,0] = np.mean(x_values)
+                            self.fine_grid[i,j,1] = np.mean(y_values)
+                        else:
+                            self.fine_grid[i,j] = self.search_calibration((x,y), (i,j))[0]
+
+                    # print(f"Green map: {self.green_map}")
+                    # print(f"Fine_grid: {self.fine_grid[i,j]}")
+                    # print()
+                    if self.green_map:
+                        diagnostics.record('green_map', f'green_map_{i}_{j}', np.array(self.whole_green_map, dtype=np.float64))
+                    self.green_map = []
+                    self.whole_green_map = []
+                    time.sleep(2)
    
     def plot_green_map(self, name):
         """
@@ -373,23 +557,7 @@ class LaserPainter:
             print("Green map is empty. No data to plot.")
             return
 
-        # Extract x, y, and green values
-        x_values = [point[0] for point in self.whole_green_map]
-        y_values = [point[1] for point in self.whole_green_map]
-        green_values = [point[2] for point in self.whole_green_map]
-
-        # Normalize the green values to the range [0, 1] for color mapping
-        norm = mcolors.Normalize(vmin=min(green_values), vmax=max(green_values))
-
-        # Create the scatter plot
-        plt.scatter(x_values, y_values, c=green_values, cmap='Greens', norm=norm)
-        plt.colorbar()  # Add a color bar to indicate the scale of green values
-        plt.xlabel('X Coordinate')
-        plt.ylabel('Y Coordinate')
-        plt.title('Green Map Color Plot')
-        plt.savefig(f"{name}", format='pdf')
-        plt.clf()
-        # plt.show()
+        render_green_map(np.array(self.whole_green_map, dtype=np.float64), name)
 
     def save_calibration_data(self, filename="data/calibration_data.pkl"):
         """
@@ -453,64 +621,82 @@ class LaserPainter:
             image_processor = ImageProcessor(image)
             centroids = image_processor.centroids(f"images/centroids/marked_centroids_image_{camera_number}.jpg")
             self.centroids, self.contours = outils.sort_centroids(centroids)
+            # Brightness regions around the 9 fiducials, measured together on every calibration capture
+            self.brightness_rois = BrightnessROIs(self.contours, image.shape)
             print("Computed centroids camera 2")
 
-    def paint_tumour(self, tumour_coordinates, centroid_shift):
+    def save_calibration_lut(self, filename="data/calibration_lut.npy", frame_shape=(480, 640)):
         """
-        Paints the tumor on the image.
+        Tabulates the pixel to voltage mapping over the whole camera frame and saves it.
 
         Args:
-        - tumour_coordinates (array): Array of tumor coordinates.
-        - centroid_shift (tuple): Shift of the centroid.
+        - filename (str): Destination, next to calibration_data.pkl by default.
+        - frame_shape (tuple): Height and width of the camera frame.
 
         Returns:
         - None
         """
-        x_axis = []
-        y_axis = []
+        CalibrationLUT.build(self.centroids, self.fine_grid, frame_shape, self.calibration_mapping).save(filename)
 
-        self.load_calibration_data()
+    def build_calibration_transform(self, centroid_shift, lut_file="data/calibration_lut.npy"):
+        """
+        Builds the pixel to voltage mapping from the saved calibration and centroids.
+
+        With a lookup table mapping, the table saved by the calibration routine is memory-mapped,
+        and rebuilt from the saved data if it is missing, or was built with another method or from
+        another calibration.
 
-        voltages = self.fine_grid
+        Args:
+        - centroid_shift (tuple): Shift of the centroid.
+        - lut_file (str): Saved lookup table.
 
+        Returns:
+        - CalibrationTransform or CalibrationLUT: Mapping from tumour coordinates to galvo voltages.
+        """
+        self.load_calibration_data()
         self.compute_centroids(use_saved_data=True)
-        centroids = self.centroids
 
-        for horizontal_line in centroids:
-            for center in horizontal_line:
-                center[0] -= centroid_shift[0]
-                center[1] -= centroid_shift[1]
+        if self.calibration_mapping == 'linear':
+            return CalibrationTransform(self.centroids, self.fine_grid, centroid_shift)
 
-        for pxs, volts in zip(centroids, voltages):
-            for px, volt in zip(pxs, volts):
-                x_axis.append([px[0], volt[0]])
-                y_axis.append([px[1], volt[1]])
+        if not CalibrationLUT.is_current(lut_file, self.centroids, self.fine_grid, self.calibration_mapping):
+            self.save_calibration_lut(lut_file)
+        return CalibrationLUT.load(lut_file, centroid_shift)
 
-        x_axis = np.array(x_axis)
-        y_axis = np.array(y_axis)
+    def paint_tumour(self, tumour_coordinates, centroid_shift, transform=None):
+        """
+        Paints the tumor on the image.
 
-        vx = LinearRegression().fit(x_axis[:, 0].reshape(-1, 1), x_axis[:, 1])
-        vy = LinearRegression().fit(y_axis[:, 0].reshape(-1, 1), y_axis[:, 1])
+        Args:
+        - tumour_coordinates (array): Array of tumor coordinates.
+        - centroid_shift (tuple): Shift of the centroid.
+        - transform (CalibrationTransform or CalibrationLUT): Mapping built once per burn. Built here if not given.
 
-        for x, y in tumour_coordinates[::1]:
-            xPos = vx.predict(np.array(x).reshape(-1, 1))
-            yPos = vy.predict(np.array(y).reshape(-1, 1))
+        Returns:
+        - float: Achieved points per second.
+        """
+        with Tracing.span('paint slice', points=len(tumour_coordinates)):
+            if transform is None:
+                transform = self.build_calibration_transform(centroid_shift)
 
-            self.paint_coordinate(xPos[0], yPos[0])
+            if self.point_dwell is not None:
+                return self.pulse_trajectory(transform(tumour_coordinates))
+            return self.stream_trajectory(transform(tumour_coordinates))
 
-    def calibration_routine(self, manual=False):
+    def calibration_routine(self, manual=False, goniometer_method='sweep'):
         """
         Performs calibration routine.
 
         Args:
         - manual (bool): Whether to calibrate manually.
+        - goniometer_method (str): 'sweep' or 'golden' search for the panel-facing angle (see GoniometerController.calibrate_goniometer).
 
         Returns:
         - None
         """
         with GoniometerController() as controller:
             input("Turn on light pannel and press enter")
-            controller.calibrate_goniometer(0)
+            controller.calibrate_goniometer(0, method=goniometer_method)
 
             input("Turn off light pannel and press enter")
 
@@ -524,6 +710,7 @@ class LaserPainter:
                 print("-----------------------------------------")
 
             if manual:
+                import curses
                 curses.wrapper(self.set_laser_grid)
                 self.interpolate_calibration_grid(verbose=False)
             else:
@@ -536,60 +723,107 @@ class LaserPainter:
             # In order to make the correspondence voltage - pixe, compute centroids when facing the other camera
             self.compute_centroids()
 
-    def burn_tumour(self, static=False, angle_per_step=36):
+            if self.calibration_mapping != 'linear':
+                self.save_calibration_lut()
+
+    def plan_burn(self, angle_per_step=36):
+        """
+        Slices the saved tumour model for every burn angle and orders the slice paths.
+
+        Args:
+        - angle_per_step (float): Rotation between burn angles, in degrees.
+
+        Returns:
+        - list: One slices dictionary per angle (see Tumour.burn_plan).
+        """
+        return Tumour.from_files().burn_plan(angle_per_step, self.path_strategy)
+
+    def burn_tumour(self, static=False, angle_per_step=36, plan=None, checkpoint=None):
         """
         Burns the tumor.
 
         Args:
         - static (bool): Whether the tumor is static.
+        - angle_per_step (float): Rotation between burn angles, in degrees.
+        - plan (list): Slices per angle, as returned by plan_burn. Computed here if not given.
+        - checkpoint (Pipeline.Checkpoint): Records the goniometer origin and the angles already burnt,
+          and resumes after them if it holds an interrupted burn.
 
         Returns:
         - None
         """
-        coords = np.load('data/coordinates.npy')
-        center = np.load('data/center.npy')
+        if plan is None:
+            plan = self.plan_burn(angle_per_step)
 
-        tumour = Tumour(coords, center)
+        first = checkpoint.get('angle', 0) if checkpoint is not None else 0
 
-        with GoniometerController() as controller:
+        # Slice paths are recorded for the plots instead of being plotted between slices
+        diagnostics = DiagnosticsRecorder('data/diagnostics/burn.npz', self.diagnostics, append=bool(first))
+
+        with GoniometerController() as controller, diagnostics:
             if not static:
-                controller.move(89)
+                if first:
+                    # Go back to where the interrupted burn stopped
+                    controller.move_to(checkpoint.get('origin') + 89 + first * angle_per_step)
+                else:
+                    if checkpoint is not None:
+                        checkpoint.update(origin=controller.position())
+                    controller.move(89)
 
-            steps = 360/angle_per_step
-            steps = int(steps)
+            if not static:
+                transform = self.build_calibration_transform((130, 65))
 
             print("Burning Tumour")
             print("----------------------------")
 
-            for i in range(steps):
-                slices = tumour.generate_slices()
+            for i, slices in enumerate(plan):
+                if i < first:
+                    continue
 
                 j = 0
-
-                if not static:
-                    self.laser_controller.switch_laser('on')
-
-                for key, value in slices.items():
-
-                    tumour_coordinates = np.array(value)
-                    x = tumour_coordinates[:, 0]
-                    y = tumour_coordinates[:, 1]
-
-                    plt.plot(x, y)
-                    plt.gca().invert_yaxis()
-
-                    plt.savefig(f"images/planos/plano_{i}_{j}")
-                    plt.clf()
+                painted_points = 0
+                painting_time = 0.0
+                path_total = 0.0
+                width_error = 0.0
+
+                with Tracing.span('burn angle', angle=i * angle_per_step):
+                    if not static and self.point_dwell is None:
+                        self.laser_controller.switch_laser('on')
+
+                    for key, value in slices.items():
+
+                        # Already in painting order (see plan_burn)
+                        tumour_coordinates = np.asarray(value)
+                        path_total += Toolpath.path_length(tumour_coordinates)
+                        painted_points += len(tumour_coordinates)
+
+                        diagnostics.record('slice', f"images/planos/plano_{i}_{j}.png", tumour_coordinates[:, :2])
+
+                        if not static:
+                            start = time.monotonic()
+                            self.paint_tumour(tumour_coordinates, (130, 65), transform)
+                            painting_time += time.monotonic() - start
+                            if self.point_dwell is not None:
+                                width_error = max(width_error, self.pulse_stats['width_error']['max'])
+                        j += 1
+
+                    report = f"Angle {i}: {painted_points} points, {self.path_strategy} path length {path_total:.0f} px"
+                    if painting_time > 0:
+                        report += f", {painted_points / painting_time:.0f} points/sec"
+                    if self.point_dwell is not None and not static:
+                        report += f", pulse width error up to {width_error * 1e6:.0f} us"
+                    print(report)
 
                     if not static:
-                        self.paint_tumour(tumour_coordinates, (130, 65))
-                    j += 1
+                        self.laser_controller.switch_laser('off')
 
-                tumour.rotate_tumour(-1*angle_per_step)
+                    # Recorded before the rotation, so a stalled move is never followed by a second
+                    # dose at this angle; resuming moves to the next angle from the origin
+                    if checkpoint is not None:
+                        checkpoint.update(angle=i + 1)
 
-                if not static:
-                    self.laser_controller.switch_laser('off')
-                    controller.move(angle_per_step)
+                    if not static:
+                        controller.move(angle_per_step)
 
             if not static:
                 controller.move(-89)
@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import hashlib
+import Tracing
+
+class Checkpoint:
+    """
+    Progress of a running stage, saved with the pipeline state on every update.
+
+    A stage that is interrupted finds its last checkpoint again when the pipeline is resumed.
+    """
+
+    def __init__(self, values, save):
+        self.values = values
+        self._save = save
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def update(self, **values):
+        self.values.update(values)
+        self._save()
+
+    def clear(self):
+        self.values.clear()
+        self._save()
+
+
+class Stage:
+    """
+    A pipeline step and the artifacts it reads and writes.
+
+    Attributes:
+        name (str): Name of the stage, as given on the command line.
+        func (callable): The step. Called with a Checkpoint if `checkpointed`, without arguments otherwise.
+        inputs (list): Files the stage reads.
+        outputs (list): Files the stage writes.
+        params (dict): Settings that change the outputs, hashed with the inputs.
+        hardware (bool): Whether the stage acts on the device. Hardware stages always run when a run
+                         reaches them, and are only skipped when resuming.
+        checkpointed (bool): Whether the stage takes a Checkpoint to resume from.
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), params=None, hardware=False, checkpointed=False):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.hardware = hardware
+        self.checkpointed = checkpointed
+
+
+class Pipeline:
+    """
+    Ordered stages with content-hashed artifacts.
+
+    Each stage records, in a JSON state file, the hash of its inputs and parameters and the hashes of
+    the outputs it wrote. A data stage whose inputs are unchanged and whose outputs are still on disk
+    as it left them is skipped. The state is saved after every stage, so a failure keeps the work of
+    the stages before it, and checkpointed stages keep their progress for `run(resume=True)`.
+    """
+
+    def __init__(self, state_file='data/pipeline_state.json'):
+        """
+        Loads the state of earlier runs.
+
+        Args:
+            state_file (str): JSON file with the stage records and file hash cache.
+        """
+        self.state_file = state_file
+        self.stages = []
+        try:
+            with open(state_file) as file:
+                self.state = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.state = {}
+        self.state.setdefault('stages', {})
+        self.state.setdefault('files', {})
+
+    def add_stage(self, name, func, inputs=(), outputs=(), params=None, hardware=False, checkpointed=False):
+        """
+        Appends a stage. Stages run in the order they are added.
+
+        Args:
+            See Stage.
+        """
+        self.stages.append(Stage(name, func, inputs, outputs, params, hardware, checkpointed))
+
+    def stage_names(self):
+        """
+        Returns:
+            list: Names of the stages, in order.
+        """
+        return [stage.name for stage in self.stages]
+
+    def save(self):
+        """Writes the state file atomically."""
+        directory = os.path.dirname(self.state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{self.state_file}.tmp"
+        with open(temporary, 'w') as file:
+            json.dump(self.state, file, indent=1)
+        os.replace(temporary, self.state_file)
+
+    def file_hash(self, path):
+        """
+        Content hash of a file, cached by size and modification time.
+
+        Args:
+            path (str): The file.
+
+        Returns:
+            str: Hex digest, or None if the file does not exist.
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        cached = self.state['files'].get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        self.state['files'][path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def input_hash(self, stage):
+        """
+        Hash of the parameters and input contents of a stage.
+
+        Args:
+            stage (Stage): The stage.
+
+        Returns:
+            str: Hex digest.
+        """
+        digest = hashlib.sha256(json.dumps(stage.params, sort_keys=True, default=str).encode('utf-8'))
+        for path in sorted(stage.inputs):
+            digest.update(f"{path}:{self.file_hash(path)}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def is_current(self, stage):
+        """
+        Whether the last run of a stage completed on the current inputs and its outputs are untouched.
+
+        Args:
+            stage (Stage): The stage.
+
+        Returns:
+            bool: True if the stage can be skipped.
+        """
+        record = self.state['stages'].get(stage.name)
+        if not record or record.get('status') != 'complete' or record.get('input_hash') != self.input_hash(stage):
+            return False
+        return all(self.file_hash(path) is not None and self.file_hash(path) == digest
+                   for path, digest in record.get('outputs', {}).items())
+
+    def run(self, start=None, resume=False):
+        """
+        Runs the stages from `start` onwards.
+
+        The start stage always runs. After it, hardware stages run and data stages run unless current.
+        With `resume`, every stage from the first on is skipped if current, and an interrupted
+        checkpointed stage continues from its checkpoint. Once a stage runs, every later hardware
+        stage and stage without inputs runs too, so e.g. a recalibration is always followed by the
+        tomography; data stages still skip when the stage before left their inputs unchanged.
+
+        Args:
+            start (str, optional): Name of the first stage. Defaults to the first stage, or when resuming
+                                   to the first stage that has run before.
+            resume (bool): Whether to resume an earlier run. Defaults to False.
+        """
+        names = self.stage_names()
+        if start is not None and start not in names:
+            raise ValueError(f"Unknown stage '{start}', choose from {', '.join(names)}")
+        if start is not None:
+            first = names.index(start)
+        elif resume:
+            first = next((index for index, name in enumerate(names) if name in self.state['stages']), 0)
+        else:
+            first = 0
+
+        ran = False
+        for index, stage in enumerate(self.stages[first:], first):
+            # Changes made by a stage that ran are only visible to later stages through their inputs
+            forced = (index == first and not resume) or (ran and (stage.hardware or not stage.inputs))
+            if not forced and (resume or not stage.hardware) and self.is_current(stage):
+                print(f"Skipping {stage.name}: up to date")
+                continue
+            ran = True
+            try:
+                self._run_stage(stage, resume)
+            except BaseException:
+                print(f"Stage {stage.name} did not finish; the earlier stages and its progress are saved, resume to continue")
+                raise
+
+    def _run_stage(self, stage, resume):
+        """
+        Runs one stage and records its outcome.
+
+        Args:
+            stage (Stage): The stage.
+            resume (bool): Whether to continue from the checkpoint of an interrupted run on the same inputs.
+        """
+        input_hash = self.input_hash(stage)
+        previous = self.state['stages'].get(stage.name, {})
+
+        values = {}
+        if resume and previous.get('status') == 'running' and previous.get('input_hash') == input_hash:
+            values = previous.get('checkpoint', {})
+            print(f"Resuming {stage.name} from {values}")
+
+        record = {'status': 'running', 'input_hash': input_hash, 'checkpoint': values, 'started': time.time()}
+        self.state['stages'][stage.name] = record
+        self.save()
+
+        with Tracing.span(stage.name, 'stage'):
+            if stage.checkpointed:
+                stage.func(Checkpoint(values, self.save))
+            else:
+                stage.func()
+
+        record.update({
+            'status': 'complete',
+            'outputs': {path: self.file_hash(path) for path in stage.outputs},
+            'finished': time.time(),
+        })
+        self.save()
@@ -1,41 +1,80 @@
-from Painter import LaserPainter
-from Mcp import Mcp
-from Socket_connection import SocketConnection
-from Image_processor import ImageProcessor
-from Function_chain import FunctionLinkedList
-from Model_generator import SilhouetteTo3D
-from Goniometer import  GoniometerController
+from Pipeline import Pipeline
+import os
 import yaml
+import pickle
 import socket
 import sys
+import argparse
+import subprocess
+
+# Modules each stage imports when it runs, for the import-time report. The stages import them
+# locally, so a run only pays for the stages it reaches.
+STAGE_IMPORTS = {
+    'calibrate': ['Painter', 'Simulation'],
+    'tomography': ['Goniometer', 'Frame_stack', 'Model_generator', 'Simulation'],
+    'generate-model': ['Model_generator', 'Frame_stack', 'Image_processor'],
+    'plan-burn': ['Tumour'],
+    'burn-tumour': ['Painter', 'Simulation'],
+}
 
 class Runner:
     def __init__(self):
-        self.mcp = Mcp()
-
         self._load_data('config/config.yaml')
-        self._connect_sockets()
-        self._instantiate_painter()
 
-        self.functions_chain = FunctionLinkedList()
-        self.functions_chain.add_function(self._calibrate)
-        self.functions_chain.add_function(self._wait_user)
-        self.functions_chain.add_function(self._execute_tomography)
-        self.functions_chain.add_function(self._generate_model)
-        self.functions_chain.add_function(self._burn_tumour)
+        # Devices are opened by the first stage that needs them
+        self.rig = None
+        self.painter = None
+
+        self.streamed_model = None
+
+        self._build_pipeline()
 
     def _load_data(self, file_path):
         with open(file_path) as f:
             data = yaml.safe_load(f)
             self.host_x = data['host_x']
             self.host_y = data['host_y']
-            self.port = data['port']
+            self.port_x = self.port_y = data['port']
             self.cal_x = data['cal_x']
             self.cal_y = data['cal_y']
+            self.reconstruction = data.get('reconstruction', 'delaunay')
+            self.voxel_resolution = data.get('voxel_resolution', 100)
+            self.workers = data.get('workers')
+            self.stream_batch = data.get('stream_batch', 1)
+            self.point_rate = data.get('point_rate')
+            self.path_strategy = data.get('path_strategy', 'raster')
+            self.search_strategy = data.get('search_strategy', 'raster')
+            self.search_budget = data.get('search_budget', 40)
+            self.search_tolerance = data.get('search_tolerance', 0.5)
+            self.goniometer_search = data.get('goniometer_search', 'sweep')
+            self.calibration_mapping = data.get('calibration_mapping', 'linear')
+            self.fly_scan = data.get('fly_scan', False)
+            self.fly_speed = data.get('fly_speed', 10.0)
+            self.streaming = data.get('streaming', False)
+            self.save_frames = data.get('save_frames', True)
+            self.frame_stack = data.get('frame_stack')
+            self.simulation = data.get('simulation', False)
+            self.simulation_speedup = data.get('simulation_speedup', 1.0)
+            self.angle_per_step = data.get('angle_per_step', 36)
+            self.diagnostics = data.get('diagnostics', 'report')
+            self.point_dwell = data.get('point_dwell')
+            self.pulse_settle = data.get('pulse_settle', 0.0005)
+            self.burn_plan_file = 'data/burn_plan.pkl'
+
+    def _start_rig(self):
+        if self.simulation and self.rig is None:
+            from Simulation import SimulatedRig
+
+            # Simulated goniometer, cameras, galvo controllers and laser GPIO instead of the device
+            self.rig = SimulatedRig(speedup=self.simulation_speedup).start()
+            (self.host_x, self.port_x), (self.host_y, self.port_y) = [galvo.address for galvo in self.rig.galvos]
+        return self.rig
 
     def _connect_sockets(self):
-        self.socket_x = SocketConnection(self.host_x, self.port)
-        self.socket_y = SocketConnection(self.host_y, self.port)
+        from Socket_connection import SocketConnection
+
+        self.socket_x = SocketConnection(self.host_x, self.port_x)
+        self.socket_y = SocketConnection(self.host_y, self.port_y)
 
         try:
             self.socket_x.connect()
@@ -43,67 +82,242 @@ class Runner:
         except socket.error as e:
             print(f"Error connecting to socket: {e}")
 
+    def _build_pipeline(self):
+        calibration = ['data/calibration_data.pkl', 'data/centroids_data.pkl']
+        if self.calibration_mapping != 'linear':
+            calibration += ['data/calibration_lut.npy', 'data/calibration_lut.json']
+
+        model = ['data/coordinates.npy', 'data/center.npy']
+
+        frames = [self.frame_stack] if self.frame_stack else []
+        if self.save_frames or not (self.streaming or self.frame_stack):
+            frames += [f'images/reconstruction/angle_{i}.jpg' for i in range(360)]
+        # A streamed model is saved by the tomography itself
+        tomography_outputs = frames + model if self.streaming else frames
+
+        self.pipeline = Pipeline()
+        self.pipeline.add_stage('calibrate', self._calibrate, outputs=calibration, hardware=True,
+                                params={'search_strategy': self.search_strategy, 'search_budget': self.search_budget,
+                                        'search_tolerance': self.search_tolerance, 'goniometer_search': self.goniometer_search,
+                                        'calibration_mapping': self.calibration_mapping})
+        self.pipeline.add_stage('wait-user', self._wait_user, hardware=True)
+        self.pipeline.add_stage('tomography', self._execute_tomography, outputs=tomography_outputs, hardware=True, checkpointed=True,
+                                params={'fly_scan': self.fly_scan, 'fly_speed': self.fly_speed, 'streaming': self.streaming,
+                                        'frame_stack': self.frame_stack})
+        self.pipeline.add_stage('generate-model', self._generate_model, inputs=frames, outputs=model,
+                                params={'reconstruction': self.reconstruction, 'voxel_resolution': self.voxel_resolution})
+        self.pipeline.add_stage('plan-burn', self._plan_burn, inputs=model, outputs=[self.burn_plan_file],
+                                params={'angle_per_step': self.angle_per_step, 'path_strategy': self.path_strategy})
+        self.pipeline.add_stage('burn-tumour', self._burn_tumour, inputs=calibration + [self.burn_plan_file], hardware=True,
+                                checkpointed=True, params={'stream_batch': self.stream_batch,
+                                                           'point_rate': self.point_rate, 'point_dwell': self.point_dwell,
+                                                           'pulse_settle': self.pulse_settle})
+
     def _instantiate_painter(self):
-        self.painter = LaserPainter(self.socket_x, self.socket_y, self.cal_x, self.cal_y, self.mcp)  
+        if self.painter is not None:
+            return self.painter
+
+        from Painter import LaserPainter
+        from Mcp import Mcp
+
+        rig = self._start_rig()
+        self.mcp = rig.mcp if rig else Mcp()
+        self._connect_sockets()
+
+        self.painter = LaserPainter(self.socket_x, self.socket_y, self.cal_x, self.cal_y, self.mcp,
+                                    stream_batch=self.stream_batch, point_rate=self.point_rate,
+                                    path_strategy=self.path_strategy, search_strategy=self.search_strategy,
+                                    search_budget=self.search_budget, search_tolerance=self.search_tolerance,
+                                    calibration_mapping=self.calibration_mapping, diagnostics=self.diagnostics,
+                                    point_dwell=self.point_dwell, pulse_settle=self.pulse_settle)
+        return self.painter
 
     def _calibrate(self, manual=True):
-        self.painter.calibration_routine(manual=manual)
+        painter = self._instantiate_painter()
+        if self.rig:
+            self.rig.mount('plate')
+        painter.calibration_routine(manual=manual, goniometer_method=self.goniometer_search)
+
+    def _execute_tomography(self, checkpoint):
+        from Goniometer import GoniometerController
+
+        self._start_rig()
+
+        reconstructor = None
+        if self.streaming:
+            from Model_generator import StreamingReconstructor
+            reconstructor = StreamingReconstructor(reconstruction=self.reconstruction, voxel_resolution=self.voxel_resolution)
 
-    def _execute_tomography(self):
+        stack_writer = None
+        if self.frame_stack:
+            from Frame_stack import FrameStackWriter
+            stack_writer = FrameStackWriter(self.frame_stack, 360, camera_index=0)
+
+        if reconstructor or stack_writer:
+            # The reconstructor and the frame stack only hold the frames of this run, so start over
+            checkpoint.clear()
+
+        sinks = []
+        if reconstructor:
+            sinks.append(lambda index, frame, timestamp: reconstructor.submit(index, frame))
+        if stack_writer:
+            sinks.append(lambda index, frame, timestamp: stack_writer.write(index, frame, timestamp=timestamp))
+
+        def on_frame(index, frame, timestamp):
+            for sink in sinks:
+                sink(index, frame, timestamp)
 
         with GoniometerController() as controller:
             controller.connect()
-            controller.perform_tomography()
+            controller.perform_tomography(fly_scan=self.fly_scan, degrees_per_second=self.fly_speed,
+                                          on_frame=on_frame if sinks else None,
+                                          save_frames=self.save_frames or not (self.streaming or self.frame_stack),
+                                          checkpoint=checkpoint)
             controller.disconnect()
 
+        if stack_writer:
+            stack_writer.close()
+
+        if reconstructor:
+            self.streamed_model = reconstructor.finish()
+            self.streamed_model.save_coordinates()
+
     def _generate_model(self):
-        
-        img_index = [i for i in range(180)]
-        image_folder = "images/reconstruction"
-        images = [f'{image_folder}/angle_{i}.jpg' for i in img_index]
+        from Model_generator import SilhouetteTo3D, silhouettes_from_stack
+        from Frame_stack import FrameStack
+        from Image_processor import ImageProcessor
 
-        processor = ImageProcessor(None)  # Initialize ImageProcessor with None image
+        if self.streamed_model is not None:
+            # The model was already built while the tomography frames arrived
+            s23 = self.streamed_model
+            if self.reconstruction != 'carving':
+                s23.plot_shell()
+            s23.save_coordinates()
+            return
 
-        # Find contours for each image and get the contour with maximum area
-        contours = [processor.find_tumour(image)[1] for image in images]
+        thetas = None
+        if self.frame_stack:
+            # Read the frames straight from the stack file instead of decoding JPEGs
+            stack = FrameStack(self.frame_stack)
+            if self.reconstruction == 'carving':
+                contours, thetas, masks = silhouettes_from_stack(stack, 180, workers=self.workers, with_masks=True)
+            else:
+                contours, thetas = silhouettes_from_stack(stack, 180, workers=self.workers)
+        else:
+            img_index = [i for i in range(180)]
+            image_folder = "images/reconstruction"
+            images = [f'{image_folder}/angle_{i}.jpg' for i in img_index]
+
+            processor = ImageProcessor(None)  # Initialize ImageProcessor with None image
+
+            # Find contours for each image and get the contour with maximum area
+            if self.reconstruction == 'carving':
+                contours, masks = processor.find_tumours(images, workers=self.workers, with_masks=True)
+            else:
+                contours = processor.find_tumours(images, workers=self.workers)
 
         # SilhouetteTo3D -> s-two-3d -> s23
         s23 = SilhouetteTo3D() 
 
-        for i,contour in enumerate(contours):
-            s23.add_silhouette(contour, i)
-    
-        s23.convert_coordinates()
-        s23.generate_solid()
-        s23.plot_shell()
+        s23.add_silhouettes(contours, thetas)
+
+        if self.reconstruction == 'carving':
+            s23.carve_visual_hull(masks, thetas, resolution=self.voxel_resolution)
+        else:
+            s23.convert_coordinates()
+            s23.generate_solid()
+            s23.plot_shell()
 
         s23.save_coordinates()
 
-    def _burn_tumour(self):
-        self.painter.load_calibration_data()
-        self.painter.burn_tumour()
+    def _plan_burn(self):
+        from Tumour import Tumour
+
+        plan = Tumour.from_files().burn_plan(self.angle_per_step, self.path_strategy)
+        with open(self.burn_plan_file, 'wb') as file:
+            pickle.dump(plan, file)
+
+    def _burn_tumour(self, checkpoint):
+        with open(self.burn_plan_file, 'rb') as file:
+            plan = pickle.load(file)
+        painter = self._instantiate_painter()
+        painter.load_calibration_data()
+        painter.burn_tumour(angle_per_step=self.angle_per_step, plan=plan, checkpoint=checkpoint)
 
     def _wait_user(self):
         input("Remove calibration plaque, add tumour and press enter \n")
+        if self._start_rig():
+            self.rig.mount('phantom')
 
-    def execute(self, func):
-        self.functions_chain.execute_functions_from(func)
+    def execute(self, stage=None, resume=False):
+        self.pipeline.run(stage, resume)
 
-if __name__=="__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 Run.py <argument>")
-        sys.exit(1)
+    def report(self):
+        from Diagnostics import render_archive
 
-    # Access the argument provided
-    argument = sys.argv[1]
+        for archive in ['data/diagnostics/calibration.npz', 'data/diagnostics/burn.npz']:
+            if os.path.exists(archive):
+                print(f"Rendered {render_archive(archive, self.workers)} plots from {archive}")
 
-    correspondance = {'calibrate':'_calibrate', 'tomography':'_execute_tomography', 'generate-model':'_generate_model', 'burn-tumour':'_burn_tumour'}
+def import_report(budget=None):
+    """
+    Measures the import time of the CLI and of each stage, each in a fresh interpreter.
 
-    if argument not in correspondance:
-        print("Invalid argument, choose from 'calibrate', 'tomography', 'generate-model', 'burn_tumour'")
-        sys.exit(1)
+    Args:
+        budget (float, optional): Maximum import time of a stage, in milliseconds.
 
-    runner = Runner()
-    runner.execute(correspondance[argument])
+    Returns:
+        bool: True if every stage imports within the budget.
+    """
+    child = ("import time\n"
+             "start = time.perf_counter()\n"
+             "import Run\n"
+             "{imports}\n"
+             "print((time.perf_counter() - start) * 1000)")
+
+    within_budget = True
+    print(f"{'stage':<16} {'import ms':>10}  heaviest modules (cumulative ms)")
+    for stage in ['cli'] + list(STAGE_IMPORTS):
+        imports = '\n'.join(f"import {name}" for name in STAGE_IMPORTS.get(stage, []))
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', child.format(imports=imports)],
+                                capture_output=True, text=True, check=True)
+        elapsed = float(result.stdout.split()[-1])
+
+        # Top-level entries of -X importtime: "import time: self | cumulative | name"
+        modules = []
+        for line in result.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[1].strip().isdigit() and not fields[2].startswith('  '):
+                modules.append((int(fields[1]) / 1000, fields[2].strip()))
+        heaviest = ', '.join(f"{name} {ms:.0f}" for ms, name in sorted(modules, reverse=True)[:4])
 
+        over = budget is not None and elapsed > budget
+        within_budget = within_budget and not over
+        print(f"{stage:<16} {elapsed:>10.0f}  {heaviest}{'  OVER BUDGET' if over else ''}")
+    return within_budget
 
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Run the device pipeline from a stage onwards.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('calibrate', help="start from the calibration")
+    commands.add_parser('tomography', help="start from the tomographic imaging")
+    commands.add_parser('generate-model', help="start from the model generation")
+    commands.add_parser('plan-burn', help="start from the burn plan")
+    commands.add_parser('burn-tumour', help="execute only the tumour irradiation")
+    commands.add_parser('resume', help="continue the last run, skipping the stages that are up to date")
+    commands.add_parser('report', help="render the slice and green map plots recorded during the last runs")
+    imports = commands.add_parser('imports', help="report the import time of the CLI and of each stage")
+    imports.add_argument('--budget', type=float, help="exit with status 1 if a stage takes longer to import, in ms")
+    args = parser.parse_args()
+
+    if args.command == 'imports':
+        sys.exit(0 if import_report(args.budget) else 1)
+
+    runner = Runner()
+    if args.command == 'report':
+        runner.report()
+    elif args.command == 'resume':
+        # Skip the stages that are up to date and continue an interrupted tomography or burn
+        runner.execute(resume=True)
+    else:
+        runner.execute(args.command)
@@ -0,0 +1,304 @@
+import numpy as np
+
+STRATEGIES = ('raster', 'coarse_to_fine', 'hill_climb', 'nelder_mead')
+
+GOLDEN_RATIO = (np.sqrt(5) - 1) / 2
+
+class BudgetExhausted(Exception):
+    """Raised by a probe when the evaluation budget is used up."""
+
+
+class _Probe:
+    """
+    Budgeted, memoized evaluation of a 2D response in normalized units around a center.
+
+    A point (u, v) is evaluated at (center_x + u * scale_x, center_y + v * scale_y). Points already
+    evaluated are answered from the cache, so revisiting them does not cost a capture.
+
+    Attributes:
+        samples (list): Every evaluation as [x, y, value], in order.
+        best_point (tuple): Normalized coordinates of the highest value so far.
+        best_value (float): Highest value so far.
+    """
+
+    def __init__(self, evaluate, center, scale, budget):
+        self.evaluate = evaluate
+        self.center = np.asarray(center, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.budget = budget
+        self.samples = []
+        self.best_point = (0.0, 0.0)
+        self.best_value = -np.inf
+        self._cache = {}
+
+    def __call__(self, point):
+        key = (round(float(point[0]), 9), round(float(point[1]), 9))
+        if key in self._cache:
+            return self._cache[key]
+        if len(self._cache) >= self.budget:
+            raise BudgetExhausted()
+
+        x, y = self.center + np.asarray(key) * self.scale
+        value = float(self.evaluate(x, y))
+
+        self._cache[key] = value
+        self.samples.append([x, y, value])
+        if value > self.best_value:
+            self.best_value = value
+            self.best_point = key
+        return value
+
+    def position(self, point):
+        """Converts normalized coordinates back to (x, y)."""
+        x, y = self.center + np.asarray(point, dtype=np.float64) * self.scale
+        return float(x), float(y)
+
+
+def _coarse_grid(probe, half_span, points):
+    """
+    Samples a uniform points x points grid over the search window.
+
+    Args:
+        probe (_Probe): The response.
+        half_span (float): Half the width of the window, in normalized units.
+        points (int): Samples per axis.
+
+    Returns:
+        float: The grid spacing.
+    """
+    axis = np.linspace(-half_span, half_span, points)
+    for v in axis:
+        for u in axis:
+            probe((u, v))
+    return axis[1] - axis[0] if points > 1 else half_span
+
+def _zoom(probe, step, tolerance, plateau_tolerance):
+    """
+    Local refinement by repeatedly sampling a 3x3 grid around the best point and halving its spacing.
+
+    Args:
+        probe (_Probe): The response.
+        step (float): Initial spacing.
+        tolerance (float): Stops once the spacing is below this.
+        plateau_tolerance (float): Stops once the whole grid lies on the plateau of maximum response.
+    """
+    while step >= tolerance:
+        u, v = probe.best_point
+        values = [probe((u + du, v + dv)) for dv in (-step, 0, step) for du in (-step, 0, step)]
+        if min(values) >= probe.best_value - plateau_tolerance:
+            break
+        step /= 2
+
+def _hill_climb(probe, step, tolerance, plateau_tolerance):
+    """
+    Compass search: moves to the best of the 4 neighbours while it improves, else halves the step.
+
+    Args:
+        probe (_Probe): The response.
+        step (float): Initial step.
+        tolerance (float): Stops once the step is below this.
+        plateau_tolerance (float): Stops once all 4 neighbours lie on the plateau of maximum response.
+    """
+    while step >= tolerance:
+        u, v = probe.best_point
+        values = [probe((u + du, v + dv)) for du, dv in ((step, 0), (-step, 0), (0, step), (0, -step))]
+        if min(values) >= probe.best_value - plateau_tolerance:
+            break
+        if probe.best_point == (u, v):
+            step /= 2
+
+def _nelder_mead(probe, step, tolerance, plateau_tolerance):
+    """
+    Nelder-Mead simplex search for the maximum, started from a simplex of size `step` at the best point.
+
+    Args:
+        probe (_Probe): The response.
+        step (float): Initial simplex size.
+        tolerance (float): Stops once every vertex is within this of the best one.
+        plateau_tolerance (float): Stops once every vertex lies on the plateau of maximum response.
+    """
+    origin = np.array(probe.best_point)
+    simplex = [origin, origin + (step, 0), origin + (0, step)]
+    values = [probe(p) for p in simplex]
+
+    while True:
+        order = np.argsort(values)[::-1]
+        simplex = [simplex[k] for k in order]
+        values = [values[k] for k in order]
+
+        if max(np.linalg.norm(p - simplex[0]) for p in simplex[1:]) < tolerance:
+            break
+        if values[-1] >= probe.best_value - plateau_tolerance:
+            break
+
+        centroid = (simplex[0] + simplex[1]) / 2
+        reflected = centroid + (centroid - simplex[2])
+        reflected_value = probe(reflected)
+
+        if reflected_value > values[0]:
+            expanded = centroid + 2 * (centroid - simplex[2])
+            expanded_value = probe(expanded)
+            if expanded_value > reflected_value:
+                simplex[2], values[2] = expanded, expanded_value
+            else:
+                simplex[2], values[2] = reflected, reflected_value
+        elif reflected_value > values[1]:
+            simplex[2], values[2] = reflected, reflected_value
+        else:
+            contracted = centroid + 0.5 * (simplex[2] - centroid)
+            contracted_value = probe(contracted)
+            if contracted_value > values[2]:
+                simplex[2], values[2] = contracted, contracted_value
+            else:
+                # Shrink towards the best vertex
+                simplex = [simplex[0]] + [simplex[0] + 0.5 * (p - simplex[0]) for p in simplex[1:]]
+                values = [values[0]] + [probe(p) for p in simplex[1:]]
+
+def _plateau_centre(probe, reach, tolerance, plateau_tolerance):
+    """
+    Centre of the plateau of maximum response around the best point.
+
+    The brightness saturates while the spot lies inside the region, so the maximum is a plateau
+    rather than a peak. Its edge is bisected in the 4 axis directions and the midpoint returned.
+    If the budget runs out, the edges bracketed so far are used and an axis whose edges were
+    not both reached keeps the best point's coordinate.
+
+    Args:
+        probe (_Probe): The response.
+        reach (float): How far to look for the edge, in normalized units.
+        tolerance (float): Precision of the edges.
+        plateau_tolerance (float): Values within this of the maximum belong to the plateau.
+
+    Returns:
+        tuple: Normalized coordinates of the plateau centre.
+    """
+    origin = np.array(probe.best_point)
+    directions = ((1, 0), (-1, 0), (0, 1), (0, -1))
+    brackets = [None] * 4
+
+    def on_plateau(direction, distance):
+        return probe(origin + distance * np.asarray(direction)) >= probe.best_value - plateau_tolerance
+
+    try:
+        # A sharp peak is settled with one sample per direction; only a plateau is bisected
+        for k, direction in enumerate(directions):
+            brackets[k] = [0.0, tolerance] if not on_plateau(direction, tolerance) else [tolerance, reach]
+        for k, direction in enumerate(directions):
+            if brackets[k][0] > 0 and on_plateau(direction, reach):
+                brackets[k] = [reach, reach]
+        # Bisect the edges in turn so that running out of budget leaves them equally precise;
+        # brackets of 2 * tolerance put the centre within tolerance
+        while True:
+            open_edges = [k for k in range(4) if brackets[k][1] - brackets[k][0] > 2 * tolerance]
+            if not open_edges:
+                break
+            for k in open_edges:
+                middle = sum(brackets[k]) / 2
+                brackets[k][0 if on_plateau(directions[k], middle) else 1] = middle
+    except BudgetExhausted:
+        pass
+
+    centre = origin.copy()
+    for axis in range(2):
+        forward, backward = brackets[2 * axis], brackets[2 * axis + 1]
+        if forward is not None and backward is not None:
+            centre[axis] += (sum(forward) - sum(backward)) / 4
+    return tuple(centre)
+
+REFINEMENTS = {
+    'coarse_to_fine': _zoom,
+    'hill_climb': _hill_climb,
+    'nelder_mead': _nelder_mead,
+}
+
+def search(evaluate, center, scale=(1, 1), strategy='coarse_to_fine', span=15, budget=40, tolerance=0.5,
+           coarse_points=4, plateau_tolerance=0):
+    """
+    Finds the position of maximum response (the centre of its plateau) with a bounded number of evaluations.
+
+    A coarse grid over the whole window locates the bright region, the chosen strategy refines the
+    maximum and the plateau edges are bisected to centre the result. If the budget runs out, the
+    best estimate so far is returned.
+
+    Args:
+        evaluate (callable): evaluate(x, y) -> response, e.g. a galvo move plus a brightness capture.
+        center (tuple): Center of the search window.
+        scale (tuple, optional): Size of one normalized unit along x and y, e.g. the calibration factors. Defaults to (1, 1).
+        strategy (str, optional): 'coarse_to_fine', 'hill_climb' or 'nelder_mead'. Defaults to 'coarse_to_fine'.
+        span (float, optional): Width of the search window in normalized units. Defaults to 15.
+        budget (int, optional): Maximum number of evaluations. Defaults to 40.
+        tolerance (float, optional): Convergence tolerance in normalized units. Defaults to 0.5.
+        coarse_points (int, optional): Samples per axis of the coarse grid. Defaults to 4.
+        plateau_tolerance (float, optional): Values within this of the maximum belong to the plateau. Defaults to 0.
+
+    Returns:
+        tuple: (x, y) of the maximum, the maximum value, and every sample as [x, y, value].
+    """
+    if strategy not in REFINEMENTS:
+        raise ValueError(f"Unknown search strategy '{strategy}', choose from {', '.join(REFINEMENTS)}")
+
+    probe = _Probe(evaluate, center, scale, budget)
+    point = None
+
+    spacing = span / max(coarse_points - 1, 1)
+    # Keep enough evaluations to at least bracket the 4 plateau edges after the refinement
+    reserve = 8
+
+    try:
+        _coarse_grid(probe, span / 2, coarse_points)
+        probe.budget = max(budget - reserve, 0)
+        REFINEMENTS[strategy](probe, spacing / 2, tolerance, plateau_tolerance)
+    except BudgetExhausted:
+        pass
+
+    try:
+        probe.budget = budget
+        point = _plateau_centre(probe, spacing, tolerance, plateau_tolerance)
+    except BudgetExhausted:
+        pass
+
+    if point is None:
+        point = probe.best_point
+
+    return probe.position(point), probe.best_value, probe.samples
+
+def golden_section_maximum(evaluate, lower, upper, tolerance=0.1, max_evaluations=15):
+    """
+    Maximum of a unimodal function of one variable by golden-section search.
+
+    Args:
+        evaluate (callable): evaluate(x) -> response, e.g. a goniometer move plus a contour area.
+        lower (float): Lower end of the bracket.
+        upper (float): Upper end of the bracket.
+        tolerance (float, optional): Stops once the bracket is narrower than this. Defaults to 0.1.
+        max_evaluations (int, optional): Maximum number of evaluations. Defaults to 15.
+
+    Returns:
+        tuple: The best x, its value, and every sample as [x, value].
+    """
+    samples = []
+
+    def probe(x):
+        value = float(evaluate(x))
+        samples.append([x, value])
+        return value
+
+    a, b = lower, upper
+    c = b - GOLDEN_RATIO * (b - a)
+    d = a + GOLDEN_RATIO * (b - a)
+    fc, fd = probe(c), probe(d)
+
+    while b - a > tolerance and len(samples) < max_evaluations:
+        if fc >= fd:
+            # The maximum lies in [a, d]
+            b, d, fd = d, c, fc
+            c = b - GOLDEN_RATIO * (b - a)
+            fc = probe(c)
+        else:
+            # The maximum lies in [c, b]
+            a, c, fc = c, d, fd
+            d = a + GOLDEN_RATIO * (b - a)
+            fd = probe(d)
+
+    best_x, best_value = max(samples, key=lambda sample: sample[1])
+    return best_x, best_value, samples
@@ -0,0 +1,525 @@
+import time
+import socket
+import threading
+from collections import deque
+import cv2
+import numpy as np
+import Camera
+import Goniometer
+
+LASER_CAMERA = 2
+
+# Fiducial holes of the calibration plate, as seen by the cameras (same layout as data/centroids_data.pkl)
+FIDUCIALS = ((188, 115), (343, 118), (499, 124),
+             (185, 225), (340, 230), (496, 235),
+             (182, 335), (336, 341), (491, 346))
+
+class SimulatedStage:
+    """
+    Motion controller of the goniometer axis, answering the commands GoniometerController sends.
+
+    Every command is acknowledged with one ':' line, and MG queries are followed by a line with
+    their values, separated by spaces.
+    Moves follow a trapezoidal profile (triangular when too short to reach the speed), so the
+    stage reports itself moving for as long as the real axis would, scaled by the rig speedup.
+
+    Attributes:
+        STEPS_PER_DEGREE (int): Steps per degree, as in GoniometerController.
+        commands (int): Number of commands received.
+    """
+
+    STEPS_PER_DEGREE = Goniometer.GoniometerController.STEPS_PER_DEGREE
+
+    def __init__(self, clock, speed=60000, acc=256000, dec=256000):
+        """
+        Starts the axis at rest at position 0.
+
+        Args:
+            clock (callable): Simulated time in seconds.
+            speed (int): Default speed in steps per second. Defaults to 60000.
+            acc (int): Default acceleration in steps per second squared. Defaults to 256000.
+            dec (int): Default deceleration in steps per second squared. Defaults to 256000.
+        """
+        self.clock = clock
+        self.settings = {'PRH': 0, 'PAH': None, 'SPH': speed, 'ACH': acc, 'DCH': dec, 'JGH': None}
+        self.commands = 0
+        self._lock = threading.Lock()
+        # Phases of the current motion as (start time, start position, start velocity, acceleration, duration)
+        self._phases = [(0.0, 0.0, 0.0, 0.0, 0.0)]
+
+    def state(self, now=None):
+        """
+        Position and velocity of the axis.
+
+        Args:
+            now (float, optional): Simulated time. Defaults to the current time.
+
+        Returns:
+            tuple: Position in steps, velocity in steps per second and whether the axis is moving.
+        """
+        now = self.clock() if now is None else now
+        for start, position, velocity, acceleration, duration in self._phases:
+            elapsed = now - start
+            if elapsed < duration:
+                return position + velocity * elapsed + 0.5 * acceleration * elapsed ** 2, velocity + acceleration * elapsed, True
+        start, position, velocity, acceleration, duration = self._phases[-1]
+        return position + velocity * duration + 0.5 * acceleration * duration ** 2, 0.0, False
+
+    def angle(self):
+        """
+        Returns:
+            float: Current angle of the stage in degrees.
+        """
+        return self.state()[0] / self.STEPS_PER_DEGREE
+
+    def command(self, line):
+        """
+        Executes one command.
+
+        Args:
+            line (str): The command, without line terminator.
+
+        Returns:
+            list: The reply lines.
+        """
+        line = line.strip()
+        with self._lock:
+            self.commands += 1
+            now = self.clock()
+            position, velocity, moving = self.state(now)
+
+            if line.startswith('MG'):
+                values = {'_BGH': int(moving), '_TPH': round(position), '_ACH': self.settings['ACH'], '_DCH': self.settings['DCH']}
+                operands = [operand.strip() for operand in line[2:].split(',')]
+                if not all(operand in values for operand in operands):
+                    return ['?']
+                return [':', ' '.join(f'{values[operand]}.0000' for operand in operands)]
+
+            name, _, value = line.partition('=')
+            name = name.strip()
+            if name in self.settings and value:
+                self.settings[name] = int(float(value))
+                # The last of PRH, PAH and JGH set decides the next move
+                if name == 'PRH':
+                    self.settings['PAH'] = self.settings['JGH'] = None
+                elif name == 'PAH':
+                    self.settings['JGH'] = None
+                elif name == 'JGH':
+                    self.settings['PAH'] = None
+            elif name == 'BGH' and not moving:
+                if self.settings['JGH'] is not None:
+                    self._phases = self._jog(now, position, self.settings['JGH'])
+                elif self.settings['PAH'] is not None:
+                    self._phases = self._move(now, position, self.settings['PAH'] - position)
+                else:
+                    self._phases = self._move(now, position, self.settings['PRH'])
+            elif name == 'STH' and moving:
+                self._phases = self._stop(now, position, velocity)
+            return [':']
+
+    def _move(self, now, position, distance):
+        """Trapezoidal phases of a relative move."""
+        speed, acc, dec = self.settings['SPH'], self.settings['ACH'], self.settings['DCH']
+        sign = 1 if distance >= 0 else -1
+        distance = abs(distance)
+
+        peak = min(speed, np.sqrt(2 * distance * acc * dec / (acc + dec)))
+        t_acc, t_dec = peak / acc, peak / dec
+        t_cruise = max(0.0, distance - peak ** 2 / (2 * acc) - peak ** 2 / (2 * dec)) / peak if peak > 0 else 0.0
+
+        phases = []
+        for acceleration, duration, velocity in ((acc, t_acc, 0.0), (0.0, t_cruise, peak), (-dec, t_dec, peak)):
+            phases.append((now, position, sign * velocity, sign * acceleration, duration))
+            position += sign * (velocity * duration + 0.5 * acceleration * duration ** 2)
+            now += duration
+        return phases
+
+    def _jog(self, now, position, speed):
+        """Phases of a jog, accelerating and then turning at constant speed until stopped."""
+        sign = 1 if speed >= 0 else -1
+        t_acc = abs(speed) / self.settings['ACH']
+        return [(now, position, 0.0, sign * self.settings['ACH'], t_acc),
+                (now + t_acc, position + 0.5 * speed * t_acc, speed, 0.0, np.inf)]
+
+    def _stop(self, now, position, velocity):
+        """Phases of a stop from the current velocity."""
+        sign = 1 if velocity >= 0 else -1
+        return [(now, position, velocity, -sign * self.settings['DCH'], abs(velocity) / self.settings['DCH'])]
+
+
+class SimulatedSerial:
+    """
+    Serial port onto a SimulatedStage, with the parts of serial.Serial that GoniometerController uses.
+
+    Reading with no reply pending returns b'', as a port with a timeout would.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.is_open = True
+        self._pending = b''
+        self._replies = deque()
+
+    def write(self, data):
+        self._pending += bytes(data)
+        *lines, self._pending = self._pending.split(b'\n')
+        for line in lines:
+            line = line.decode('utf-8').strip()
+            if line:
+                self._replies.extend(f'{reply}\r\n'.encode('utf-8') for reply in self.stage.command(line))
+        return len(data)
+
+    def readline(self):
+        return self._replies.popleft() if self._replies else b''
+
+    def close(self):
+        self.is_open = False
+
+
+class SimulatedCapture:
+    """
+    Camera device rendered from the rig, with the parts of cv2.VideoCapture that Camera uses.
+
+    Frames are paced at the rig frame rate, scaled by its speedup.
+    """
+
+    def __init__(self, rig, camera_number):
+        self.rig = rig
+        self.camera_number = camera_number
+        self._opened = camera_number in rig.cameras
+        self._next_frame = time.monotonic()
+
+    def isOpened(self):
+        return self._opened
+
+    def set(self, prop, value):
+        return self._opened
+
+    def read(self):
+        if not self._opened:
+            return False, None
+        delay = self._next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_frame = max(self._next_frame, time.monotonic()) + 1 / (self.rig.frame_rate * self.rig.speedup)
+        return True, self.rig.render(self.camera_number)
+
+    def release(self):
+        self._opened = False
+
+
+class SimulatedGalvo:
+    """
+    Local TCP stand-in for one galvo controller, applying the MWV commands it receives to the rig.
+
+    Attributes:
+        axis (int): 0 for X, 1 for Y.
+        address (tuple): Host and port the server listens on.
+        commands (int): Number of MWV commands received.
+    """
+
+    def __init__(self, rig, axis, host='127.0.0.1', port=0):
+        """
+        Starts listening on a background thread.
+
+        Args:
+            rig (SimulatedRig): The rig whose mirror this controller drives.
+            axis (int): 0 for X, 1 for Y.
+            host (str): Interface to listen on. Defaults to the loopback.
+            port (int): Port to listen on. Defaults to 0, any free port.
+        """
+        self.rig = rig
+        self.axis = axis
+        self.commands = 0
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen()
+        self.address = self._server.getsockname()
+        self._connections = []
+        self._thread = threading.Thread(target=self._accept_loop, name=f"galvo-{'xy'[axis]}", daemon=True)
+        self._thread.start()
+
+    def _accept_loop(self):
+        """Serves every connection until the server is closed."""
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                break
+            self._connections.append(connection)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        """Applies the commands of one connection."""
+        pending = b''
+        while True:
+            try:
+                data = connection.recv(65536)
+            except OSError:
+                break
+            if not data:
+                break
+            *lines, pending = (pending + data).split(b'\r\n')
+            for line in lines:
+                if line.startswith(b'MWV:'):
+                    self.rig.galvo[self.axis] = float(line[4:])
+                    self.commands += 1
+        connection.close()
+
+    def close(self):
+        """Stops listening and drops the connections."""
+        self._server.close()
+        for connection in self._connections:
+            connection.close()
+        self._thread.join(timeout=2.0)
+
+
+class SimulatedMcp:
+    """
+    MCP2210 stand-in recording the GPIO outputs, with the methods Mcp and LaserController use.
+
+    Attributes:
+        outputs (dict): Output value of every pin set so far.
+        toggles (int): Number of output writes.
+    """
+
+    def __init__(self):
+        self.outputs = {}
+        self.toggles = 0
+
+    def configure_spi_timing(self, **kwargs):
+        pass
+
+    def set_gpio_designation(self, pin, designation):
+        pass
+
+    def set_gpio_direction(self, pin, direction):
+        pass
+
+    def set_gpio_output_value(self, pin, value):
+        self.outputs[pin] = bool(value)
+        self.toggles += 1
+
+
+class SimulatedRig:
+    """
+    Simulated device: goniometer, cameras, galvo mirrors and laser sharing one state.
+
+    The stage carries either the calibration plate or the tumour phantom. Camera frames show the plate
+    fiducials, lit from behind, which narrow as the stage turns away from the plate orientation, plus
+    the laser spot on the laser camera; or the silhouette of a rotating two-lobed phantom on the light
+    panel. The laser spot position is an affine function of the galvo voltages, with some cross-axis
+    coupling, roughly matching the saved calibration data.
+
+    Fly scans pace their frames in real seconds, so they only see consistent angles at a speedup of 1.
+
+    Using the rig in a 'with' statement starts the galvo servers and installs the simulated camera and
+    serial port in Camera and Goniometer until the block exits.
+
+    Attributes:
+        speedup (float): Simulated seconds per real second, for stage motion and frame pacing.
+        frame_rate (float): Frames per second of the simulated cameras.
+        scene (str): 'plate' or 'phantom'.
+        galvo (numpy.ndarray): Current X and Y galvo voltages.
+        stage (SimulatedStage): The goniometer axis.
+        mcp (SimulatedMcp): The laser GPIO.
+        galvos (list): The X and Y SimulatedGalvo servers, while the rig is running.
+    """
+
+    SCENES = ('plate', 'phantom')
+
+    def __init__(self, speedup=1.0, frame_rate=30.0, scene='phantom', frame_shape=(480, 640), cameras=(0, LASER_CAMERA),
+                 plate_offset=1.2, plate_thickness=40.0, hole_radius=10,
+                 galvo_matrix=((-26.3, 0.5), (0.6, 34.4)), galvo_offset=(352.3, 315.4)):
+        """
+        Builds the rig.
+
+        Args:
+            speedup (float): Simulated seconds per real second. Defaults to 1.0 (real time).
+            frame_rate (float): Frames per second of the simulated cameras. Defaults to 30.
+            scene (str): Object initially on the stage, 'plate' or 'phantom'. Defaults to 'phantom'.
+            frame_shape (tuple): Height and width of the frames. Defaults to (480, 640).
+            cameras (tuple): Device indices that open. Defaults to 0 and the laser camera, 2.
+            plate_offset (float): Stage angle, in degrees, at which the plate holes line up with the cameras.
+            plate_thickness (float): Depth of the holes in pixels; thicker plates close them faster when turning.
+            hole_radius (int): Radius of the holes in pixels.
+            galvo_matrix (tuple): Pixels per volt of the laser spot, rows for x and y, columns for the X and Y voltages.
+            galvo_offset (tuple): Pixel position of the laser spot at 0 V.
+        """
+        if scene not in self.SCENES:
+            raise ValueError(f"Unknown scene '{scene}', choose from {', '.join(self.SCENES)}")
+
+        self.speedup = speedup
+        self.frame_rate = frame_rate
+        self.scene = scene
+        self.frame_shape = tuple(frame_shape)
+        self.cameras = tuple(cameras)
+        self.plate_offset = plate_offset
+        self.plate_thickness = plate_thickness
+        self.hole_radius = hole_radius
+        self.galvo_matrix = np.asarray(galvo_matrix, dtype=np.float64)
+        self.galvo_offset = np.asarray(galvo_offset, dtype=np.float64)
+
+        self.galvo = np.zeros(2)
+        self.stage = SimulatedStage(self.clock)
+        self.mcp = SimulatedMcp()
+        self.galvos = []
+        self._installed = None
+
+    def clock(self):
+        """
+        Returns:
+            float: Simulated time in seconds.
+        """
+        return time.monotonic() * self.speedup
+
+    def mount(self, scene):
+        """
+        Puts the calibration plate or the phantom on the stage.
+
+        Args:
+            scene (str): 'plate' or 'phantom'.
+        """
+        if scene not in self.SCENES:
+            raise ValueError(f"Unknown scene '{scene}', choose from {', '.join(self.SCENES)}")
+        self.scene = scene
+
+    @property
+    def laser_on(self):
+        """bool: Whether the laser GPIO is high."""
+        return self.mcp.outputs.get(0, False)
+
+    def spot(self):
+        """
+        Returns:
+            numpy.ndarray: Pixel position of the laser spot for the current galvo voltages.
+        """
+        return self.galvo_matrix @ self.galvo + self.galvo_offset
+
+    def render(self, camera_number, angle=None):
+        """
+        Renders what a camera sees.
+
+        Args:
+            camera_number (int): The device index.
+            angle (float, optional): Stage angle in degrees. Defaults to the current stage angle.
+
+        Returns:
+            numpy.ndarray: BGR frame.
+        """
+        angle = self.stage.angle() if angle is None else angle
+        if self.scene == 'plate':
+            frame = self._render_plate(angle)
+            if camera_number == LASER_CAMERA and self.laser_on:
+                self._draw_spot(frame, self.spot())
+        else:
+            frame = self._render_phantom(angle)
+        return frame
+
+    def _render_plate(self, angle):
+        """Dark plate with the fiducial holes, narrowed by the tilt of the plate."""
+        frame = np.full(self.frame_shape + (3,), 40, dtype=np.uint8)
+
+        # The fixture is drilled along two perpendicular axes, so the holes line up every quarter turn
+        tilt = np.radians((angle - self.plate_offset + 45) % 90 - 45)
+        half_width = self.hole_radius - 0.5 * self.plate_thickness * abs(np.tan(tilt))
+
+        if half_width > 0:
+            # Drawn with 4 fractional bits so the lit area changes smoothly with the angle
+            for x, y in FIDUCIALS:
+                cv2.ellipse(frame, (16 * x, 16 * y), (int(16 * half_width), 16 * self.hole_radius), 0, 0, 360, (160, 160, 160), -1,
+                            cv2.LINE_AA, 4)
+        return frame
+
+    def _render_phantom(self, angle, center=(315, 170)):
+        """Bright light panel with the silhouette of the phantom, a body and an off-axis lobe."""
+        frame = np.full(self.frame_shape + (3,), 220, dtype=np.uint8)
+        theta = np.radians(angle)
+
+        # Each lobe is an ellipsoid (x, y, z offset, semi-axes a, b along x and z, c vertical) turning about the vertical axis
+        for x, y, z, a, b, c in ((0, 0, 0, 60, 40, 55), (35, -10, -20, 25, 25, 30)):
+            shift = x * np.cos(theta) + z * np.sin(theta)
+            half_width = np.hypot(a * np.cos(theta), b * np.sin(theta))
+            cv2.ellipse(frame, (int(round(center[0] + shift)), center[1] + y), (int(round(half_width)), c), 0, 0, 360, (30, 30, 30), -1)
+        return frame
+
+    @staticmethod
+    def _draw_spot(frame, position, sigma=4.0, peak=255, scatter=0.15):
+        """
+        Adds the Gaussian green laser spot to the plate frame.
+
+        The beam shows at full strength through the lit holes and only scattered on the plate,
+        so the spot reads brightest when it is centred on a hole.
+        """
+        x, y = position
+        radius = int(3 * sigma)
+        top, left = int(round(y)) - radius, int(round(x)) - radius
+        height, width = frame.shape[:2]
+        if top + 2 * radius < 0 or left + 2 * radius < 0 or top >= height or left >= width:
+            return
+
+        ys, xs = np.mgrid[top:top + 2 * radius + 1, left:left + 2 * radius + 1]
+        spot = peak * np.exp(-((xs - x) ** 2 + (ys - y) ** 2) / (2 * sigma ** 2))
+
+        rows = slice(max(top, 0), min(top + 2 * radius + 1, height))
+        cols = slice(max(left, 0), min(left + 2 * radius + 1, width))
+        patch = spot[rows.start - top:rows.stop - top, cols.start - left:cols.stop - left]
+        green = frame[rows, cols, 1]
+        patch *= np.where(frame[rows, cols, 0] > 100, 1.0, scatter)
+        frame[rows, cols, 1] = np.minimum(green + patch, 255).astype(np.uint8)
+
+    def open_camera(self, camera_number):
+        """
+        Capture backend for Camera.
+
+        Args:
+            camera_number (int): The device index.
+
+        Returns:
+            SimulatedCapture: The simulated device.
+        """
+        return SimulatedCapture(self, camera_number)
+
+    def open_serial(self, port, baud_rate=115200):
+        """
+        Serial backend for Goniometer.
+
+        Args:
+            port (str): Ignored; every port reaches the simulated stage.
+            baud_rate (int): Ignored.
+
+        Returns:
+            SimulatedSerial: A port onto the stage.
+        """
+        return SimulatedSerial(self.stage)
+
+    def start(self):
+        """
+        Starts the galvo servers and installs the simulated camera and serial backends.
+
+        Returns:
+            SimulatedRig: The rig.
+        """
+        if not self.galvos:
+            self.galvos = [SimulatedGalvo(self, 0), SimulatedGalvo(self, 1)]
+        if self._installed is None:
+            self._installed = (Camera.capture_backend, Goniometer.serial_backend)
+            Camera.capture_backend = self.open_camera
+            Goniometer.serial_backend = self.open_serial
+        return self
+
+    def close(self):
+        """Stops the galvo servers and restores the hardware backends."""
+        for galvo in self.galvos:
+            galvo.close()
+        self.galvos = []
+        if self._installed is not None:
+            Camera.capture_backend, Goniometer.serial_backend = self._installed
+            self._installed = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
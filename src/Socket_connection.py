@@ -1,19 +1,33 @@
 import socket
+import Tracing
 
 class SocketConnection:
-    def __init__(self, host, port):
+    def __init__(self, host, port, nodelay=True):
         self.host = host
         self.port = port
+        self.nodelay = nodelay
         self.socket = None
 
     def connect(self):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.nodelay:
+            # Galvo commands are tiny; don't let Nagle hold them back waiting for ACKs
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.socket.connect((self.host, self.port))
 
     def send_data(self, data):
         message = bytes(data, 'utf-8')
+        if Tracing.enabled:
+            Tracing.count('socket bytes sent', len(message))
+            Tracing.count('socket commands sent', data.count('\n'))
         self.socket.sendall(message)
 
+    def send_bytes(self, buffer):
+        if Tracing.enabled:
+            Tracing.count('socket bytes sent', len(buffer))
+            Tracing.count('socket commands sent', bytes(buffer).count(b'\n'))
+        self.socket.sendall(buffer)
+
     def close(self):
         if self.socket:
             self.socket.close()
@@ -0,0 +1,267 @@
+import numpy as np
+
+STRATEGIES = ('raster', 'serpentine', 'nearest', 'contour')
+
+def path_length(points):
+    """
+    Total length of the path through the points, in the order given.
+
+    Args:
+        points (numpy.ndarray): Array of shape (n, 2).
+
+    Returns:
+        float: Sum of the segment lengths.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 2:
+        return 0.0
+    return float(np.linalg.norm(np.diff(points, axis=0), axis=1).sum())
+
+def serpentine_order(points, row_tolerance=0.5):
+    """
+    Raster order that alternates direction on every row, so the mirrors never fly back to the row start.
+
+    Args:
+        points (numpy.ndarray): Array of shape (n, 2) with x, y coordinates.
+        row_tolerance (float, optional): Points whose y differ by less than this share a row. Defaults to 0.5.
+
+    Returns:
+        numpy.ndarray: The points reordered.
+    """
+    points = np.asarray(points)
+    if len(points) < 2:
+        return points
+
+    rows = np.rint((points[:, 1] - points[:, 1].min()) / row_tolerance).astype(np.int64)
+    _, rows = np.unique(rows, return_inverse=True)
+
+    # Odd rows run right to left
+    direction = np.where(rows % 2 == 0, 1, -1)
+    order = np.lexsort((direction * points[:, 0], rows))
+    return points[order]
+
+def nearest_neighbour_order(points, two_opt=True, window=64, max_passes=3):
+    """
+    Greedy nearest-neighbour tour, optionally improved with 2-opt moves.
+
+    Args:
+        points (numpy.ndarray): Array of shape (n, 2) with x, y coordinates.
+        two_opt (bool, optional): Whether to refine the tour with 2-opt. Defaults to True.
+        window (int, optional): Longest tour segment a 2-opt move may reverse, which keeps its
+                                cost linear in the number of points. Defaults to 64.
+        max_passes (int, optional): Maximum number of 2-opt passes. Defaults to 3.
+
+    Returns:
+        numpy.ndarray: The points reordered.
+    """
+    points = np.asarray(points)
+    n = len(points)
+    if n < 3:
+        return points
+
+    # Start from the first point of the raster order, as the unoptimised path does
+    coordinates = points.astype(np.float64)
+    order = _chain(coordinates)
+
+    if two_opt:
+        order = _two_opt(coordinates, order, window, max_passes)
+
+    return points[order]
+
+def _lattice_spacing(coordinates):
+    """
+    Coarsest spacing between neighbouring points along either axis.
+
+    Rotated voxel slices are anisotropic (rows are far apart while x is densely interleaved
+    from several voxel layers), so contour rings must be at least as wide as the row spacing.
+
+    Args:
+        coordinates (numpy.ndarray): Array of shape (n, 2).
+
+    Returns:
+        float: The spacing.
+    """
+    spacing = 1e-9
+    for axis in range(2):
+        gaps = np.diff(np.unique(np.round(coordinates[:, axis], 6)))
+        if len(gaps):
+            spacing = max(spacing, float(np.median(gaps)))
+    return spacing
+
+def _chain(coordinates, start=0, neighbours=16):
+    """
+    Greedy nearest-neighbour visiting order.
+
+    The `neighbours` nearest points of every point are found in one k-d tree query, and each step
+    takes the closest of them not yet visited. Only when all of them are visited is a tree of the
+    points left queried; it is rebuilt once half of it has been visited, so its queries stay short.
+
+    Args:
+        coordinates (numpy.ndarray): Array of shape (n, 2).
+        start (int, optional): Index of the first point. Defaults to 0.
+        neighbours (int, optional): Neighbours asked for per step. Defaults to 16.
+
+    Returns:
+        numpy.ndarray: Visiting order.
+    """
+    from scipy.spatial import cKDTree
+
+    n = len(coordinates)
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+
+    tree = cKDTree(coordinates)
+    nearest = tree.query(coordinates, k=min(neighbours + 1, n))[1].reshape(n, -1)
+    members = np.arange(n)
+    visited_members = 0
+
+    current = start
+    for step in range(n):
+        order[step] = current
+        visited[current] = True
+        visited_members += 1
+        if step == n - 1:
+            break
+
+        candidates = nearest[current]
+        unvisited = candidates[~visited[candidates]]
+        if len(unvisited):
+            current = int(unvisited[0])
+            continue
+
+        if visited_members > len(members) // 2:
+            members = np.flatnonzero(~visited)
+            tree = cKDTree(coordinates[members])
+            visited_members = 0
+
+        k = min(neighbours, len(members))
+        while True:
+            _, found = tree.query(coordinates[current], k=k)
+            candidates = members[np.atleast_1d(found)]
+            unvisited = candidates[~visited[candidates]]
+            if len(unvisited) or k == len(members):
+                break
+            k = min(2 * k, len(members))
+        current = int(unvisited[0])
+
+    return order
+
+def _two_opt(coordinates, order, window, max_passes):
+    """
+    Improves an open tour with 2-opt segment reversals of at most `window` points.
+
+    The greedy tour is mostly made of short steps between lattice neighbours, so only its jumps,
+    edges longer than twice the median step, are tried for removal, and only by reversing a
+    nearby segment; this keeps each pass linear in the number of points.
+
+    Args:
+        coordinates (numpy.ndarray): Array of shape (n, 2).
+        order (numpy.ndarray): Initial visiting order.
+        window (int): Longest segment reversed.
+        max_passes (int): Maximum number of passes over the tour.
+
+    Returns:
+        numpy.ndarray: The improved visiting order.
+    """
+    n = len(order)
+    tour = coordinates[order]
+
+    for _ in range(max_passes):
+        improved = False
+        steps = np.hypot(*np.diff(tour, axis=0).T)
+        jumps = np.flatnonzero(steps[:n - 2] > 2 * np.median(steps))
+        for i in jumps:
+            end = min(n, i + 3 + window)
+            a, b = tour[i], tour[i + 1]
+            c = tour[i + 2:end]
+            d = tour[i + 3:end + 1]
+
+            # Reversing tour[i+1:j+1] replaces edges (a, b) and (c, d) with (a, c) and (b, d);
+            # for the last point there is no (c, d) edge since the tour is open
+            gain = np.hypot(*(a - b)) - np.hypot(*(c - a).T)
+            gain[:len(d)] += np.hypot(*(c[:len(d)] - d).T) - np.hypot(*(d - b).T)
+
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                j = i + 2 + best
+                order[i + 1:j + 1] = order[i + 1:j + 1][::-1]
+                tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+
+    return order
+
+def contour_order(points, spacing=None):
+    """
+    Contour-parallel order: the outline first, then successively inner rings.
+
+    The points are drawn on a grid with cells of the lattice spacing, and the distance of each
+    cell to the outside of the slice gives its ring, so every ring follows the slice outline
+    whatever its shape. Each ring is chained by nearest neighbour, starting from the point
+    closest to where the previous ring ended.
+
+    Args:
+        points (numpy.ndarray): Array of shape (n, 2) with x, y coordinates.
+        spacing (float, optional): Distance between rings. Defaults to the coarsest lattice spacing of the points.
+
+    Returns:
+        numpy.ndarray: The points reordered.
+    """
+    import cv2
+
+    points = np.asarray(points)
+    n = len(points)
+    if n < 3:
+        return points
+
+    coordinates = points.astype(np.float64)
+    if spacing is None:
+        spacing = _lattice_spacing(coordinates)
+
+    # One empty cell of margin, so the outline is at distance 1 from the outside
+    cells = np.rint((coordinates - coordinates.min(axis=0)) / spacing).astype(np.int64) + 1
+    mask = np.zeros((cells[:, 1].max() + 2, cells[:, 0].max() + 2), dtype=np.uint8)
+    mask[cells[:, 1], cells[:, 0]] = 1
+    distance = cv2.distanceTransform(mask, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    rings = np.floor(distance[cells[:, 1], cells[:, 0]]).astype(np.int64)
+
+    order = []
+    position = None
+    for ring in np.unique(rings):
+        members = np.flatnonzero(rings == ring)
+        start = 0
+        if position is not None:
+            start = int(np.argmin(np.sum((coordinates[members] - position) ** 2, axis=1)))
+        members = members[_chain(coordinates[members], start)]
+        order.append(members)
+        position = coordinates[members[-1]]
+
+    return points[np.concatenate(order)]
+
+def plan_path(points, strategy='raster'):
+    """
+    Orders the points of a slice for painting.
+
+    Args:
+        points (numpy.ndarray): Array of shape (n, 2) with x, y coordinates, in raster order.
+        strategy (str, optional): 'raster' (unchanged), 'serpentine', 'nearest' (nearest neighbour + 2-opt)
+                                  or 'contour'. Defaults to 'raster'.
+
+    Returns:
+        tuple: The reordered points and the total path length.
+    """
+    points = np.asarray(points)
+
+    if strategy == 'raster':
+        ordered = points
+    elif strategy == 'serpentine':
+        ordered = serpentine_order(points)
+    elif strategy == 'nearest':
+        ordered = nearest_neighbour_order(points)
+    elif strategy == 'contour':
+        ordered = contour_order(points)
+    else:
+        raise ValueError(f"Unknown path strategy '{strategy}', choose from {', '.join(STRATEGIES)}")
+
+    return ordered, path_length(ordered)
@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from contextlib import nullcontext
+
+# Chrome trace file written at exit, e.g. CNPEM_TRACE=trace.json (open it in chrome://tracing or Perfetto)
+TRACE_FILE = os.environ.get('CNPEM_TRACE')
+# Print a table of the spans and counters at exit
+TRACE_SUMMARY = os.environ.get('CNPEM_TRACE_SUMMARY', '').lower() not in ('', '0', 'false', 'no')
+
+enabled = bool(TRACE_FILE) or TRACE_SUMMARY
+
+_origin = time.perf_counter()
+_spans = []
+_counters = {}
+_lock = threading.Lock()
+_disabled_span = nullcontext()
+
+class _Span:
+    """Times a block and records it as a complete event."""
+
+    __slots__ = ('name', 'category', 'args', 'start')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        _spans.append((self.name, self.category, self.start, end - self.start, threading.get_ident(), self.args))
+
+
+def span(name, category='pipeline', **args):
+    """
+    Context manager recording the time spent in a block.
+
+    Args:
+        name (str): Name of the span, e.g. the stage.
+        category (str): Category of the span in the trace. Defaults to 'pipeline'.
+        args: Values attached to the span, e.g. the angle.
+
+    Returns:
+        A context manager; a shared no-op one when tracing is disabled.
+    """
+    if not enabled:
+        return _disabled_span
+    return _Span(name, category, args)
+
+def count(name, value=1):
+    """
+    Adds to a counter.
+
+    Args:
+        name (str): The counter.
+        value (int): Amount to add. Defaults to 1.
+    """
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def counters():
+    """
+    Returns:
+        dict: Current value of every counter.
+    """
+    with _lock:
+        return dict(_counters)
+
+def chrome_trace():
+    """
+    Builds the recorded spans and counters in the Chrome trace event format.
+
+    Returns:
+        dict: The trace, with one complete event per span and the final counter values.
+    """
+    pid = os.getpid()
+    events = [{
+        'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+        'ts': (start - _origin) * 1e6, 'dur': duration * 1e6, 'args': args,
+    } for name, category, start, duration, tid, args in list(_spans)]
+
+    end = (time.perf_counter() - _origin) * 1e6
+    events.extend({'name': name, 'ph': 'C', 'pid': pid, 'tid': 0, 'ts': end, 'args': {'value': value}}
+                  for name, value in counters().items())
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def summary():
+    """
+    Formats the recorded spans and counters as a table.
+
+    Returns:
+        str: One line per span name with its calls, total, mean and max milliseconds, then the counters.
+    """
+    totals = {}
+    for name, category, start, duration, tid, args in list(_spans):
+        calls, total, longest = totals.get(name, (0, 0.0, 0.0))
+        totals[name] = (calls + 1, total + duration, max(longest, duration))
+
+    lines = [f"{'span':<28} {'calls':>8} {'total ms':>12} {'mean ms':>10} {'max ms':>10}"]
+    for name, (calls, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{name:<28} {calls:>8} {total * 1000:>12.1f} {total * 1000 / calls:>10.2f} {longest * 1000:>10.2f}")
+
+    values = counters()
+    if values:
+        lines.append("")
+        lines.append(f"{'counter':<28} {'value':>8}")
+        lines.extend(f"{name:<28} {value:>8}" for name, value in sorted(values.items()))
+    return "\n".join(lines)
+
+def export(trace_file=None, print_summary=None):
+    """
+    Writes the Chrome trace and prints the summary, as configured by the environment.
+
+    Args:
+        trace_file (str, optional): Chrome trace destination. Defaults to CNPEM_TRACE.
+        print_summary (bool, optional): Whether to print the summary. Defaults to CNPEM_TRACE_SUMMARY.
+    """
+    trace_file = TRACE_FILE if trace_file is None else trace_file
+    print_summary = TRACE_SUMMARY if print_summary is None else print_summary
+
+    if trace_file:
+        with open(trace_file, 'w') as file:
+            json.dump(chrome_trace(), file)
+    if print_summary:
+        print(summary(), file=sys.stderr)
+
+if enabled:
+    atexit.register(export)
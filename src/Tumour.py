@@ -1,7 +1,11 @@
+import os
+import pickle
+import hashlib
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-from collections import defaultdict
+import Toolpath
+
+# Slice plans already computed in this process, keyed by (model hash, angle, num_slices, tolerance)
+_plan_cache = {}
 
 class Tumour:
     """
@@ -12,6 +16,7 @@ class Tumour:
         cx (float): The x-coordinate of the center of the tumour.
         cy (float): The y-coordinate of the center of the tumour.
         rotation (float): The rotation angle of the tumour around the y-axis.
+        original_coordinates (numpy.ndarray): The coordinates in the initial pose, before any rotation.
         T_origin (numpy.ndarray): Transformation matrix for translating to the origin.
         T_back (numpy.ndarray): Transformation matrix for translating back to the original position.
     """
@@ -36,8 +41,23 @@ class Tumour:
         self.T_origin = np.array([[1, 0, 0, -self.cx], [0,1,0, -self.cy], [0,0,1,0], [0,0,0,1]])
         self.T_back = np.array([[1, 0, 0, self.cx], [0,1,0, self.cy], [0,0,1,0], [0,0,0,1]])
 
-        for i,coord in enumerate(self.coordinates):
-            self.coordinates[i,1]  = 209 - self.coordinates[i,1]
+        self.coordinates[:, 1] = 209 - self.coordinates[:, 1]
+        self.original_coordinates = self.coordinates.copy()
+        self._model_hash = None
+
+    @classmethod
+    def from_files(cls, coordinates_file='data/coordinates.npy', center_file='data/center.npy'):
+        """
+        Load the tumour model saved by SilhouetteTo3D.save_coordinates.
+
+        Args:
+            coordinates_file (str, optional): File with the model vertices. Defaults to 'data/coordinates.npy'.
+            center_file (str, optional): File with the model center. Defaults to 'data/center.npy'.
+
+        Returns:
+            Tumour: The tumour in its initial pose.
+        """
+        return cls(np.load(coordinates_file), np.load(center_file))
 
     def rotate_tumour(self, theta):
         """
@@ -54,10 +74,110 @@ class Tumour:
         vertices_transformed = (transformation_matrix @ vertices_homogeneous.T).T
         self.coordinates = vertices_transformed[:, :3]
 
+    def model_hash(self):
+        """
+        Hash identifying the tumour model, computed from the initial pose and the center.
+
+        Returns:
+            str: Hex digest of the model.
+        """
+        if self._model_hash is None:
+            digest = hashlib.sha1(np.ascontiguousarray(self.original_coordinates, dtype=np.float64).tobytes())
+            digest.update(np.array([self.cx, self.cy], dtype=np.float64).tobytes())
+            self._model_hash = digest.hexdigest()
+        return self._model_hash
+
+    def rotated_coordinates(self, thetas):
+        """
+        Rotate the initial pose by several angles at once.
+
+        Every rotation is applied from the initial pose in a single batched matrix product,
+        so no float error accumulates between angles.
+
+        Args:
+            thetas (list): Angles of rotation around the y-axis, in degrees.
+
+        Returns:
+            numpy.ndarray: Array of shape (len(thetas), n, 3) with the rotated coordinates.
+        """
+        thetas = np.deg2rad(np.asarray(thetas, dtype=np.float64))
+        cos, sin = np.cos(thetas), np.sin(thetas)
+        zero, one = np.zeros_like(thetas), np.ones_like(thetas)
+
+        R_y = np.stack([np.stack([cos, zero, sin], axis=-1),
+                        np.stack([zero, one, zero], axis=-1),
+                        np.stack([-sin, zero, cos], axis=-1)], axis=1)
+
+        origin = np.array([self.cx, self.cy, 0], dtype=np.float64)
+        return np.einsum('kij,nj->kni', R_y, self.original_coordinates - origin) + origin
+
+    def slice_plan(self, thetas, num_slices=15, tolerance=20, cache_dir='data/slice_plans'):
+        """
+        Compute the slices of the tumour for every angle up front.
+
+        Each angle is rotated from the initial pose (see rotated_coordinates) and sliced with
+        generate_slices. Plans are cached by (model hash, angle, num_slices, tolerance) in memory
+        and, unless cache_dir is None, on disk so repeated runs on the same model reuse them.
+
+        Args:
+            thetas (list): Angles of rotation around the y-axis, in degrees.
+            num_slices (int, optional): Number of slices to generate. Defaults to 15.
+            tolerance (int, optional): Tolerance for considering a point in a slice. Defaults to 20.
+            cache_dir (str, optional): Directory of the on-disk plan cache. Defaults to 'data/slice_plans'.
+
+        Returns:
+            list: One slices dictionary, as returned by generate_slices, per angle.
+        """
+        keys = [(self.model_hash(), float(theta), num_slices, tolerance) for theta in thetas]
+
+        for key in keys:
+            if key not in _plan_cache and cache_dir is not None:
+                path = os.path.join(cache_dir, _plan_filename(key))
+                if os.path.exists(path):
+                    with open(path, 'rb') as file:
+                        _plan_cache[key] = pickle.load(file)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in _plan_cache]
+
+        if missing:
+            rotated = self.rotated_coordinates([key[1] for key in missing])
+            for key, coordinates in zip(missing, rotated):
+                _plan_cache[key] = _slice_points(coordinates, num_slices, tolerance)
+
+                if cache_dir is not None:
+                    if not os.path.exists(cache_dir):
+                        os.makedirs(cache_dir)
+                    with open(os.path.join(cache_dir, _plan_filename(key)), 'wb') as file:
+                        pickle.dump(_plan_cache[key], file)
+
+        return [_plan_cache[key] for key in keys]
+
+    def burn_plan(self, angle_per_step=36, path_strategy='raster'):
+        """
+        Compute the slices for every burn angle, one goniometer step of `angle_per_step` apart,
+        with the points of every slice already in painting order.
+
+        Args:
+            angle_per_step (float, optional): Rotation between burn angles, in degrees. Defaults to 36.
+            path_strategy (str, optional): Order of the points of a slice (see Toolpath.plan_path). Defaults to 'raster'.
+
+        Returns:
+            list: One slices dictionary per angle (see slice_plan), with the points reordered.
+        """
+        steps = int(360 / angle_per_step)
+
+        # Every angle is sliced and its paths ordered up front, so nothing is left to compute
+        # once the laser is on
+        plan = self.slice_plan([-i * angle_per_step for i in range(steps)])
+        return [{key: Toolpath.plan_path(value, path_strategy)[0] for key, value in slices.items()} for slices in plan]
+
     def sanity_plot(self):
         """
         Plot the tumour in 3D space.
         """
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d import Axes3D
+
         x = self.coordinates[:,0]
         y = self.coordinates[:,1]
         z = self.coordinates[:,2]
@@ -74,6 +194,9 @@ class Tumour:
         """
         Plot the slices of the tumour.
         """
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d import Axes3D
+
         transformed_list = self.generate_slices()
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
@@ -92,28 +215,72 @@ class Tumour:
         """
         Generate slices of the tumour.
 
+        Each point goes to the first of `num_slices` evenly spaced z planes that lies within
+        `tolerance` of it; points farther than `tolerance` from every plane are dropped.
+        The planes are assigned in a single vectorized pass with searchsorted.
+
         Args:
             num_slices (int, optional): Number of slices to generate. Defaults to 15.
             tolerance (int, optional): Tolerance for considering a point in a slice. Defaults to 20.
 
         Returns:
-            dict: A dictionary containing slices of the tumour.
+            dict: Maps each slice's z value, in ascending order, to a contiguous (n, 2) array of
+                  its x, y points sorted by (y, x).
         """
-        ordered_points = sorted(self.coordinates, key=lambda xyz: (xyz[2], xyz[1], xyz[0]))
-        min_z, max_z = ordered_points[0][2], ordered_points[-1][2]
-        slices = defaultdict(list)
-        z_list = np.linspace(min_z, max_z, num_slices)
+        return _slice_points(self.coordinates, num_slices, tolerance)
+
+def _slice_points(coordinates, num_slices, tolerance):
+    """
+    Slice a set of coordinates; see Tumour.generate_slices.
+
+    Args:
+        coordinates (numpy.ndarray): Array of shape (n, 3).
+        num_slices (int): Number of slices to generate.
+        tolerance (float): Tolerance for considering a point in a slice.
+
+    Returns:
+        dict: Maps each slice's z value to a contiguous (n, 2) array of its points.
+    """
+    if len(coordinates) == 0:
+        return {}
+
+    x, y, z = coordinates[:, 0], coordinates[:, 1], coordinates[:, 2]
+    z_list = np.linspace(z.min(), z.max(), num_slices)
+
+    # First plane at or above z - tolerance; the one below is checked too so that
+    # rounding in the subtraction cannot change which plane is the first within tolerance
+    index = np.searchsorted(z_list, z - tolerance, side='left')
+    below = np.clip(index - 1, 0, num_slices - 1)
+    index = np.where((index > 0) & (np.abs(z - z_list[below]) <= tolerance), below, index)
 
-        for point in ordered_points:
-            for z in z_list:
-                if abs(point[2] - z) <= tolerance:
-                    slices[z].append([point[0], point[1]])
-                    break
+    candidate = np.clip(index, 0, num_slices - 1)
+    valid = (index < num_slices) & (np.abs(z - z_list[candidate]) <= tolerance)
 
-        for z_value, xy_list in slices.items():
-            slices[z_value] = sorted(xy_list, key=lambda xy: (xy[1], xy[0]))
+    index = index[valid]
+    x, y, z = x[valid], y[valid], z[valid]
 
-        return slices
+    # Sort by slice, then (y, x), with z breaking ties as the original (z, y, x) ordering did
+    order = np.lexsort((z, x, y, index))
+    index = index[order]
+    points = np.column_stack((x[order], y[order]))
+
+    slice_ids, starts = np.unique(index, return_index=True)
+    ends = np.append(starts[1:], len(index))
+
+    return {z_list[k]: points[start:end] for k, start, end in zip(slice_ids, starts, ends)}
+
+def _plan_filename(key):
+    """
+    File name of a cached slice plan.
+
+    Args:
+        key (tuple): (model hash, angle, num_slices, tolerance).
+
+    Returns:
+        str: The file name.
+    """
+    model_hash, theta, num_slices, tolerance = key
+    return f"{model_hash}_{theta:g}_{num_slices}_{tolerance:g}.pkl"
 
 if __name__=="__main__":
 
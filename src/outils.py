@@ -1,7 +1,5 @@
 import numpy as np
 import cv2
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 
 def sort_centroids(centroids):
     # Sort centroids by y-coordinate
@@ -23,6 +21,7 @@ def show_wait_destroy(winname, img):
         # Convert color from BGR to RGB
         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     # Otherwise, it's a grayscale image and no conversion is needed
+    import matplotlib.pyplot as plt
 
     plt.imshow(img, cmap='gray' if len(img.shape) == 2 else None)
     plt.title(winname)